@@ -1,9 +1,22 @@
+"""
+OCCAMS Studies
+
+Startup matters for every process that loads this package: web workers,
+Celery workers and the ``os_*`` scripts. Keep imports of this package
+cheap, i.e. heavy dependencies that only a few code paths need are
+imported where they are used, and nothing scans the installed
+distributions (see "How do I check startup time?" in the README).
+"""
+
 from __future__ import unicode_literals
 import logging
-import pkg_resources
+
+try:
+    from importlib.metadata import version as distribution_version
+except ImportError:  # pragma: nocover (python < 3.8)
+    from importlib_metadata import version as distribution_version
 
 from pyramid.i18n import TranslationStringFactory
-import wtforms_json; wtforms_json.init()  # monkey-patch wtforms to accept JSON data
 
 from . import models
 
@@ -13,7 +26,7 @@ _ = TranslationStringFactory(__name__)
 
 __prefix__ = '/studies'
 __title__ = _(u'Studies')
-__version__ = pkg_resources.require(__name__)[0].version
+__version__ = distribution_version(__name__)
 
 
 def initdb(connectable):
@@ -32,6 +45,10 @@ def includeme(config):
 
     config.include('.assets')
     config.include('.exports')
+    config.include('.profiling')
+    config.include('.renderers')
+    config.include('.replica')
     config.include('.routes')
     config.include('.tasks')
-    config.scan()
+    # Only the views register anything with the scanner
+    config.scan('.views')
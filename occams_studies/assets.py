@@ -1,57 +1,132 @@
+"""
+Web assets
+
+In development, bundles are built on demand by webassets. For production,
+compile them ahead of time with ``os_assets`` (see
+``occams_studies.scripts.assets``), which writes content-hashed bundles
+along with precompressed siblings and a manifest of their versions to
+``static/gen``. If the manifest exists at startup, bundle URLs are taken
+from it, bundles are never built by the application, and the compiled
+files are served with year-long, immutable caching.
+"""
+
+from collections import OrderedDict
+import json
 import os
 
+from pyramid.static import static_view
 from webassets import Bundle
 
 from . import log
 
 
+HERE = os.path.dirname(os.path.realpath(__file__))
+
+#: Where compiled bundles are written
+GEN_DIR = os.path.join(HERE, 'static', 'gen')
+
+#: Versions of the compiled bundles, written by ``os_assets``
+MANIFEST = os.path.join(GEN_DIR, 'manifest.json')
+
+#: How long browsers may keep compiled bundles (in seconds)
+GEN_MAX_AGE = 365 * 24 * 60 * 60
+
+
 def includeme(config):
     """
     Loads web assets
     """
-    here = os.path.dirname(os.path.realpath(__file__))
-
     env = config.get_webassets_env()
-    env.append_path(os.path.join(here, 'static'), '/studies/static')
+    env.append_path(os.path.join(HERE, 'static'), '/studies/static')
+
+    bundles = make_bundles()
+    compiled = load_manifest()
+
+    for name, bundle in bundles.items():
+        if compiled is not None:
+            if name in compiled:
+                bundle.version = compiled[name]
+                bundle.config.update({'auto_build': False, 'url_expire': False})
+            else:
+                log.warn('{0} is not compiled, rerun os_assets'.format(name))
+        config.add_webasset(name, bundle)
+
+    serve_gen = static_view(
+        GEN_DIR,
+        cache_max_age=GEN_MAX_AGE,
+        use_subpath=True,
+        content_encodings=['br', 'gzip'])
+
+    def gen_view(context, request):
+        response = serve_gen(context, request)
+        # Compiled file names change with their content
+        if response.status_int == 200:
+            response.cache_control.public = True
+            response.headers['Cache-Control'] += ', immutable'
+        return response
+
+    # Must be registered before the general static view (see .routes)
+    config.add_route('studies.static_gen', '/static/gen/*subpath')
+    config.add_view(gen_view, route_name='studies.static_gen')
 
+    log.debug('Assets configurated')
+
+
+def load_manifest():
+    """
+    Returns the versions of the compiled bundles by name
+
+    Returns None if the bundles have not been compiled.
+    """
+    if not os.path.exists(MANIFEST):
+        return None
+    with open(MANIFEST) as fp:
+        return json.load(fp)
+
+
+def make_bundles():
+    """
+    Returns the application's bundles by name
+    """
     # "resolves" the path relative to this package
     def rel(path):
-        return os.path.join(here, 'static', path)
-
-    scriptsdir = os.path.join(here, 'static/scripts')
-
-    config.add_webasset('studies-js', Bundle(
-        # Dependency javascript libraries must be loaded in a specific order
-        rel('bower_components/jquery/dist/jquery.min.js'),
-        rel('bower_components/jquery-ui/jquery-ui.min.js'),
-        Bundle(rel('bower_components/jquery-cookie/jquery.cookie.js'), filters='jsmin'),
-        rel('bower_components/jquery-validate/dist/jquery.validate.min.js'),
-        rel('bower_components/bootstrap/dist/js/bootstrap.min.js'),
-        rel('bower_components/knockout/dist/knockout.js'),
-        rel('bower_components/knockout-sortable/build/knockout-sortable.min.js'),
-        rel('bower_components/select2/select2.min.js'),
-        rel('bower_components/moment/min/moment.min.js'),
-        rel('bower_components/eonasdan-bootstrap-datetimepicker/build/js/bootstrap-datetimepicker.min.js'),
-        rel('bower_components/bootstrap-fileinput/js/fileinput.min.js'),
-        rel('bower_components/bootstrap-switch/dist/js/bootstrap-switch.min.js'),
-        # App-specific scripts can be loaded in any order
-        Bundle(
-            *[os.path.join(root, filename)
-                for root, dirnames, filenames in os.walk(scriptsdir)
-                for filename in filenames if filename.endswith('.js')],
-            filters='jsmin'),
-        output=rel('gen/studies.%(version)s.js')))
-
-    config.add_webasset('studies-css', Bundle(
-        Bundle(
-            rel('styles/main.less'),
-            filters='less,cssmin',
-            depends=rel('styles/*.less'),
-            output=rel('gen/studies-main.%(version)s.css')),
-        Bundle(rel('bower_components/select2/select2.css'), filters='cssrewrite'),
-        rel('bower_components/select2-bootstrap-css/select2-bootstrap.css'),
-        Bundle(rel('bower_components/bootstrap-fileinput/css/fileinput.min.css'), filters='cssrewrite'),
-        rel('bower_components/bootstrap-switch/dist/css/bootstrap3/bootstrap-switch.min.css'),
-        output=rel('gen/studies.%(version)s.css')))
+        return os.path.join(HERE, 'static', path)
 
-    log.debug('Assets configurated')
+    scriptsdir = os.path.join(HERE, 'static/scripts')
+
+    return OrderedDict([
+        ('studies-js', Bundle(
+            # Dependency javascript libraries must be loaded in a specific order
+            rel('bower_components/jquery/dist/jquery.min.js'),
+            rel('bower_components/jquery-ui/jquery-ui.min.js'),
+            Bundle(rel('bower_components/jquery-cookie/jquery.cookie.js'), filters='jsmin'),
+            rel('bower_components/jquery-validate/dist/jquery.validate.min.js'),
+            rel('bower_components/bootstrap/dist/js/bootstrap.min.js'),
+            rel('bower_components/knockout/dist/knockout.js'),
+            rel('bower_components/knockout-sortable/build/knockout-sortable.min.js'),
+            rel('bower_components/select2/select2.min.js'),
+            rel('bower_components/moment/min/moment.min.js'),
+            rel('bower_components/eonasdan-bootstrap-datetimepicker/build/js/bootstrap-datetimepicker.min.js'),
+            rel('bower_components/bootstrap-fileinput/js/fileinput.min.js'),
+            rel('bower_components/bootstrap-switch/dist/js/bootstrap-switch.min.js'),
+            # App-specific scripts can be loaded in any order
+            Bundle(
+                *sorted(
+                    os.path.join(root, filename)
+                    for root, dirnames, filenames in os.walk(scriptsdir)
+                    for filename in filenames if filename.endswith('.js')),
+                filters='jsmin'),
+            output=rel('gen/studies.%(version)s.js'))),
+
+        ('studies-css', Bundle(
+            Bundle(
+                rel('styles/main.less'),
+                filters='less,cssmin',
+                depends=rel('styles/*.less'),
+                output=rel('gen/studies-main.%(version)s.css')),
+            Bundle(rel('bower_components/select2/select2.css'), filters='cssrewrite'),
+            rel('bower_components/select2-bootstrap-css/select2-bootstrap.css'),
+            Bundle(rel('bower_components/bootstrap-fileinput/css/fileinput.min.css'), filters='cssrewrite'),
+            rel('bower_components/bootstrap-switch/dist/css/bootstrap3/bootstrap-switch.min.css'),
+            output=rel('gen/studies.%(version)s.css'))),
+    ])
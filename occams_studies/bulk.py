@@ -0,0 +1,171 @@
+"""
+Set-based helpers for loading large batches of records
+
+The ORM unit of work is fine for a handful of objects, but tens of
+thousands of rows through it is slow and holds everything in memory
+until the flush. These helpers issue multi-row INSERT statements directly
+instead, filling in the audit columns that the datastore event handlers
+would otherwise have set.
+"""
+
+from datetime import datetime
+from itertools import islice
+
+import sqlalchemy as sa
+from zope.sqlalchemy import mark_changed
+
+from occams_datastore import models as datastore
+
+
+class UploadError(Exception):
+    """
+    Raised when an uploaded file cannot be loaded
+
+    Attributes:
+    message -- translatable summary of the problem
+    errors -- problems found in specific rows, as dictionaries with
+              ``line``, ``column`` and (translatable) ``message`` keys
+    """
+
+    def __init__(self, message, errors=None):
+        super(UploadError, self).__init__(message)
+        self.message = message
+        self.errors = errors or []
+
+
+def chunked(iterable, size):
+    """
+    Yields lists of at most ``size`` items from ``iterable``
+    """
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def audit_values(db_session, user=None):
+    """
+    Returns the audit column values for records inserted outside the ORM
+
+    Arguments:
+    db_session -- the current database session
+    user -- (optional) the user to blame, defaults to the session's blame
+    """
+    if user is None:
+        user = db_session.info['blame']
+    if not isinstance(user, datastore.User):
+        user = db_session.query(datastore.User).filter_by(key=user).one()
+    now = datetime.now()
+    return {
+        'create_user_id': user.id,
+        'create_date': now,
+        'modify_user_id': user.id,
+        'modify_date': now,
+        'revision': 1,
+    }
+
+
+def reserve_ids(db_session, table, count):
+    """
+    Allocates ``count`` primary keys from the table's id sequence
+
+    Knowing the keys up front allows dependent records (such as contexts
+    and values of new entities) to be inserted in the same batch.
+    """
+    if not count:
+        return []
+    sequence = sa.func.pg_get_serial_sequence(table.name, 'id')
+    query = (
+        sa.select([sa.func.nextval(sequence)])
+        .select_from(sa.func.generate_series(1, count)))
+    return [id for (id,) in db_session.execute(query)]
+
+
+def insert_many(db_session, table, rows):
+    """
+    Inserts ``rows`` (a list of dicts) using a single multi-row INSERT
+    """
+    if not rows:
+        return
+    db_session.execute(table.insert().values(rows))
+    mark_changed(db_session)
+
+
+def delete_many(db_session, table, whereclause, dry_run=False):
+    """
+    Deletes the rows of ``table`` matching ``whereclause`` in one statement
+
+    Rows of audited tables are first copied to the table's audit table,
+    keeping their history as deletes through the ORM do.
+
+    Arguments:
+    db_session -- the current database session
+    table -- the table to delete from
+    whereclause -- the rows to delete
+    dry_run -- (optional) only count the rows that would be deleted
+
+    Returns the number of rows (that would be) deleted
+    """
+    if dry_run:
+        query = (
+            sa.select([sa.func.count()])
+            .select_from(table)
+            .where(whereclause))
+        return db_session.execute(query).scalar()
+
+    audit_table = table.metadata.tables.get(table.name + '_audit')
+    if audit_table is not None:
+        columns = [column.name for column in table.c]
+        db_session.execute(audit_table.insert().from_select(
+            columns,
+            sa.select([table.c[name] for name in columns])
+            .where(whereclause)))
+
+    result = db_session.execute(table.delete().where(whereclause))
+    mark_changed(db_session)
+    return result.rowcount
+
+
+def insert_entities(db_session, rows, contexts, audit=None):
+    """
+    Inserts new entities along with the contexts they belong to
+
+    Arguments:
+    db_session -- the current database session
+    rows -- entity column values (schema_id, state_id, collect_date)
+    contexts -- for each entity, the (external, key) pairs it belongs to
+    audit -- (optional) audit column values, see ``audit_values``
+
+    Returns the ids of the new entities
+    """
+    if audit is None:
+        audit = audit_values(db_session)
+
+    entity_table = datastore.Entity.__table__
+    context_table = datastore.Context.__table__
+
+    ids = reserve_ids(db_session, entity_table, len(rows))
+
+    insert_many(db_session, entity_table, [
+        dict(audit, id=id, not_done=False, **row)
+        for id, row in zip(ids, rows)])
+
+    insert_many(db_session, context_table, [
+        dict(audit, entity_id=id, external=external, key=key)
+        for id, pairs in zip(ids, contexts)
+        for external, key in pairs])
+
+    return ids
+
+
+def errors2json(errors, translate):
+    """
+    Serializes row problems using ``translate`` for the messages
+    """
+    return [{
+        'line': error['line'],
+        'column': error['column'],
+        'message': translate(error['message'])
+    } for error in errors]
@@ -0,0 +1,178 @@
+"""
+Cross-process caching of rarely-changing lookups
+
+Values are computed once, shared between workers through redis, and also
+kept in process memory. A version counter in redis tells each worker
+whether its in-memory copy is still current, so an invalidation in one
+worker is noticed by every other worker on its next read.
+
+Also provides conditional GET support for JSON views, so that clients
+polling for changes are answered with 304 Not Modified until the records
+they are shown actually change.
+"""
+
+from datetime import datetime
+import functools
+import hashlib
+import json
+import time
+
+from pyramid.httpexceptions import HTTPNotModified
+import six
+import sqlalchemy as sa
+import transaction
+
+
+class VersionedCache(object):
+    """
+    A JSON-serializable value cached in process memory and redis.
+
+    Readers only fetch the small version counter from redis while their
+    in-memory copy is current. The full value is read from redis (or
+    recomputed) only after an invalidation.
+    """
+
+    def __init__(self, name, expire=86400):
+        self.name = name
+        self.expire = expire
+        self.version_key = 'studies:cache:{0}:version'.format(name)
+        self._local = None
+
+    def data_key(self, version):
+        return 'studies:cache:{0}:{1}'.format(self.name, version)
+
+    def get(self, redis, creator):
+        """
+        Returns the cached value, calling ``creator`` if it's not available
+
+        Arguments:
+        redis -- redis connection shared by all workers
+        creator -- callable that returns a fresh JSON-serializable value
+        """
+        version = _text(redis.get(self.version_key) or '0')
+
+        local = self._local
+        if local is not None and local[0] == version:
+            return local[1]
+
+        key = self.data_key(version)
+        raw = redis.get(key)
+
+        if raw is None:
+            value = creator()
+            redis.set(key, json.dumps(value), ex=self.expire)
+        else:
+            value = json.loads(_text(raw))
+
+        self._local = (version, value)
+        return value
+
+    def invalidate(self, redis):
+        """
+        Invalidates all copies of the value
+        """
+        redis.incr(self.version_key)
+        self._local = None
+
+    def invalidate_after_commit(self, redis):
+        """
+        Invalidates all copies of the value once the transaction commits
+
+        Invalidating any sooner would allow another worker to recompute
+        the value from data that has not been committed yet.
+        """
+        def hook(success):
+            if success:
+                self.invalidate(redis)
+        transaction.get().addAfterCommitHook(hook)
+
+
+def modification_state(db_session, sources):
+    """
+    Returns the row count and latest modify_date of each source
+
+    Everything is fetched in a single query of scalar subqueries.
+
+    Arguments:
+    db_session -- the current database session
+    sources -- (model or table, criterion) pairs, modify_date is only
+               checked for tables that have one
+    """
+    columns = []
+
+    for source, criterion in sources:
+        table = getattr(source, '__table__', source)
+        columns.append(
+            sa.select([sa.func.count()])
+            .select_from(table)
+            .where(criterion)
+            .as_scalar())
+        if 'modify_date' in table.c:
+            columns.append(
+                sa.select([sa.func.max(table.c.modify_date)])
+                .where(criterion)
+                .as_scalar())
+
+    return list(db_session.execute(sa.select(columns)).first())
+
+
+def conditional_get(sources):
+    """
+    Returns a view decorator that answers conditional GET requests
+
+    ``sources(context, request)`` returns the (model, criterion) pairs of
+    the records a view serializes. Their state (see ``modification_state``)
+    is hashed into an ETag along with the URL and the user's principals, so
+    that a matching If-None-Match is answered with 304 Not Modified
+    without calling the view. Row counts are included so that removed
+    records are noticed too, which is also why If-Modified-Since alone is
+    not answered with 304 (the latest modify_date does not change when a
+    record is deleted).
+
+    Responses are private and must be revalidated on every use.
+
+    Use with ``view_config(decorator=...)``, so that other views calling the
+    view function directly are unaffected.
+    """
+    def decorator(view):
+
+        @functools.wraps(view)
+        def wrapper(context, request):
+            if request.method not in ('GET', 'HEAD'):
+                return view(context, request)
+
+            state = modification_state(
+                request.db_session, sources(context, request))
+
+            etag = hashlib.sha1(json.dumps([
+                request.path_qs,
+                request.authenticated_userid,
+                sorted(request.effective_principals),
+                state,
+            ], default=six.text_type).encode('utf-8')).hexdigest()
+
+            if etag in request.if_none_match:
+                response = HTTPNotModified()
+            else:
+                response = view(context, request)
+
+            response.etag = etag
+            response.cache_control = 'private, no-cache'
+
+            modify_dates = [v for v in state if isinstance(v, datetime)]
+            if modify_dates:
+                # modify_date is recorded in server local time
+                response.last_modified = \
+                    time.mktime(max(modify_dates).timetuple())
+
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+def _text(value):
+    if not isinstance(value, six.text_type):
+        value = value.decode('utf-8')
+    return value
@@ -0,0 +1,66 @@
+"""
+Optional subsystems of a deployment
+
+Not every deployment has every subsystem, e.g. the lab (specimen) tables
+are only installed along with occams_lims. Rather than checking the
+database catalog on every request, each database is probed once per
+process, the first time it is used, and the flags are kept for the life
+of the process::
+
+    if capabilities.get(db_session).lab:
+        ...
+
+Call ``refresh`` after installing or removing a subsystem on a running
+process (e.g. from a shell or maintenance script).
+"""
+
+from collections import namedtuple
+
+
+#: Flags of the optional subsystems available to a database
+#:
+#: lab -- the lab (specimen) tables are installed
+Capabilities = namedtuple('Capabilities', ['lab'])
+
+# Probed capabilities of each database (by URL)
+_registry = {}
+
+
+def probe(connection):
+    """
+    Probes a database for optional subsystems
+
+    Only what is installed is probed, not data that may show up while the
+    process runs.
+    """
+    return Capabilities(
+        lab=connection.dialect.has_table(connection, 'specimen'))
+
+
+def get(db_session):
+    """
+    Returns the capabilities of the session's database
+
+    The database is only probed the first time it is used by the process.
+    """
+    key = str(db_session.bind.url)
+    if key not in _registry:
+        _registry[key] = probe(db_session.connection())
+    return _registry[key]
+
+
+def refresh(db_session=None):
+    """
+    Discards probed capabilities
+
+    Arguments:
+    db_session -- (optional) only discard the capabilities of this
+                  session's database, and re-probe it immediately
+
+    Returns the new capabilities of ``db_session``'s database, if given.
+    """
+    if db_session is None:
+        _registry.clear()
+        return None
+    _registry.pop(str(db_session.bind.url), None)
+    return get(db_session)
@@ -6,6 +6,7 @@ offer an interface (gui or cli, etc)
 """
 
 import inspect
+from timeit import default_timer
 
 try:
     import unicodecsv as csv
@@ -20,7 +21,7 @@ from pyramid.config import aslist
 from pyramid.path import DottedNameResolver
 
 from .. import log
-from . import codebook
+from . import codebook, metrics
 
 
 def includeme(config):
@@ -74,12 +75,43 @@ def write_data(buffer, query):
     buffer -- a file object which will be used to write data contents
     query -- SQLAlchemy query that will be writen to a CSV file.
              Note that the column names will be used as the header.
+
+    Returns a dictionary of the file's costs (see ``exports.metrics``):
+    query_time -- seconds spent executing the query and fetching its rows
+    write_time -- seconds spent writing the rows
+    rows -- number of rows written
+    bytes -- size of the file
+    memory_growth -- bytes the process's peak memory grew while writing
     """
+    peak_memory = metrics.peak_memory()
+
     fieldnames = [d['name'] for d in query.column_descriptions]
     writer = csv.DictWriter(buffer, fieldnames=fieldnames)
     writer.writeheader()
-    writer.writerows(r._asdict() for r in query)
+
+    start = default_timer()
+    # Query results are fetched in full before the first row is returned
+    results = iter(query)
+    query_time = default_timer() - start
+
+    rows = 0
+    start = default_timer()
+    for result in results:
+        writer.writerow(result._asdict())
+        rows += 1
     buffer.flush()
+    write_time = default_timer() - start
+
+    if peak_memory is not None:
+        peak_memory = metrics.peak_memory() - peak_memory
+
+    return {
+        'query_time': query_time,
+        'write_time': write_time,
+        'rows': rows,
+        'bytes': buffer.tell(),
+        'memory_growth': peak_memory,
+    }
 
 
 def write_codebook(buffer, rows):
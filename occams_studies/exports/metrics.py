@@ -0,0 +1,147 @@
+"""
+Export metrics
+
+Every data file written by an export (``tasks.make_export``) or by
+``os_export`` records what it cost:
+
+    queue_wait -- seconds the export waited for a worker (exports only)
+    query_time -- seconds spent executing the plan's query
+    write_time -- seconds spent writing the CSV file
+    rows -- number of rows written
+    bytes -- size of the file
+    memory_growth -- how much the process's peak resident memory grew
+                     while the file was written (in bytes)
+
+Administrators can rank the plans by cost and follow their trends at
+``/exports/metrics`` (see ``views.export.metrics``).
+"""
+
+from datetime import datetime, timedelta
+import sys
+
+import sqlalchemy as sa
+
+try:
+    import resource
+except ImportError:  # pragma: nocover
+    resource = None
+
+from .. import models
+
+
+#: Default period summarized (in days)
+DEFAULT_DAYS = 30
+
+#: Sources of recorded metrics
+SOURCES = ('task', 'cli')
+
+
+def peak_memory():
+    """
+    Returns the peak resident memory of the process (in bytes)
+
+    The peak covers the whole life of the process (e.g. every export a
+    worker has run), so files are measured by how much they raise it.
+
+    Returns None if the platform cannot report it.
+    """
+    if resource is None:  # pragma: nocover
+        return None
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return usage if sys.platform == 'darwin' else usage * 1024
+
+
+def record(db_session, plan_name, stats, source,
+           export_id=None, queue_wait=None):
+    """
+    Records the costs of a data file
+
+    Arguments:
+    db_session -- the session to record in (must be on the primary)
+    plan_name -- the plan the file was generated from
+    stats -- the costs returned by ``exports.write_data``
+    source -- what wrote the file (see ``SOURCES``)
+    export_id -- (optional) the export the file belongs to
+    queue_wait -- (optional) seconds the export waited for a worker
+    """
+    db_session.execute(models.export_metric_table.insert().values(
+        export_id=export_id,
+        plan_name=plan_name,
+        source=source,
+        create_date=datetime.now(),
+        queue_wait=queue_wait,
+        query_time=stats['query_time'],
+        write_time=stats['write_time'],
+        rows=stats['rows'],
+        bytes=stats['bytes'],
+        memory_growth=stats['memory_growth']))
+
+
+def _since(days):
+    return datetime.now() - timedelta(days)
+
+
+def rank(db_session, days=DEFAULT_DAYS):
+    """
+    Ranks plans by the total time spent on them, most expensive first
+
+    Arguments:
+    db_session -- the session to query
+    days -- (optional) only consider the most recent number of days
+    """
+    metric = models.export_metric_table.c
+    cost = metric.query_time + metric.write_time
+
+    query = (
+        sa.select([
+            metric.plan_name.label('name'),
+            sa.func.count().label('runs'),
+            sa.func.sum(cost).label('total_time'),
+            sa.func.avg(cost).label('avg_time'),
+            sa.func.max(cost).label('max_time'),
+            sa.func.avg(metric.query_time).label('avg_query_time'),
+            sa.func.avg(metric.write_time).label('avg_write_time'),
+            sa.func.avg(metric.queue_wait).label('avg_queue_wait'),
+            sa.func.max(metric.rows).label('max_rows'),
+            sa.func.max(metric.bytes).label('max_bytes'),
+            sa.func.max(metric.memory_growth).label('max_memory_growth'),
+            sa.func.max(metric.create_date).label('last_date'),
+        ])
+        .where(metric.create_date >= _since(days))
+        .group_by(metric.plan_name)
+        .order_by(sa.desc('total_time'), metric.plan_name))
+
+    return [dict(row) for row in db_session.execute(query)]
+
+
+def trend(db_session, plan_name, days=DEFAULT_DAYS):
+    """
+    Returns a plan's daily costs, oldest first
+
+    Arguments:
+    db_session -- the session to query
+    plan_name -- the plan to trend
+    days -- (optional) only consider the most recent number of days
+    """
+    metric = models.export_metric_table.c
+    day = sa.func.date_trunc('day', metric.create_date)
+
+    query = (
+        sa.select([
+            day.label('date'),
+            sa.func.count().label('runs'),
+            sa.func.avg(metric.query_time).label('avg_query_time'),
+            sa.func.avg(metric.write_time).label('avg_write_time'),
+            sa.func.avg(metric.queue_wait).label('avg_queue_wait'),
+            sa.func.max(metric.rows).label('max_rows'),
+            sa.func.max(metric.bytes).label('max_bytes'),
+            sa.func.max(metric.memory_growth).label('max_memory_growth'),
+        ])
+        .where(
+            (metric.plan_name == plan_name)
+            & (metric.create_date >= _since(days)))
+        .group_by(day)
+        .order_by(day))
+
+    return [dict(row) for row in db_session.execute(query)]
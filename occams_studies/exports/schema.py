@@ -16,11 +16,20 @@ from occams_datastore import models as datastore
 from occams_datastore.reporting import build_report
 from occams_datastore.utils.sql import group_concat, to_date
 
-from .. import models
+from .. import models, reports
 from .plan import ExportPlan
 from .codebook import types, row
 
 
+#: Forms collected for patients' partners
+PARTNER_FORMS = (
+    'IPartnerBio',
+    'IPartnerContact',
+    'IPartnerDemographics',
+    'IPartnerDisclosure',
+)
+
+
 class SchemaPlan(ExportPlan):
 
     is_system = False
@@ -67,14 +76,8 @@ class SchemaPlan(ExportPlan):
         return [cls.from_sql(db_session, r) for r in query]
 
     @property
-    def _is_aeh_partner_form(self):
-        return (
-            'aeh' in self.db_session.bind.url.database
-            and self.name in (
-                'IPartnerBio',
-                'IPartnerContact',
-                'IPartnerDemographics',
-                'IPartnerDisclosure'))
+    def _is_partner_form(self):
+        return self.name in PARTNER_FORMS
 
     def codebook(self):
         session = self.db_session
@@ -90,7 +93,7 @@ class SchemaPlan(ExportPlan):
             row('enrollment_ids', self.name, types.NUMBER, decimal_places=0,
                 is_collection=True, is_system=True)]
 
-        if self._is_aeh_partner_form:
+        if self._is_partner_form:
             knowns.extend([
                 row('partner_id', self.name, types.NUMBER, decimal_places=0,
                     is_required=True, is_system=True,
@@ -173,16 +176,21 @@ class SchemaPlan(ExportPlan):
         session = self.db_session
         ids_query = (
             session.query(datastore.Schema.id)
+            .filter(datastore.Schema.name == self.name)
             .filter(datastore.Schema.publish_date.in_(self.versions)))
         ids = [id for id, in ids_query]
 
-        report = build_report(
-            session,
-            self.name,
-            ids=ids,
-            expand_collections=expand_collections,
-            use_choice_labels=use_choice_labels,
-            ignore_private=ignore_private)
+        # Only the default report is materialized
+        if use_choice_labels or expand_collections or not ignore_private:
+            report = build_report(
+                session,
+                self.name,
+                ids=ids,
+                expand_collections=expand_collections,
+                use_choice_labels=use_choice_labels,
+                ignore_private=ignore_private)
+        else:
+            report = reports.fetch_report(session, self.name, ids=ids)
 
         query = (
             session.query(report.c.id.label('id'))
@@ -231,7 +239,7 @@ class SchemaPlan(ExportPlan):
                 .label('enrollment_ids'))
             )
 
-        if self._is_aeh_partner_form:
+        if self._is_partner_form:
             PartnerPatient = orm.aliased(models.Patient)
             query = (
                 query
@@ -0,0 +1,83 @@
+"""
+Progress tracking for background jobs
+
+Large uploads and batches are handed off to Celery so they do not tie up
+a web worker. Their progress is kept in a redis hash that the browser
+polls until the job is complete or has failed.
+"""
+
+import json
+
+
+#: How long (in seconds) job statuses are kept around
+EXPIRE = 60 * 60 * 24
+
+#: Fields that are stored as JSON
+JSON_FIELDS = ('errors', 'results')
+
+
+class JobStatus(object):
+    """
+    The redis-backed status of a background job
+
+    Statuses are one of pending, validating, loading, complete or failed.
+    """
+
+    def __init__(self, redis, kind, job_id):
+        self.redis = redis
+        self.job_id = job_id
+        self.key = 'studies:{0}:{1}'.format(kind, job_id)
+
+    def start(self, owner, total=0):
+        """
+        Records a newly-scheduled job
+
+        Arguments:
+        owner -- what the job belongs to (e.g. the study's id), only
+                 status requests for the same owner are answered
+        total -- (optional) the number of items to process, if known
+        """
+        self.redis.hmset(self.key, {
+            'owner': owner,
+            'status': 'pending',
+            'count': 0,
+            'total': total,
+        })
+        self.redis.expire(self.key, EXPIRE)
+
+    def update(self, **fields):
+        """
+        Updates the job's status fields
+        """
+        for name in JSON_FIELDS:
+            if name in fields:
+                fields[name] = json.dumps(fields[name])
+        self.redis.hmset(self.key, fields)
+
+    def progress(self, count):
+        """
+        Records the number of items processed so far
+        """
+        self.redis.hset(self.key, 'count', count)
+
+    def to_json(self, owner):
+        """
+        Returns the status of the job, or None if it's not the owner's
+        """
+        data = self.redis.hgetall(self.key)
+
+        if not data or data['owner'] != str(owner):
+            return None
+
+        result = {
+            'id': self.job_id,
+            'status': data['status'],
+            'count': int(data.get('count') or 0),
+            'total': int(data.get('total') or 0),
+            'message': data.get('message'),
+        }
+
+        for name in JSON_FIELDS:
+            result[name] = json.loads(data.get(name) or '[]')
+
+        return result
@@ -3,6 +3,7 @@ import os
 import re
 import uuid
 
+from pyramid.decorator import reify
 from pyramid.security import Allow, Authenticated, ALL_PERMISSIONS
 import sqlalchemy as sa
 from sqlalchemy import orm
@@ -92,15 +93,45 @@ class StudyFactory(object):
         self.request = request
 
     def __getitem__(self, key):
-        db_session = self.request.db_session
+        memo = _traversal_memo(self.request)
         try:
-            study = db_session.query(Study).filter_by(name=key).one()
-        except orm.exc.NoResultFound:
-            raise KeyError
+            study = memo[Study, key]
+        except KeyError:
+            db_session = self.request.db_session
+            try:
+                study = db_session.query(Study).filter_by(name=key).one()
+            except orm.exc.NoResultFound:
+                raise KeyError
+            memo[Study, key] = study
         study.__parent__ = self
         return study
 
 
+def _traversal_memo(request):
+    """
+    Returns the request-scoped memo of resources resolved during traversal
+
+    Lookups are keyed by resource class and URL key so that resources
+    resolved ahead of time (or more than once) do not hit the database
+    again during the same request.
+    """
+    return request.environ.setdefault('occams_studies.traversal', {})
+
+
+def _parse_visit_date(value):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except (TypeError, ValueError):
+        return None
+
+
+def _parse_id(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
 # Configured forms for the study
 study_schema_table = sa.Table(
     'study_schema',
@@ -452,8 +483,6 @@ class PatientFactory(object):
 
     @property
     def __acl__(self):
-        db_session = self.request.db_session
-
         acl = [
             (Allow, groups.administrator(), ALL_PERMISSIONS),
             (Allow, groups.manager(), ('view', 'add'))
@@ -462,7 +491,10 @@ class PatientFactory(object):
         # Grant access to any member of any site and
         # filter patients within the view listing based
         # on which sites the user has access.
-        for site in db_session.query(Site):
+        # Only principals the user holds can ever match an entry, so the
+        # site-level entries are generated from those instead of from
+        # every site in the database.
+        for site in self.principal_sites:
             acl.extend([
                 (Allow, groups.coordinator(site), ('view', 'add')),
                 (Allow, groups.enterer(site), ('view', 'add')),
@@ -478,17 +510,82 @@ class PatientFactory(object):
     def __init__(self, request):
         self.request = request
 
+    @reify
+    def principal_sites(self):
+        """
+        Sites referenced by the current user's site-level principals
+        """
+        db_session = self.request.db_session
+        names = set(
+            principal.split(':', 1)[0]
+            for principal in self.request.effective_principals or []
+            if ':' in principal)
+        if not names:
+            return []
+        return (
+            db_session.query(Site)
+            .filter(Site.name.in_(sorted(names)))
+            .all())
+
     def __getitem__(self, key):
+        memo = _traversal_memo(self.request)
+
+        try:
+            return memo[Patient, key]
+        except KeyError:
+            pass
+
         db_session = self.request.db_session
+        matchdict = self.request.matchdict or {}
+
+        query = (
+            db_session.query(Patient)
+            .options(orm.joinedload('site'))
+            .filter_by(pid=key))
+
+        # Deep URLs are resolved along with the patient so that traversal
+        # only needs a single query. The child factories will pick these
+        # up from the memo instead of querying again.
+        prefetched = []
+
+        visit_date = _parse_visit_date(matchdict.get('visit'))
+        if visit_date is not None:
+            query = (
+                query
+                .outerjoin(
+                    Visit,
+                    (Visit.patient_id == Patient.id)
+                    & (Visit.visit_date == visit_date))
+                .add_entity(Visit))
+            prefetched.append(visit_date)
+
+        enrollment_id = _parse_id(matchdict.get('enrollment'))
+        if enrollment_id is not None:
+            query = (
+                query
+                .outerjoin(
+                    Enrollment,
+                    (Enrollment.patient_id == Patient.id)
+                    & (Enrollment.id == enrollment_id))
+                .add_entity(Enrollment))
+            prefetched.append(enrollment_id)
+
         try:
-            patient = (
-                db_session.query(Patient)
-                .options(orm.joinedload('site'))
-                .filter_by(pid=key)
-                .one())
+            result = query.one()
         except orm.exc.NoResultFound:
             raise KeyError
 
+        if not prefetched:
+            patient = result
+        else:
+            patient = result[0]
+            for child_key, child in zip(prefetched, result[1:]):
+                # Misses are left for the child factory to look up
+                if child is not None:
+                    memo[child.__class__, patient.id, child_key] = child
+
+        memo[Patient, key] = patient
+
         # We do not specifically set the __parent__ attribute in this case
         # because we want users to be able to view the "/patients" URL
         # (with site-specific filtered results), but we do not want children
@@ -831,13 +928,17 @@ class EnrollmentFactory(object):
 
     def __getitem__(self, key):
         db_session = self.request.db_session
+        memo = _traversal_memo(self.request)
         try:
-            enrollment = (
-                db_session.query(Enrollment)
-                .options(orm.joinedload('patient').joinedload('site'))
-                .filter_by(id=key).one())
-        except orm.exc.NoResultFound:
-            raise KeyError
+            enrollment = memo[Enrollment, self.__parent__.id, _parse_id(key)]
+        except KeyError:
+            try:
+                enrollment = (
+                    db_session.query(Enrollment)
+                    .options(orm.joinedload('patient').joinedload('site'))
+                    .filter_by(id=key).one())
+            except orm.exc.NoResultFound:
+                raise KeyError
         enrollment.__parent__ = self
         return enrollment
 
@@ -944,6 +1045,13 @@ class Enrollment(StudiesModel,
                 ondelete='CASCADE'),
             sa.Index('ix_%s_patient_id' % cls.__tablename__, 'patient_id'),
             sa.Index('ix_%s_study_id' % cls.__tablename__, 'study_id'),
+            # Study dashboards filter/count enrollments by these dates
+            sa.Index(
+                'ix_%s_study_id_consent_date' % cls.__tablename__,
+                'study_id', 'consent_date'),
+            sa.Index(
+                'ix_%s_study_id_termination_date' % cls.__tablename__,
+                'study_id', 'termination_date'),
             # A patient may enroll only once in the study per day
             sa.UniqueConstraint('patient_id', 'study_id', 'consent_date'),
             sa.Index(
@@ -1050,10 +1158,57 @@ class Stratum(StudiesModel,
             sa.Index(
                 'ix_%s_block_number' % cls.__tablename__, cls.block_number),
             sa.Index(
-                'ix_%s_patient_id' % cls.__tablename__, cls.block_number),
+                'ix_%s_patient_id' % cls.__tablename__, cls.patient_id),
             sa.Index('ix_%s_arm_id' % cls.__tablename__, cls.arm_id))
 
 
+# Unassigned strata indexed by their randomization criteria, entries are
+# removed as the strata get assigned (see occams_studies.randomization)
+stratum_allocation_table = sa.Table(
+    'stratum_allocation',
+    StudiesModel.metadata,
+    sa.Column(
+        'stratum_id',
+        sa.Integer(),
+        sa.ForeignKey(
+            'stratum.id',
+            name='fk_stratum_allocation_stratum_id',
+            ondelete='CASCADE'),
+        primary_key=True),
+    sa.Column(
+        'study_id',
+        sa.Integer(),
+        sa.ForeignKey(
+            'study.id',
+            name='fk_stratum_allocation_study_id',
+            ondelete='CASCADE'),
+        nullable=False),
+    sa.Column('criteria_hash', sa.String(40), nullable=False),
+    sa.Column('criteria', sa.Unicode, nullable=False),
+    sa.Index(
+        'ix_stratum_allocation_study_id_criteria_hash',
+        'study_id', 'criteria_hash', 'stratum_id'))
+
+
+# Forms are listed/exported by what they're attached to, this allows
+# finding the forms of a patient, visit, etc. using only the index.
+# The context table belongs to occams_datastore, so the index is created
+# along with this package's tables rather than declared on its metadata.
+sa.event.listen(
+    StudiesModel.metadata,
+    'after_create',
+    sa.DDL(
+        'CREATE INDEX IF NOT EXISTS ix_context_external_key_entity_id '
+        'ON context (external, key, entity_id)'
+    ).execute_if(dialect='postgresql'))
+
+sa.event.listen(
+    StudiesModel.metadata,
+    'before_drop',
+    sa.DDL('DROP INDEX IF EXISTS ix_context_external_key_entity_id')
+    .execute_if(dialect='postgresql'))
+
+
 class VisitFactory(object):
 
     @property
@@ -1074,19 +1229,23 @@ class VisitFactory(object):
 
     def __getitem__(self, key):
         db_session = self.request.db_session
-        try:
-            key = datetime.strptime(key, '%Y-%m-%d').date()
-        except ValueError:
+        key = _parse_visit_date(key)
+        if key is None:
             raise KeyError
+        memo = _traversal_memo(self.request)
         try:
-            visit = (
-                db_session.query(Visit)
-                .options(orm.joinedload('patient').joinedload('site'))
-                .filter_by(patient=self.__parent__)
-                .filter_by(visit_date=key)
-                .one())
-        except orm.exc.NoResultFound:
-            raise KeyError
+            visit = memo[Visit, self.__parent__.id, key]
+        except KeyError:
+            # The patient (and its site) is already loaded as the parent
+            try:
+                visit = (
+                    db_session.query(Visit)
+                    .filter_by(patient=self.__parent__)
+                    .filter_by(visit_date=key)
+                    .one())
+            except orm.exc.NoResultFound:
+                raise KeyError
+            memo[Visit, self.__parent__.id, key] = visit
         visit.__parent__ = self
         return visit
 
@@ -1175,6 +1334,598 @@ class Visit(StudiesModel,
                 name='uq_%s_patient_id_visit_date' % cls.__tablename__))
 
 
+# Per-patient activity summary for listings, maintained by the triggers
+# below so that set-based loads (see occams_studies.bulk) are included.
+# The triggers fire once per statement and refresh each affected patient
+# once (from the statement's transition tables), which needs PostgreSQL 10.
+patient_activity_table = sa.Table(
+    'patient_activity',
+    StudiesModel.metadata,
+    sa.Column(
+        'patient_id',
+        sa.Integer(),
+        sa.ForeignKey(
+            'patient.id',
+            name='fk_patient_activity_patient_id',
+            ondelete='CASCADE'),
+        primary_key=True),
+    sa.Column('site_id', sa.Integer(), nullable=False),
+    sa.Column('last_visit_date', sa.Date()),
+    sa.Column('last_modified', sa.DateTime(), nullable=False),
+    sa.Column(
+        'enrollment_count', sa.Integer(), nullable=False, server_default='0'),
+    sa.Column(
+        'open_form_count', sa.Integer(), nullable=False, server_default='0'),
+    sa.Index(
+        'ix_patient_activity_site_id_last_modified',
+        'site_id', 'last_modified'))
+
+PATIENT_ACTIVITY_TRIGGERS = [
+    """
+    CREATE OR REPLACE FUNCTION patient_activity_refresh(targets INTEGER[])
+    RETURNS VOID AS $$
+    BEGIN
+      INSERT INTO patient_activity (
+        patient_id, site_id, last_visit_date, last_modified,
+        enrollment_count, open_form_count)
+      SELECT
+        patient.id,
+        patient.site_id,
+        (SELECT MAX(visit.visit_date)
+         FROM visit
+         WHERE visit.patient_id = patient.id),
+        patient.modify_date,
+        (SELECT COUNT(*)
+         FROM enrollment
+         WHERE enrollment.patient_id = patient.id),
+        (SELECT COUNT(*)
+         FROM context
+         JOIN entity ON entity.id = context.entity_id
+         LEFT JOIN state ON state.id = entity.state_id
+         WHERE context.external = 'patient'
+         AND context.key = patient.id
+         AND state.name IS DISTINCT FROM 'complete')
+      FROM patient
+      WHERE patient.id = ANY(targets)
+      ON CONFLICT (patient_id) DO UPDATE SET
+        site_id = EXCLUDED.site_id,
+        last_visit_date = EXCLUDED.last_visit_date,
+        last_modified = EXCLUDED.last_modified,
+        enrollment_count = EXCLUDED.enrollment_count,
+        open_form_count = EXCLUDED.open_form_count;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE OR REPLACE FUNCTION patient_activity_on_patient()
+    RETURNS TRIGGER AS $$
+    BEGIN
+      PERFORM patient_activity_refresh(ARRAY(SELECT id FROM new_rows));
+      RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE OR REPLACE FUNCTION patient_activity_on_child()
+    RETURNS TRIGGER AS $$
+    BEGIN
+      IF TG_OP = 'INSERT' THEN
+        PERFORM patient_activity_refresh(ARRAY(
+          SELECT DISTINCT patient_id FROM new_rows));
+      ELSIF TG_OP = 'DELETE' THEN
+        PERFORM patient_activity_refresh(ARRAY(
+          SELECT DISTINCT patient_id FROM old_rows));
+      ELSE
+        PERFORM patient_activity_refresh(ARRAY(
+          SELECT patient_id FROM old_rows
+          UNION
+          SELECT patient_id FROM new_rows));
+      END IF;
+      RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE OR REPLACE FUNCTION patient_activity_on_context()
+    RETURNS TRIGGER AS $$
+    BEGIN
+      IF TG_OP = 'INSERT' THEN
+        PERFORM patient_activity_refresh(ARRAY(
+          SELECT DISTINCT key FROM new_rows WHERE external = 'patient'));
+      ELSE
+        PERFORM patient_activity_refresh(ARRAY(
+          SELECT DISTINCT key FROM old_rows WHERE external = 'patient'));
+      END IF;
+      RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE OR REPLACE FUNCTION patient_activity_on_entity()
+    RETURNS TRIGGER AS $$
+    BEGIN
+      PERFORM patient_activity_refresh(ARRAY(
+        SELECT DISTINCT context.key
+        FROM new_rows
+        JOIN old_rows ON old_rows.id = new_rows.id
+        JOIN context ON context.entity_id = new_rows.id
+        WHERE context.external = 'patient'
+        AND new_rows.state_id IS DISTINCT FROM old_rows.state_id));
+      RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE TRIGGER patient_activity_patient_insert
+    AFTER INSERT ON patient
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE patient_activity_on_patient()
+    """,
+    """
+    CREATE TRIGGER patient_activity_patient_update
+    AFTER UPDATE ON patient
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE patient_activity_on_patient()
+    """,
+    """
+    CREATE TRIGGER patient_activity_visit_insert
+    AFTER INSERT ON visit
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE patient_activity_on_child()
+    """,
+    """
+    CREATE TRIGGER patient_activity_visit_update
+    AFTER UPDATE ON visit
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE patient_activity_on_child()
+    """,
+    """
+    CREATE TRIGGER patient_activity_visit_delete
+    AFTER DELETE ON visit
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE patient_activity_on_child()
+    """,
+    """
+    CREATE TRIGGER patient_activity_enrollment_insert
+    AFTER INSERT ON enrollment
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE patient_activity_on_child()
+    """,
+    """
+    CREATE TRIGGER patient_activity_enrollment_update
+    AFTER UPDATE ON enrollment
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE patient_activity_on_child()
+    """,
+    """
+    CREATE TRIGGER patient_activity_enrollment_delete
+    AFTER DELETE ON enrollment
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE patient_activity_on_child()
+    """,
+    """
+    CREATE TRIGGER patient_activity_context_insert
+    AFTER INSERT ON context
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE patient_activity_on_context()
+    """,
+    """
+    CREATE TRIGGER patient_activity_context_delete
+    AFTER DELETE ON context
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE patient_activity_on_context()
+    """,
+    """
+    CREATE TRIGGER patient_activity_entity_update
+    AFTER UPDATE ON entity
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE patient_activity_on_entity()
+    """,
+]
+
+for _statement in PATIENT_ACTIVITY_TRIGGERS:
+    sa.event.listen(
+        StudiesModel.metadata,
+        'after_create',
+        sa.DDL(_statement).execute_if(dialect='postgresql'))
+
+for _function in ('patient_activity_refresh(INTEGER[])',
+                  'patient_activity_on_patient()',
+                  'patient_activity_on_child()',
+                  'patient_activity_on_context()',
+                  'patient_activity_on_entity()'):
+    sa.event.listen(
+        StudiesModel.metadata,
+        'before_drop',
+        sa.DDL('DROP FUNCTION IF EXISTS %s CASCADE' % _function)
+        .execute_if(dialect='postgresql'))
+
+
+# Materialized form reports (see occams_studies.reports)
+report_status_table = sa.Table(
+    'report_status',
+    StudiesModel.metadata,
+    sa.Column('id', sa.Integer(), primary_key=True),
+    sa.Column('name', sa.String(), nullable=False),
+    # Semicolon-delimited ids of the schema versions that were materialized
+    sa.Column('schema_ids', sa.String(), nullable=False),
+    sa.Column('refresh_date', sa.DateTime(), nullable=False),
+    sa.UniqueConstraint('name', name='uq_report_status_name'))
+
+# Entities modified since their report was last refreshed, filled in by the
+# triggers below so that set-based loads (see occams_studies.bulk) are
+# included.
+report_change_table = sa.Table(
+    'report_change',
+    StudiesModel.metadata,
+    sa.Column('entity_id', sa.Integer(), primary_key=True),
+    sa.Column('schema_id', sa.Integer(), primary_key=True),
+    sa.Index('ix_report_change_schema_id', 'schema_id'))
+
+REPORT_VALUE_TABLES = (
+    'value_blob',
+    'value_choice',
+    'value_datetime',
+    'value_decimal',
+    'value_integer',
+    'value_string',
+    'value_text')
+
+REPORT_CHANGE_TRIGGERS = [
+    """
+    CREATE OR REPLACE FUNCTION report_change_on_entity()
+    RETURNS TRIGGER AS $$
+    BEGIN
+      IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        INSERT INTO report_change (entity_id, schema_id)
+        VALUES (OLD.id, OLD.schema_id)
+        ON CONFLICT DO NOTHING;
+      END IF;
+      IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO report_change (entity_id, schema_id)
+        VALUES (NEW.id, NEW.schema_id)
+        ON CONFLICT DO NOTHING;
+      END IF;
+      RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE OR REPLACE FUNCTION report_change_on_value()
+    RETURNS TRIGGER AS $$
+    BEGIN
+      IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        INSERT INTO report_change (entity_id, schema_id)
+        SELECT entity.id, entity.schema_id
+        FROM entity
+        WHERE entity.id = OLD.entity_id
+        ON CONFLICT DO NOTHING;
+      END IF;
+      IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO report_change (entity_id, schema_id)
+        SELECT entity.id, entity.schema_id
+        FROM entity
+        WHERE entity.id = NEW.entity_id
+        ON CONFLICT DO NOTHING;
+      END IF;
+      RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE TRIGGER report_change_entity
+    AFTER INSERT OR UPDATE OR DELETE ON entity
+    FOR EACH ROW EXECUTE PROCEDURE report_change_on_entity()
+    """,
+] + [
+    """
+    CREATE TRIGGER report_change_%(table)s
+    AFTER INSERT OR UPDATE OR DELETE ON %(table)s
+    FOR EACH ROW EXECUTE PROCEDURE report_change_on_value()
+    """ % {'table': _table}
+    for _table in REPORT_VALUE_TABLES]
+
+for _statement in REPORT_CHANGE_TRIGGERS:
+    sa.event.listen(
+        StudiesModel.metadata,
+        'after_create',
+        sa.DDL(_statement).execute_if(dialect='postgresql'))
+
+for _function in ('report_change_on_entity()',
+                  'report_change_on_value()'):
+    sa.event.listen(
+        StudiesModel.metadata,
+        'before_drop',
+        sa.DDL('DROP FUNCTION IF EXISTS %s CASCADE' % _function)
+        .execute_if(dialect='postgresql'))
+
+
+# Expected visits of active enrollments (see occams_studies.schedule),
+# maintained by the triggers below so that set-based loads are included.
+# Like the patient activity, each statement refreshes the patients (or
+# cycles) it changed only once.
+# Whether a visit is due, overdue or missed depends on the current date so
+# it is worked out when listing.
+visit_schedule_table = sa.Table(
+    'visit_schedule',
+    StudiesModel.metadata,
+    sa.Column(
+        'enrollment_id',
+        sa.Integer(),
+        sa.ForeignKey(
+            'enrollment.id',
+            name='fk_visit_schedule_enrollment_id',
+            ondelete='CASCADE'),
+        primary_key=True),
+    sa.Column(
+        'cycle_id',
+        sa.Integer(),
+        sa.ForeignKey(
+            'cycle.id',
+            name='fk_visit_schedule_cycle_id',
+            ondelete='CASCADE'),
+        primary_key=True),
+    sa.Column('patient_id', sa.Integer(), nullable=False),
+    sa.Column('study_id', sa.Integer(), nullable=False),
+    sa.Column('site_id', sa.Integer(), nullable=False),
+    sa.Column('expected_date', sa.Date(), nullable=False),
+    sa.Column('window_start', sa.Date(), nullable=False),
+    # Cycles without a threshold are never missed
+    sa.Column('window_end', sa.Date()),
+    # The visit, if any, that the patient already had for the cycle
+    sa.Column('visit_id', sa.Integer()),
+    sa.Column('visit_date', sa.Date()),
+    sa.Index('ix_visit_schedule_patient_id', 'patient_id'),
+    sa.Index(
+        'ix_visit_schedule_study_id_expected_date',
+        'study_id', 'expected_date',
+        postgresql_where=sa.text('visit_id IS NULL')),
+    sa.Index(
+        'ix_visit_schedule_site_id_expected_date',
+        'site_id', 'expected_date',
+        postgresql_where=sa.text('visit_id IS NULL')))
+
+VISIT_SCHEDULE_TRIGGERS = [
+    """
+    CREATE OR REPLACE FUNCTION visit_schedule_refresh(
+      target_patients INTEGER[], target_cycles INTEGER[])
+    RETURNS VOID AS $$
+    BEGIN
+      -- NULL targets everything, an empty list nothing
+      IF target_patients = '{}' OR target_cycles = '{}' THEN
+        RETURN;
+      END IF;
+
+      DELETE FROM visit_schedule
+      WHERE (target_patients IS NULL OR patient_id = ANY(target_patients))
+      AND (target_cycles IS NULL OR cycle_id = ANY(target_cycles));
+
+      INSERT INTO visit_schedule (
+        enrollment_id, cycle_id, patient_id, study_id, site_id,
+        expected_date, window_start, window_end, visit_id, visit_date)
+      SELECT
+        enrollment.id,
+        cycle.id,
+        enrollment.patient_id,
+        enrollment.study_id,
+        patient.site_id,
+        enrollment.consent_date + cycle.week * 7,
+        enrollment.consent_date + cycle.week * 7
+          - COALESCE(cycle.threshold, 0),
+        enrollment.consent_date + cycle.week * 7 + cycle.threshold,
+        visit.id,
+        visit.visit_date
+      FROM enrollment
+      JOIN patient ON patient.id = enrollment.patient_id
+      JOIN cycle ON cycle.study_id = enrollment.study_id
+      LEFT JOIN LATERAL (
+        SELECT visit.id, visit.visit_date
+        FROM visit
+        JOIN visit_cycle ON visit_cycle.visit_id = visit.id
+        WHERE visit.patient_id = enrollment.patient_id
+        AND visit_cycle.cycle_id = cycle.id
+        ORDER BY visit.visit_date
+        LIMIT 1
+      ) AS visit ON TRUE
+      WHERE enrollment.termination_date IS NULL
+      AND cycle.week IS NOT NULL
+      AND cycle.is_interim IS NOT TRUE
+      AND (target_patients IS NULL
+           OR enrollment.patient_id = ANY(target_patients))
+      AND (target_cycles IS NULL OR cycle.id = ANY(target_cycles));
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE OR REPLACE FUNCTION visit_schedule_on_patient()
+    RETURNS TRIGGER AS $$
+    BEGIN
+      PERFORM visit_schedule_refresh(ARRAY(
+        SELECT new_rows.id
+        FROM new_rows
+        JOIN old_rows ON old_rows.id = new_rows.id
+        WHERE new_rows.site_id IS DISTINCT FROM old_rows.site_id), NULL);
+      RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE OR REPLACE FUNCTION visit_schedule_on_child()
+    RETURNS TRIGGER AS $$
+    BEGIN
+      IF TG_OP = 'INSERT' THEN
+        PERFORM visit_schedule_refresh(ARRAY(
+          SELECT DISTINCT patient_id FROM new_rows), NULL);
+      ELSE
+        PERFORM visit_schedule_refresh(ARRAY(
+          SELECT DISTINCT patient_id FROM old_rows), NULL);
+      END IF;
+      RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE OR REPLACE FUNCTION visit_schedule_on_enrollment_update()
+    RETURNS TRIGGER AS $$
+    BEGIN
+      PERFORM visit_schedule_refresh(ARRAY(
+        SELECT DISTINCT changed.patient_id
+        FROM new_rows
+        JOIN old_rows ON old_rows.id = new_rows.id
+        CROSS JOIN LATERAL (
+          VALUES (old_rows.patient_id), (new_rows.patient_id)
+        ) AS changed (patient_id)
+        WHERE (new_rows.patient_id, new_rows.study_id,
+               new_rows.consent_date, new_rows.termination_date)
+          IS DISTINCT FROM (old_rows.patient_id, old_rows.study_id,
+                            old_rows.consent_date, old_rows.termination_date)
+        ), NULL);
+      RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE OR REPLACE FUNCTION visit_schedule_on_visit_update()
+    RETURNS TRIGGER AS $$
+    BEGIN
+      PERFORM visit_schedule_refresh(ARRAY(
+        SELECT DISTINCT changed.patient_id
+        FROM new_rows
+        JOIN old_rows ON old_rows.id = new_rows.id
+        CROSS JOIN LATERAL (
+          VALUES (old_rows.patient_id), (new_rows.patient_id)
+        ) AS changed (patient_id)
+        WHERE (new_rows.patient_id, new_rows.visit_date)
+          IS DISTINCT FROM (old_rows.patient_id, old_rows.visit_date)
+        ), NULL);
+      RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE OR REPLACE FUNCTION visit_schedule_on_visit_cycle()
+    RETURNS TRIGGER AS $$
+    BEGIN
+      -- Visits deleted along with their cycles are handled by the visit
+      IF TG_OP = 'INSERT' THEN
+        PERFORM visit_schedule_refresh(ARRAY(
+          SELECT DISTINCT visit.patient_id
+          FROM new_rows
+          JOIN visit ON visit.id = new_rows.visit_id), NULL);
+      ELSE
+        PERFORM visit_schedule_refresh(ARRAY(
+          SELECT DISTINCT visit.patient_id
+          FROM old_rows
+          JOIN visit ON visit.id = old_rows.visit_id), NULL);
+      END IF;
+      RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE OR REPLACE FUNCTION visit_schedule_on_cycle()
+    RETURNS TRIGGER AS $$
+    BEGIN
+      -- Only the changed cycles' expected visits are recomputed, those of
+      -- deleted cycles are removed by the foreign key
+      IF TG_OP = 'INSERT' THEN
+        PERFORM visit_schedule_refresh(NULL, ARRAY(SELECT id FROM new_rows));
+      ELSE
+        PERFORM visit_schedule_refresh(NULL, ARRAY(
+          SELECT new_rows.id
+          FROM new_rows
+          JOIN old_rows ON old_rows.id = new_rows.id
+          WHERE (new_rows.study_id, new_rows.week,
+                 new_rows.threshold, new_rows.is_interim)
+            IS DISTINCT FROM (old_rows.study_id, old_rows.week,
+                              old_rows.threshold, old_rows.is_interim)));
+      END IF;
+      RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE TRIGGER visit_schedule_patient_update
+    AFTER UPDATE ON patient
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE visit_schedule_on_patient()
+    """,
+    """
+    CREATE TRIGGER visit_schedule_enrollment_insert
+    AFTER INSERT ON enrollment
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE visit_schedule_on_child()
+    """,
+    """
+    CREATE TRIGGER visit_schedule_enrollment_update
+    AFTER UPDATE ON enrollment
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE visit_schedule_on_enrollment_update()
+    """,
+    """
+    CREATE TRIGGER visit_schedule_enrollment_delete
+    AFTER DELETE ON enrollment
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE visit_schedule_on_child()
+    """,
+    """
+    CREATE TRIGGER visit_schedule_visit_update
+    AFTER UPDATE ON visit
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE visit_schedule_on_visit_update()
+    """,
+    """
+    CREATE TRIGGER visit_schedule_visit_delete
+    AFTER DELETE ON visit
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE visit_schedule_on_child()
+    """,
+    """
+    CREATE TRIGGER visit_schedule_visit_cycle_insert
+    AFTER INSERT ON visit_cycle
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE visit_schedule_on_visit_cycle()
+    """,
+    """
+    CREATE TRIGGER visit_schedule_visit_cycle_delete
+    AFTER DELETE ON visit_cycle
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE visit_schedule_on_visit_cycle()
+    """,
+    """
+    CREATE TRIGGER visit_schedule_cycle_insert
+    AFTER INSERT ON cycle
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE visit_schedule_on_cycle()
+    """,
+    """
+    CREATE TRIGGER visit_schedule_cycle_update
+    AFTER UPDATE ON cycle
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE visit_schedule_on_cycle()
+    """,
+]
+
+for _statement in VISIT_SCHEDULE_TRIGGERS:
+    sa.event.listen(
+        StudiesModel.metadata,
+        'after_create',
+        sa.DDL(_statement).execute_if(dialect='postgresql'))
+
+for _function in ('visit_schedule_refresh(INTEGER[], INTEGER[])',
+                  'visit_schedule_on_patient()',
+                  'visit_schedule_on_child()',
+                  'visit_schedule_on_enrollment_update()',
+                  'visit_schedule_on_visit_update()',
+                  'visit_schedule_on_visit_cycle()',
+                  'visit_schedule_on_cycle()'):
+    sa.event.listen(
+        StudiesModel.metadata,
+        'before_drop',
+        sa.DDL('DROP FUNCTION IF EXISTS %s CASCADE' % _function)
+        .execute_if(dialect='postgresql'))
+
+
 class FormFactory(object):
 
     @property
@@ -1380,3 +2131,35 @@ class Export(StudiesModel,
             sa.Index(
                 'ix_%s_owner_user_id' % cls.__tablename__,
                 cls.owner_user_id))
+
+
+# Costs of each data file written by an export (tasks.make_export) or by
+# os_export, see occams_studies.exports.metrics
+export_metric_table = sa.Table(
+    'export_metric',
+    StudiesModel.metadata,
+    sa.Column('id', sa.Integer(), primary_key=True),
+    sa.Column(
+        'export_id',
+        sa.Integer(),
+        sa.ForeignKey(
+            'export.id',
+            name='fk_export_metric_export_id',
+            ondelete='SET NULL')),
+    sa.Column('plan_name', sa.String(), nullable=False),
+    # "task" or "cli"
+    sa.Column('source', sa.String(), nullable=False),
+    sa.Column('create_date', sa.DateTime(), nullable=False),
+    # Times are in seconds
+    sa.Column('queue_wait', sa.Float()),
+    sa.Column('query_time', sa.Float(), nullable=False),
+    sa.Column('write_time', sa.Float(), nullable=False),
+    sa.Column('rows', sa.Integer(), nullable=False),
+    sa.Column('bytes', sa.BigInteger(), nullable=False),
+    # Growth of the process's peak resident memory (in bytes) while the
+    # file was written
+    sa.Column('memory_growth', sa.BigInteger()),
+    sa.Index(
+        'ix_export_metric_plan_name_create_date', 'plan_name', 'create_date'),
+    sa.Index('ix_export_metric_create_date', 'create_date'),
+    sa.Index('ix_export_metric_export_id', 'export_id'))
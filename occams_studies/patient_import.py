@@ -0,0 +1,336 @@
+"""
+Bulk import of patient rosters
+
+Partner sites joining a study bring along their existing rosters, often
+tens of thousands of patients long. Rosters are supplied either as CSV
+files (a SITE column followed by one column per reference type) or as
+JSON lists of ``{"site": ..., "references": {type: number}}`` records.
+
+As with randomization lists, rosters are validated in a single pass
+using set-based queries and then loaded in chunks of multi-row INSERT
+statements, along with the PHI forms every new patient starts with.
+"""
+
+try:
+    import unicodecsv as csv
+except ImportError:  # pragma: nocover
+    import csv  # NOQA (py3, hopefully)
+from datetime import date
+import json
+
+import six
+import sqlalchemy as sa
+
+from occams_datastore import models as datastore
+from occams_roster import generate
+
+from . import _, models
+from .bulk import \
+    audit_values, chunked, insert_entities, insert_many, reserve_ids, \
+    UploadError
+
+
+#: Number of rows checked/loaded at a time
+CHUNK_SIZE = 1000
+
+#: Validation stops reporting problems past this amount
+MAX_ERRORS = 100
+
+
+class PatientList(object):
+    """
+    A CSV or JSON patient roster to import
+
+    Attributes:
+    sites -- available sites by name
+    reference_types -- available reference types by (upper-cased) name
+    """
+
+    def __init__(self, db_session, fileobj):
+        self.db_session = db_session
+        self.fileobj = fileobj
+        self.sites = dict(
+            (site.name, site) for site in db_session.query(models.Site))
+        self.reference_types = dict(
+            (type_.name.upper(), type_)
+            for type_ in db_session.query(models.ReferenceType))
+        self.format = self._read_format()
+
+    def _read_format(self):
+        """
+        Checks that the file is either a JSON list or a CSV file with
+        the required columns
+
+        Returns either ``json`` or ``csv``
+        """
+        self.fileobj.seek(0)
+        head = self.fileobj.read(1024)
+        if isinstance(head, six.binary_type):
+            head = head.decode('utf-8', 'replace')
+        self.fileobj.seek(0)
+
+        if head.lstrip().startswith(u'['):
+            return 'json'
+
+        try:
+            csv.Sniffer().sniff(head)
+        except csv.Error:
+            raise UploadError(_(u'Invalid file-type, must be CSV or JSON'))
+
+        reader = csv.reader(self.fileobj)
+        header = [name.upper() for name in next(reader, [])]
+
+        if u'SITE' not in header:
+            raise UploadError(_(
+                u'File upload is missing the following columns ${columns}',
+                mapping={'columns': u'SITE'}))
+
+        unknown = [name for name in header
+                   if name != u'SITE' and name not in self.reference_types]
+        if unknown:
+            raise UploadError(_(
+                u'Unknown reference types ${columns}',
+                mapping={'columns': u', '.join(unknown)}))
+
+        return 'csv'
+
+    def rows(self):
+        """
+        Streams the roster as (line number, record) pairs
+
+        Records are dictionaries with the site name and a dictionary of
+        reference numbers keyed by reference type name. CSV rows with more
+        cells than the header also carry the ``extra`` cells.
+        """
+        self.fileobj.seek(0)
+
+        if self.format == 'json':
+            try:
+                records = json.load(self.fileobj)
+            except ValueError:
+                raise UploadError(_(u'Invalid JSON'))
+            if not isinstance(records, list):
+                raise UploadError(_(u'Invalid JSON'))
+            return enumerate(records, start=1)
+
+        def read():
+            # Line 1 is the header
+            for line, row in enumerate(csv.DictReader(self.fileobj), start=2):
+                site = None
+                references = {}
+                # Cells past the header are listed under the key ``None``
+                extra = row.pop(None, None)
+                for key, value in row.items():
+                    if key.upper() == u'SITE':
+                        site = value
+                    elif value:
+                        references[key] = value
+                record = {'site': site, 'references': references}
+                if extra:
+                    record['extra'] = extra
+                yield line, record
+
+        return read()
+
+    def parse(self, record):
+        """
+        Resolves a roster record
+
+        Returns a tuple of (site, references, problems) where
+        ``references`` is a list of (reference type, number) pairs and
+        ``problems`` is a list of (column, message) pairs.
+        """
+        problems = []
+
+        if not isinstance(record, dict):
+            return None, [], [(None, _(u'Invalid record'))]
+
+        if record.get('extra'):
+            problems.append((None, _(u'Too many columns')))
+
+        site = self.sites.get(record.get('site'))
+        if site is None:
+            problems.append((u'SITE', _(
+                u'Site ${site} does not exist',
+                mapping={'site': record.get('site')})))
+
+        references = []
+        items = record.get('references') or {}
+        if not isinstance(items, dict):
+            items = {}
+            problems.append((None, _(u'Invalid references')))
+
+        for name, number in sorted(items.items()):
+            type_ = self.reference_types.get(name.upper())
+            number = six.text_type(number)
+            if type_ is None:
+                problems.append((name, _(
+                    u'Unknown reference type ${name}',
+                    mapping={'name': name})))
+            elif not type_.check(number):
+                problems.append((name, _(u'Invalid format')))
+            else:
+                references.append((type_, number))
+
+        return site, references, problems
+
+    def validate(self, is_allowed=None, progress=None):
+        """
+        Checks every row without loading anything
+
+        Arguments:
+        is_allowed -- (optional) called with a site, returns whether
+                      patients may be added to the site
+        progress -- (optional) called with the number of rows checked
+
+        Returns a tuple of (number of rows, problems)
+        """
+        db_session = self.db_session
+        errors = []
+        seen = set()
+        allowed = {}
+        total = 0
+
+        def report(line, column, message):
+            if len(errors) < MAX_ERRORS:
+                errors.append({
+                    'line': line,
+                    'column': column,
+                    'message': message})
+
+        for chunk in chunked(self.rows(), CHUNK_SIZE):
+            lines = {}
+
+            for line, record in chunk:
+                site, references, problems = self.parse(record)
+
+                for column, message in problems:
+                    report(line, column, message)
+
+                if site is not None and is_allowed is not None:
+                    if site.id not in allowed:
+                        allowed[site.id] = is_allowed(site)
+                    if not allowed[site.id]:
+                        report(line, u'SITE', _(
+                            u'You do not belong to this site'))
+
+                for type_, number in references:
+                    key = (type_.id, number)
+                    if key in seen:
+                        report(line, type_.name, _(
+                            u'Reference ${number} is repeated in the file',
+                            mapping={'number': number}))
+                    else:
+                        seen.add(key)
+                        lines[key] = (line, type_.name)
+
+            if lines:
+                existing = (
+                    db_session.query(
+                        models.PatientReference.reference_type_id,
+                        models.PatientReference.reference_number)
+                    .filter(sa.tuple_(
+                        models.PatientReference.reference_type_id,
+                        models.PatientReference.reference_number
+                    ).in_(list(lines))))
+
+                for key in existing:
+                    line, column = lines[tuple(key)]
+                    report(line, column, _(u'Already assigned'))
+
+            total += len(chunk)
+
+            if progress is not None:
+                progress(total)
+
+        return total, sorted(errors, key=lambda e: e['line'])
+
+    def load(self, progress=None, user=None):
+        """
+        Loads the (validated) roster in chunks of set-based INSERTs
+
+        Each row generates a patient with a newly reserved PID, its
+        references and the pending PHI forms new patients start with.
+
+        Arguments:
+        progress -- (optional) called with the number of rows loaded
+        user -- (optional) the user to blame for the new records
+
+        Returns the PIDs of the new patients
+        """
+        db_session = self.db_session
+        audit = audit_values(db_session, user)
+        today = date.today()
+
+        patient_table = models.Patient.__table__
+
+        pending_entry = (
+            db_session.query(datastore.State)
+            .filter_by(name=u'pending-entry')
+            .one())
+
+        schema_ids = [
+            schema_id for (schema_id,)
+            in db_session.query(models.patient_schema_table.c.schema_id)]
+
+        pids = []
+
+        for chunk in chunked(self.rows(), CHUNK_SIZE):
+            parsed = []
+
+            for line, record in chunk:
+                site, references, problems = self.parse(record)
+                if problems:
+                    column, message = problems[0]
+                    raise UploadError(message, [{
+                        'line': line, 'column': column, 'message': message}])
+                parsed.append((site, references))
+
+            chunk_pids = reserve_pids(
+                db_session, [site for site, references in parsed])
+            patient_ids = reserve_ids(db_session, patient_table, len(parsed))
+
+            insert_many(db_session, patient_table, [
+                dict(audit, id=patient_id, site_id=site.id, pid=pid)
+                for (site, references), patient_id, pid
+                in zip(parsed, patient_ids, chunk_pids)])
+
+            insert_many(db_session, models.PatientReference.__table__, [
+                dict(
+                    audit,
+                    patient_id=patient_id,
+                    reference_type_id=type_.id,
+                    reference_number=number)
+                for (site, references), patient_id
+                in zip(parsed, patient_ids)
+                for type_, number in references])
+
+            insert_entities(
+                db_session,
+                [{'schema_id': schema_id,
+                  'state_id': pending_entry.id,
+                  'collect_date': today}
+                 for patient_id in patient_ids
+                 for schema_id in schema_ids],
+                [[(patient_table.name, patient_id)]
+                 for patient_id in patient_ids
+                 for schema_id in schema_ids],
+                audit)
+
+            pids.extend(chunk_pids)
+
+            if progress is not None:
+                progress(len(pids))
+
+        return pids
+
+
+def reserve_pids(db_session, sites):
+    """
+    Reserves a block of PIDs, one for each of the given (patient) sites
+
+    The roster issues PIDs one at a time, so they are reserved for the
+    whole block before any of the patients are inserted. PIDs reserved for
+    a load that fails are wasted, same as for individually added patients.
+    """
+    return [six.text_type(generate(db_session, site.name)) for site in sites]
@@ -0,0 +1,301 @@
+"""
+Request profiling
+
+A tween samples a fraction of requests and records, for each route, the
+distribution of:
+
+    latency -- time to handle the request (milliseconds)
+    sql_count -- number of SQL statements executed
+    sql_time -- time spent executing SQL statements (milliseconds)
+    serialize -- time spent rendering JSON (milliseconds)
+
+Distributions are kept in redis as HDR-style histograms, that is, values
+are counted in logarithmic buckets that are each ``GROWTH`` times wider
+than the last, so percentiles are accurate to within that ratio regardless
+of magnitude. Administrators can see a summary at ``/settings/profiling``
+(see ``views.settings.profiling_json``).
+
+Administrators may also capture a full cProfile dump of a single request
+by sending an ``X-Profile`` header or a ``_profile`` query parameter. The
+dump is written to ``studies.export.dir`` and its name returned in the
+``X-Profile-File`` response header.
+
+Settings::
+
+    studies.profiling.sample_rate = 0.05
+
+Sampling is disabled by default.
+"""
+
+from contextlib import contextmanager
+import cProfile
+from datetime import datetime
+import math
+import os
+import random
+import threading
+from timeit import default_timer
+import uuid
+
+from pyramid.tweens import INGRESS
+from redis.exceptions import RedisError
+import six
+import sqlalchemy as sa
+
+from . import log, models
+
+
+#: Ratio of the upper bounds of consecutive histogram buckets
+GROWTH = 1.05
+
+#: Reported percentiles
+PERCENTILES = (50, 90, 99)
+
+#: Recorded metrics
+METRICS = ('latency', 'sql_count', 'sql_time', 'serialize')
+
+ROUTES_KEY = 'studies:profile:routes'
+
+# Profile of the request being handled by the current thread (or greenlet)
+_local = threading.local()
+
+
+def includeme(config):
+    settings = config.registry.settings
+
+    settings['studies.profiling.sample_rate'] = \
+        float(settings.get('studies.profiling.sample_rate') or 0)
+
+    instrument_sql()
+
+    config.add_tween(
+        'occams_studies.profiling.profiling_tween_factory', under=INGRESS)
+
+
+def instrument_sql():
+    """
+    Times the SQL statements executed by every engine (only while a
+    request is being profiled)
+    """
+    if not sa.event.contains(
+            sa.engine.Engine, 'before_cursor_execute', before_cursor_execute):
+        sa.event.listen(
+            sa.engine.Engine, 'before_cursor_execute', before_cursor_execute)
+        sa.event.listen(
+            sa.engine.Engine, 'after_cursor_execute', after_cursor_execute)
+
+
+def histogram_key(route_name, metric):
+    return 'studies:profile:{0}:{1}'.format(route_name, metric)
+
+
+def bucket(value):
+    """
+    Returns the histogram bucket of a (positive) value
+    """
+    if value <= 1:
+        return 0
+    return int(math.ceil(math.log(value, GROWTH)))
+
+
+def bucket_value(index):
+    """
+    Returns the upper bound of a histogram bucket
+    """
+    return GROWTH ** index if index > 0 else 1
+
+
+class Profile(object):
+    """
+    Measurements of a single request
+    """
+
+    def __init__(self):
+        self.metrics = dict.fromkeys(METRICS, 0)
+
+    def add(self, metric, value):
+        self.metrics[metric] += value
+
+
+def current():
+    """
+    Returns the profile of the request being handled, if it is sampled
+    """
+    return getattr(_local, 'profile', None)
+
+
+@contextmanager
+def timer(metric):
+    """
+    Adds the time (in milliseconds) spent in the block to a metric of the
+    current profile, if any
+    """
+    profile = current()
+    if profile is None:
+        yield
+        return
+    start = default_timer()
+    try:
+        yield
+    finally:
+        profile.add(metric, (default_timer() - start) * 1000)
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    if current() is not None:
+        conn.info.setdefault('studies_profile_start', []).append(
+            default_timer())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context,
+                         executemany):
+    profile = current()
+    starts = conn.info.get('studies_profile_start')
+    if profile is not None and starts:
+        profile.add('sql_count', 1)
+        profile.add('sql_time', (default_timer() - starts.pop()) * 1000)
+
+
+def record(redis, route_name, profile):
+    """
+    Adds a request's measurements to the histograms of its route
+    """
+    pipeline = redis.pipeline(transaction=False)
+    pipeline.sadd(ROUTES_KEY, route_name)
+    for metric, value in profile.metrics.items():
+        pipeline.hincrby(histogram_key(route_name, metric), bucket(value), 1)
+    pipeline.execute()
+
+
+def percentiles(histogram):
+    """
+    Summarizes a histogram (as stored in redis)
+    """
+    counts = sorted(
+        (int(index), int(count)) for index, count in histogram.items())
+    total = sum(count for index, count in counts)
+
+    summary = {'count': total}
+
+    if not total:
+        return summary
+
+    for percentile in PERCENTILES:
+        rank = total * percentile / 100.0
+        seen = 0
+        for index, count in counts:
+            seen += count
+            if seen >= rank:
+                break
+        summary['p{0}'.format(percentile)] = round(bucket_value(index), 2)
+
+    summary['max'] = round(bucket_value(counts[-1][0]), 2)
+    return summary
+
+
+def summarize(redis):
+    """
+    Returns the distributions of every profiled route, slowest first
+    """
+    route_names = sorted(
+        name.decode('utf-8') if isinstance(name, bytes) else name
+        for name in redis.smembers(ROUTES_KEY))
+
+    pipeline = redis.pipeline(transaction=False)
+    for route_name in route_names:
+        for metric in METRICS:
+            pipeline.hgetall(histogram_key(route_name, metric))
+    histograms = iter(pipeline.execute())
+
+    routes = []
+    for route_name in route_names:
+        route = {'name': route_name}
+        for metric in METRICS:
+            route[metric] = percentiles(next(histograms))
+        route['count'] = route['latency']['count']
+        routes.append(route)
+
+    routes.sort(key=lambda r: r['latency'].get('p99', 0), reverse=True)
+    return routes
+
+
+def reset(redis):
+    """
+    Discards all recorded measurements
+    """
+    route_names = redis.smembers(ROUTES_KEY)
+    keys = [
+        histogram_key(
+            name.decode('utf-8') if isinstance(name, bytes) else name,
+            metric)
+        for name in route_names
+        for metric in METRICS]
+    redis.delete(ROUTES_KEY, *keys)
+
+
+def wants_capture(request):
+    """
+    Determines whether an administrator asked to profile the request
+    """
+    return (
+        ('X-Profile' in request.headers or '_profile' in request.GET)
+        and request.has_permission('admin', models.RootFactory(request)))
+
+
+def capture(handler, request):
+    """
+    Handles a request under cProfile and writes the dump to the export
+    directory
+    """
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        response = handler(request)
+    finally:
+        profiler.disable()
+
+    route = request.matched_route
+    name = 'profile-{0}-{1:%Y%m%d%H%M%S}-{2}.prof'.format(
+        route.name if route else 'none',
+        datetime.now(),
+        uuid.uuid4().hex[:8])
+    export_dir = request.registry.settings['studies.export.dir']
+    profiler.dump_stats(os.path.join(export_dir, name))
+
+    response.headers['X-Profile-File'] = six.text_type(name)
+    return response
+
+
+def profiling_tween_factory(handler, registry):
+    sample_rate = registry.settings['studies.profiling.sample_rate']
+
+    def profiling_tween(request):
+        capturing = wants_capture(request)
+
+        if not capturing and random.random() >= sample_rate:
+            return handler(request)
+
+        _local.profile = profile = Profile()
+        start = default_timer()
+
+        try:
+            if capturing:
+                response = capture(handler, request)
+            else:
+                response = handler(request)
+        finally:
+            _local.profile = None
+
+        profile.add('latency', (default_timer() - start) * 1000)
+
+        route = request.matched_route
+        if route is not None and route.name.startswith('studies.'):
+            try:
+                record(request.redis, route.name, profile)
+            except RedisError as e:
+                log.warn('Could not record profile: {0!r}'.format(e))
+
+        return response
+
+    return profiling_tween
@@ -0,0 +1,448 @@
+"""
+Bulk loading of randomization lists
+
+Statisticians supply randomization lists as CSV files with one
+pre-generated assignment (RANDID) per row, followed by the criteria the
+assignment is intended for. Lists can be tens of thousands of rows long,
+so they are validated in a single streaming pass and then loaded in
+chunks using set-based INSERT statements rather than through the ORM.
+
+Unassigned strata are also indexed by a hash of their criteria in the
+``stratum_allocation`` table, so randomizing a patient only needs to claim
+the first entry for the patient's criteria instead of searching every
+stratum's randomization data.
+"""
+
+try:
+    import unicodecsv as csv
+except ImportError:  # pragma: nocover
+    import csv  # NOQA (py3, hopefully)
+from collections import defaultdict
+from datetime import date, datetime
+from decimal import Decimal, InvalidOperation
+import hashlib
+import json
+
+from dateutil.parser import parse as parse_datetime
+import six
+import sqlalchemy as sa
+from zope.sqlalchemy import mark_changed
+
+from occams_datastore import models as datastore
+
+from . import _, models
+from .bulk import \
+    audit_values, chunked, insert_entities, insert_many, reserve_ids, \
+    UploadError
+
+
+#: Columns that describe the stratum, the rest are randomization criteria
+STRATUM_KEYS = ['ARM', 'BLOCKID', 'RANDID']
+
+#: Number of rows checked/loaded at a time
+CHUNK_SIZE = 1000
+
+#: Validation stops reporting problems past this amount
+MAX_ERRORS = 100
+
+
+class RandomizationList(object):
+    """
+    A randomization list CSV file uploaded for a study
+    """
+
+    def __init__(self, study, fileobj):
+        self.study = study
+        self.fileobj = fileobj
+        self.attributes = dict(
+            (name.upper(), attribute)
+            for name, attribute
+            in study.randomization_schema.attributes.items())
+        self.fieldnames = self._read_header()
+
+    def _read_header(self):
+        """
+        Checks that the file is a CSV containing all the required columns
+
+        Returns a case-insensitive mapping of the file's column names
+        """
+        self.fileobj.seek(0)
+
+        try:
+            csv.Sniffer().sniff(self.fileobj.read(1024))
+        except csv.Error:
+            raise UploadError(_(u'Invalid file-type, must be CSV'))
+        else:
+            self.fileobj.seek(0)
+
+        reader = csv.DictReader(self.fileobj)
+        fieldnames = dict((name.upper(), name) for name in reader.fieldnames)
+
+        required = STRATUM_KEYS + \
+            list(self.study.randomization_schema.attributes.keys())
+        missing = [name for name in required
+                   if name.upper() not in fieldnames]
+        if missing:
+            raise UploadError(_(
+                u'File upload is missing the following columns ${columns}',
+                mapping={'columns': ', '.join(missing)}))
+
+        return fieldnames
+
+    def rows(self):
+        """
+        Streams the file contents as (line number, row) pairs
+        """
+        self.fileobj.seek(0)
+        # Line 1 is the header
+        return enumerate(csv.DictReader(self.fileobj), start=2)
+
+    def _get(self, row, key):
+        return row[self.fieldnames[key]] or u''
+
+    def parse(self, row):
+        """
+        Converts a CSV row to database values
+
+        Returns a tuple of (stratum, values, problems) where ``problems``
+        is a list of (column, message) pairs.
+        """
+        problems = []
+
+        stratum = {
+            'arm': self._get(row, 'ARM'),
+            'label': (self._get(row, 'STRATA')
+                      if 'STRATA' in self.fieldnames else None),
+            'block_number': None,
+            'randid': self._get(row, 'RANDID'),
+            'criteria': {},
+        }
+
+        if not stratum['arm']:
+            problems.append(('ARM', _(u'Missing arm')))
+
+        if not stratum['randid']:
+            problems.append(('RANDID', _(u'Missing reference number')))
+
+        try:
+            stratum['block_number'] = int(self._get(row, 'BLOCKID'))
+        except ValueError:
+            problems.append(('BLOCKID', _(u'Not a valid block number')))
+
+        values = []
+
+        for key, attribute in self.attributes.items():
+            raw = self._get(row, key)
+            if not raw:
+                stratum['criteria'][attribute.name] = None
+                continue
+            try:
+                value = convert(attribute, raw)
+            except ValueError as e:
+                problems.append((self.fieldnames[key], e.args[0]))
+            else:
+                values.append((attribute, value))
+                # Criteria refer to choices by name, as entered in forms
+                stratum['criteria'][attribute.name] = \
+                    raw if attribute.type == 'choice' else value
+
+        return stratum, values, problems
+
+    def validate(self, db_session, progress=None):
+        """
+        Checks every row of the file without loading anything
+
+        Arguments:
+        db_session -- the current database session
+        progress -- (optional) called with the number of rows checked
+
+        Returns a tuple of (number of rows, problems)
+        """
+        errors = []
+        seen = set()
+        total = 0
+
+        def report(line, column, message):
+            if len(errors) < MAX_ERRORS:
+                errors.append({
+                    'line': line,
+                    'column': column,
+                    'message': message})
+
+        for chunk in chunked(self.rows(), CHUNK_SIZE):
+            lines = {}
+
+            for line, row in chunk:
+                stratum, values, problems = self.parse(row)
+                for column, message in problems:
+                    report(line, column, message)
+                randid = stratum['randid']
+                if not randid:
+                    continue
+                if randid in seen:
+                    report(line, 'RANDID', _(
+                        u'Reference number ${randid} is repeated in the file',
+                        mapping={'randid': randid}))
+                else:
+                    seen.add(randid)
+                    lines[randid] = line
+
+            if lines:
+                existing = (
+                    db_session.query(models.Stratum.reference_number)
+                    .filter(models.Stratum.study_id == self.study.id)
+                    .filter(
+                        models.Stratum.reference_number.in_(list(lines))))
+
+                for (randid,) in existing:
+                    report(lines[randid], 'RANDID', _(
+                        u'Reference number ${randid} already exists',
+                        mapping={'randid': randid}))
+
+            total += len(chunk)
+
+            if progress is not None:
+                progress(total)
+
+        return total, sorted(errors, key=lambda e: e['line'])
+
+    def load(self, db_session, progress=None, user=None):
+        """
+        Loads the (validated) file in chunks of set-based INSERTs
+
+        Each row generates a stratum, and a randomization entity with its
+        values attached to the stratum. The stratum is also added to the
+        allocation index under its criteria.
+
+        Arguments:
+        db_session -- the current database session
+        progress -- (optional) called with the number of rows loaded
+        user -- (optional) the user to blame for the new records
+
+        Returns the number of rows loaded
+        """
+        study = self.study
+        schema = study.randomization_schema
+        audit = audit_values(db_session, user)
+        today = date.today()
+
+        stratum_table = models.Stratum.__table__
+
+        # Default to complete state since they're generated by a statistician
+        complete = (
+            db_session.query(datastore.State)
+            .filter_by(name=u'complete')
+            .one())
+
+        arms = dict((arm.name, arm) for arm in study.arms)
+        count = 0
+
+        for chunk in chunked(self.rows(), CHUNK_SIZE):
+            parsed = []
+
+            for line, row in chunk:
+                stratum, values, problems = self.parse(row)
+                if problems:
+                    column, message = problems[0]
+                    raise UploadError(message, [{
+                        'line': line, 'column': column, 'message': message}])
+                parsed.append((stratum, values))
+
+            # Only a handful of arms ever exist, so these go through the ORM
+            for stratum, values in parsed:
+                if stratum['arm'] not in arms:
+                    arms[stratum['arm']] = models.Arm(
+                        study=study, name=stratum['arm'], title=stratum['arm'])
+                    db_session.add(arms[stratum['arm']])
+            db_session.flush()
+
+            stratum_ids = reserve_ids(db_session, stratum_table, len(parsed))
+
+            insert_many(db_session, stratum_table, [
+                dict(
+                    audit,
+                    id=stratum_id,
+                    study_id=study.id,
+                    arm_id=arms[stratum['arm']].id,
+                    label=stratum['label'],
+                    block_number=stratum['block_number'],
+                    reference_number=stratum['randid'])
+                for (stratum, values), stratum_id
+                in zip(parsed, stratum_ids)])
+
+            entity_ids = insert_entities(
+                db_session,
+                [{'schema_id': schema.id,
+                  'state_id': complete.id,
+                  'collect_date': today}] * len(parsed),
+                [[(stratum_table.name, stratum_id)]
+                 for stratum_id in stratum_ids],
+                audit)
+
+            allocation_rows = []
+            value_rows = defaultdict(list)
+
+            for (stratum, values), stratum_id, entity_id \
+                    in zip(parsed, stratum_ids, entity_ids):
+                criteria = canonical_criteria(
+                    schema.attributes, stratum['criteria'])
+                allocation_rows.append({
+                    'stratum_id': stratum_id,
+                    'study_id': study.id,
+                    'criteria': criteria,
+                    'criteria_hash': hash_criteria(criteria)})
+                for attribute, value in values:
+                    value_rows[attribute.type].append(dict(
+                        audit,
+                        entity_id=entity_id,
+                        attribute_id=attribute.id,
+                        value=value))
+
+            for type_, rows in value_rows.items():
+                table = datastore.nameModelMap[type_].__table__
+                insert_many(db_session, table, rows)
+            insert_many(
+                db_session, models.stratum_allocation_table, allocation_rows)
+
+            count += len(parsed)
+
+            if progress is not None:
+                progress(count)
+
+        return count
+
+
+def canonical_criteria(attributes, data):
+    """
+    Returns randomization criteria as canonical (comparable) text
+
+    The same criteria may come from an uploaded file or from a submitted
+    randomization form, so values are normalized by attribute type.
+
+    Arguments:
+    attributes -- the randomization schema's attributes, by name
+    data -- the criteria values by attribute name, choices by name
+
+    Migration 4b9e2d61c0a7 indexes existing strata the same way, so the two
+    must be kept in step.
+    """
+    criteria = {}
+    for name, attribute in attributes.items():
+        value = data.get(name)
+        if value is None or value == u'':
+            value = None
+        elif attribute.type == 'number':
+            value = u'{0:f}'.format(Decimal(str(value)).normalize())
+        elif attribute.type == 'date':
+            if isinstance(value, datetime):
+                value = value.date()
+            value = value.isoformat()
+        elif attribute.type == 'datetime':
+            value = value.isoformat()
+        else:
+            value = six.text_type(value)
+        criteria[name] = value
+    return six.text_type(json.dumps(criteria, sort_keys=True))
+
+
+def hash_criteria(criteria):
+    """
+    Returns the allocation index key for canonical criteria text
+    """
+    return hashlib.sha1(criteria.encode('utf-8')).hexdigest()
+
+
+def allocate_stratum(db_session, study, data):
+    """
+    Claims the next unassigned stratum matching the randomization criteria
+
+    The lookup is a single index probe. Entries claimed by concurrent
+    randomizations are locked until their transaction completes, and are
+    skipped rather than waited on (or worse, assigned twice).
+
+    Arguments:
+    db_session -- the current database session
+    study -- the study being randomized into
+    data -- the randomization form data
+
+    Returns the claimed stratum or None if the criteria are depleted
+    """
+    table = models.stratum_allocation_table
+    criteria = canonical_criteria(study.randomization_schema.attributes, data)
+
+    query = (
+        sa.select([table.c.stratum_id])
+        .where(table.c.study_id == study.id)
+        .where(table.c.criteria_hash == hash_criteria(criteria))
+        .where(table.c.criteria == criteria)
+        .order_by(table.c.stratum_id.asc())
+        .limit(1)
+        .suffix_with('FOR UPDATE SKIP LOCKED'))
+
+    stratum_id = db_session.execute(query).scalar()
+
+    if stratum_id is None:
+        return None
+
+    db_session.execute(table.delete().where(table.c.stratum_id == stratum_id))
+    mark_changed(db_session)
+
+    return db_session.query(models.Stratum).filter_by(id=stratum_id).one()
+
+
+def remaining_strata(db_session, study):
+    """
+    Returns the number of unassigned strata left for each set of criteria
+    """
+    table = models.stratum_allocation_table
+    query = (
+        db_session.query(
+            table.c.criteria,
+            sa.func.count().label('remaining'))
+        .filter(table.c.study_id == study.id)
+        .group_by(table.c.criteria_hash, table.c.criteria)
+        .order_by(table.c.criteria))
+    return [(json.loads(criteria), remaining)
+            for criteria, remaining in query]
+
+
+def convert(attribute, raw):
+    """
+    Converts a raw CSV value to what the datastore stores for the attribute
+
+    Raises ValueError with a translatable message if the value is invalid.
+    """
+    if attribute.type == 'choice':
+        try:
+            return attribute.choices[raw].id
+        except KeyError:
+            raise ValueError(_(
+                u'"${value}" is not a valid choice',
+                mapping={'value': raw}))
+    elif attribute.type == 'number':
+        try:
+            return Decimal(raw)
+        except InvalidOperation:
+            raise ValueError(_(
+                u'"${value}" is not a valid number',
+                mapping={'value': raw}))
+    elif attribute.type == 'date':
+        try:
+            return datetime.strptime(raw, '%Y-%m-%d')
+        except ValueError:
+            raise ValueError(_(
+                u'"${value}" is not a valid date',
+                mapping={'value': raw}))
+    elif attribute.type == 'datetime':
+        try:
+            return parse_datetime(raw)
+        except (ValueError, OverflowError):
+            raise ValueError(_(
+                u'"${value}" is not a valid date/time',
+                mapping={'value': raw}))
+    elif attribute.type in ('string', 'text'):
+        return raw
+    else:
+        raise ValueError(_(
+            u'Values of type ${type} cannot be uploaded',
+            mapping={'type': attribute.type}))
@@ -0,0 +1,141 @@
+"""
+Fast JSON renderer
+
+Large responses (full codebooks, patients with hundreds of forms) spend a
+good share of their time being serialized, so JSON views use this renderer
+instead of Pyramid's stock ``json`` renderer::
+
+    @view_config(..., renderer='fastjson')
+
+It encodes with ``simplejson``'s C speedups (or ``orjson``, where it can be
+installed, i.e. Python 3), and natively handles dates, datetimes
+(ISO 8601), decimals and translation strings (translated for the request
+by ``orjson``, ``simplejson`` encodes them untranslated). Objects with a
+``__json__(request)`` method are supported as with the stock renderer.
+
+Views may return ``stream(items)`` to send a long list as a chunked JSON
+array, which is encoded a chunk at a time as it is sent rather than into a
+single string.
+"""
+
+from datetime import date, datetime
+from decimal import Decimal
+
+from pyramid.i18n import TranslationString
+import simplejson
+import six
+
+try:
+    import orjson
+except ImportError:  # pragma: nocover
+    orjson = None
+
+from . import profiling
+from .bulk import chunked
+
+
+#: Number of items encoded at a time by a streamed array
+CHUNK_SIZE = 500
+
+
+def includeme(config):
+    config.add_renderer('fastjson', renderer_factory)
+
+
+class stream(object):
+    """
+    Marks a list to be sent as a chunked JSON array
+
+    The items are encoded while the response is sent, which is after the
+    view's transaction ends, so they must already be loaded (e.g. a list of
+    rows or dictionaries, not a query).
+    """
+
+    def __init__(self, items, chunk_size=CHUNK_SIZE):
+        self.items = items
+        self.chunk_size = chunk_size
+
+    def __iter__(self):
+        return iter(self.items)
+
+
+def make_default(request=None):
+    """
+    Returns the function encoding values neither encoder supports natively
+    """
+    localizer = getattr(request, 'localizer', None)
+
+    def default(obj):
+        if isinstance(obj, TranslationString):
+            if localizer is not None:
+                return localizer.translate(obj)
+            return obj.interpolate()
+        if isinstance(obj, (datetime, date)):
+            return obj.isoformat()
+        if isinstance(obj, Decimal):
+            return float(obj)
+        if hasattr(obj, '__json__'):
+            return obj.__json__(request)
+        # orjson leaves subclasses of builtin types to us
+        # (so that translation strings can be translated)
+        if isinstance(obj, six.text_type):
+            return six.text_type(obj)
+        if isinstance(obj, dict):
+            return dict(obj)
+        if isinstance(obj, (list, tuple)):
+            return list(obj)
+        if isinstance(obj, six.integer_types):
+            return int(obj)
+        raise TypeError('{0!r} is not JSON serializable'.format(obj))
+
+    return default
+
+
+def dumps(value, request=None):
+    """
+    Encodes a value as JSON (in bytes)
+    """
+    default = make_default(request)
+    if orjson is not None:
+        return orjson.dumps(
+            value,
+            default=default,
+            option=orjson.OPT_PASSTHROUGH_SUBCLASS | orjson.OPT_NON_STR_KEYS)
+    # Named tuples are encoded as arrays, as the stock renderer does
+    return simplejson.dumps(
+        value,
+        default=default,
+        namedtuple_as_object=False).encode('utf-8')
+
+
+def iter_array(value, request=None):
+    """
+    Yields a streamed list as a JSON array, a chunk at a time
+    """
+    separator = b'['
+    for chunk in chunked(value.items, value.chunk_size):
+        # Encode the chunk as an array and splice in its items
+        yield separator + dumps(chunk, request)[1:-1]
+        separator = b','
+    yield b'[]' if separator == b'[' else b']'
+
+
+def renderer_factory(info):
+    def render(value, system):
+        request = system.get('request')
+
+        if request is not None:
+            response = request.response
+            if response.content_type == response.default_content_type:
+                response.content_type = 'application/json'
+
+        if isinstance(value, stream):
+            if request is None:
+                return b''.join(iter_array(value))
+            # Pyramid sends iterables as the response's app_iter
+            return iter_array(value, request)
+
+        with profiling.timer('serialize'):
+            return dumps(value, request)
+
+    return render
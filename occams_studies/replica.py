@@ -0,0 +1,242 @@
+"""
+Read-replica routing
+
+Exports and read-heavy pages (search, dashboards, codebooks) can take a
+while. Against the primary database they hold on to an old snapshot,
+which blocks vacuum and competes with data entry, so they may instead be
+pointed at a streaming replica::
+
+    studies.db.replica_url = postgresql://occams@replica/occams
+    studies.db.replica_max_lag = 30
+
+The replica is only used if it can be reached and is no more than
+``studies.db.replica_max_lag`` seconds behind, otherwise reads fall back
+to the primary. The lag is measured at most once every ``LAG_TTL``
+seconds per process, rather than on every request.
+
+Reads that must see a change just committed on the primary (e.g. exports
+of freshly refreshed reports) pass the primary's WAL location along, and
+only use the replica once it has replayed up to that location.
+"""
+
+from contextlib import contextmanager
+import time
+from timeit import default_timer
+
+import sqlalchemy as sa
+from sqlalchemy import orm
+
+from . import log
+
+
+#: Default maximum replication lag (in seconds)
+MAX_LAG = 30
+
+#: How long (in seconds) a measured replication lag is reused
+LAG_TTL = 5
+
+#: How long (in seconds) to wait for the replica to replay a commit
+REPLAY_TIMEOUT = 5
+
+#: How often (in seconds) to check whether the replica replayed a commit
+REPLAY_INTERVAL = 0.1
+
+# Engines are shared by all requests/tasks using the same replica
+_engines = {}
+
+# Last lag measured on each replica (by URL) as (time measured, lag)
+_lags = {}
+
+
+def includeme(config):
+    settings = config.registry.settings
+
+    if 'studies.db.replica_max_lag' in settings:
+        settings['studies.db.replica_max_lag'] = \
+            int(settings['studies.db.replica_max_lag'])
+
+    config.add_request_method(
+        read_db_session, name='read_db_session', reify=True)
+
+
+def get_engine(settings):
+    """
+    Returns the replica engine or None if no replica is configured
+    """
+    url = settings.get('studies.db.replica_url')
+    if not url:
+        return None
+    if url not in _engines:
+        _engines[url] = sa.create_engine(url)
+    return _engines[url]
+
+
+def replica_lag(connection):
+    """
+    Returns how far (in seconds) the replica is behind the primary
+
+    A database that is not replicating (e.g. the primary itself) has no
+    lag. The lag is measured from the last replayed transaction, so an
+    idle primary makes the replica appear to lag, in which case reads
+    safely fall back to the primary.
+    """
+    return connection.execute(sa.text(u"""
+        SELECT CASE
+          WHEN NOT pg_is_in_recovery() THEN 0
+          ELSE COALESCE(
+            EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+        END
+        """)).scalar()
+
+
+def current_lsn(db_session):
+    """
+    Returns the primary's current WAL location
+
+    Everything committed on the primary so far is at or before it.
+    """
+    return db_session.execute(
+        sa.text(u'SELECT CAST(pg_current_wal_lsn() AS TEXT)')).scalar()
+
+
+def has_replayed(connection, lsn):
+    """
+    Returns whether the replica has replayed the primary's WAL up to ``lsn``
+
+    A database that is not replicating (e.g. the primary itself) is always
+    up to date.
+    """
+    return connection.execute(sa.text(u"""
+        SELECT CASE
+          WHEN NOT pg_is_in_recovery() THEN TRUE
+          ELSE COALESCE(
+            pg_last_wal_replay_lsn() >= CAST(:lsn AS pg_lsn), FALSE)
+        END
+        """), {'lsn': lsn}).scalar()
+
+
+def wait_for_replay(engine, lsn):
+    """
+    Waits up to ``REPLAY_TIMEOUT`` seconds for the replica to reach ``lsn``
+
+    Returns whether it did.
+    """
+    deadline = default_timer() + REPLAY_TIMEOUT
+    try:
+        with engine.connect() as connection:
+            while not has_replayed(connection, lsn):
+                if default_timer() >= deadline:
+                    return False
+                time.sleep(REPLAY_INTERVAL)
+    except sa.exc.DBAPIError as e:
+        log.warn('Replica unavailable, using primary: {0!r}'.format(e))
+        return False
+    return True
+
+
+def measure_lag(engine):
+    """
+    Returns how far (in seconds) the replica is behind the primary
+
+    Measurements are reused for ``LAG_TTL`` seconds. Returns None if the
+    replica cannot be reached (which is also remembered, so an unreachable
+    replica doesn't slow down every request).
+    """
+    key = str(engine.url)
+    now = default_timer()
+    measured = _lags.get(key)
+
+    if measured is not None and now - measured[0] < LAG_TTL:
+        return measured[1]
+
+    try:
+        with engine.connect() as connection:
+            lag = replica_lag(connection)
+    except sa.exc.DBAPIError as e:
+        log.warn('Replica unavailable, using primary: {0!r}'.format(e))
+        lag = None
+
+    _lags[key] = (now, lag)
+    return lag
+
+
+def open_session(settings, lsn=None):
+    """
+    Opens a session on the replica
+
+    Arguments:
+    settings -- the application settings
+    lsn -- (optional) primary WAL location the replica must have replayed
+
+    Returns None if no replica is configured, it cannot be reached or it
+    is too far behind.
+    """
+    engine = get_engine(settings)
+
+    if engine is None:
+        return None
+
+    max_lag = settings.get('studies.db.replica_max_lag', MAX_LAG)
+
+    lag = measure_lag(engine)
+
+    if lag is None:
+        return None
+
+    if lag > max_lag:
+        log.warn('Replica is {0}s behind, using primary'.format(lag))
+        return None
+
+    if lsn is not None and not wait_for_replay(engine, lsn):
+        log.warn('Replica has not replayed {0}, using primary'.format(lsn))
+        return None
+
+    db_session = orm.Session(bind=engine)
+    db_session.info['settings'] = settings
+    return db_session
+
+
+@contextmanager
+def read_session(settings, primary, lsn=None):
+    """
+    Yields the session long-running reads should use
+
+    This is a session on the replica, if it may be used, otherwise the
+    ``primary`` session. Replica sessions are closed afterwards.
+
+    Arguments:
+    settings -- the application settings
+    primary -- the session on the primary
+    lsn -- (optional) primary WAL location the replica must have replayed
+           (see ``current_lsn``)
+    """
+    db_session = open_session(settings, lsn=lsn)
+
+    if db_session is None:
+        yield primary
+        return
+
+    try:
+        yield db_session
+    finally:
+        db_session.close()
+
+
+def read_db_session(request):
+    """
+    Returns the session that read-only views query
+
+    Only safe (GET/HEAD) requests are routed to the replica, anything
+    else uses ``request.db_session``.
+    """
+    if request.method not in ('GET', 'HEAD'):
+        return request.db_session
+
+    db_session = open_session(request.registry.settings)
+
+    if db_session is None:
+        return request.db_session
+
+    db_session.info['request'] = request
+    request.add_finished_callback(lambda request: db_session.close())
+    return db_session
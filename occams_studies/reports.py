@@ -0,0 +1,270 @@
+"""
+Materialized form reports
+
+``occams_datastore.reporting.build_report`` pivots the values of a form
+into a subquery with one column per attribute. The pivot is expensive and
+is repeated every time a form is exported, so the reports of published
+forms are instead materialized into tables of their own (one per form
+name, as listed in ``report_status``).
+
+Triggers record every entity that is added, modified or deleted in
+``report_change``, and ``refresh`` re-pivots only those entities. A
+materialized report is only read while it is fresh, that is, it was built
+from the currently published versions of the form and has no pending
+changes. Otherwise readers fall back to building the report.
+
+Only the default report (choice codes, collections not expanded and
+private data de-identified) is materialized.
+"""
+
+from datetime import datetime
+
+import sqlalchemy as sa
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import ClauseElement, Executable
+from zope.sqlalchemy import mark_changed
+
+from occams_datastore import models as datastore
+from occams_datastore.reporting import build_report
+
+from . import models
+from .bulk import chunked
+
+
+#: Number of changed entities re-pivoted at a time
+CHUNK_SIZE = 1000
+
+
+class CreateTableAs(Executable, ClauseElement):
+    """
+    CREATE TABLE ... AS SELECT ...
+
+    Report columns are not always typed (e.g. private data placeholders),
+    so the database infers the column types instead.
+    """
+
+    def __init__(self, name, query):
+        self.name = name
+        self.query = query
+
+
+@compiles(CreateTableAs)
+def compile_create_table_as(element, compiler, **kw):
+    return 'CREATE TABLE %s AS %s' % (
+        compiler.preparer.quote(element.name),
+        compiler.process(element.query, **kw))
+
+
+def published_names(db_session):
+    """
+    Returns the names of all forms with published versions
+    """
+    schema = datastore.Schema.__table__
+    query = (
+        sa.select([schema.c.name])
+        .where(schema.c.publish_date != sa.null())
+        .where(schema.c.retract_date == sa.null())
+        .distinct()
+        .order_by(schema.c.name))
+    return [name for (name,) in db_session.execute(query)]
+
+
+def published_ids(db_session, name):
+    """
+    Returns the ids of the currently published versions of a form
+    """
+    schema = datastore.Schema.__table__
+    query = (
+        sa.select([schema.c.id])
+        .where(schema.c.name == name)
+        .where(schema.c.publish_date != sa.null())
+        .where(schema.c.retract_date == sa.null())
+        .order_by(schema.c.id))
+    return [id for (id,) in db_session.execute(query)]
+
+
+def _format_ids(ids):
+    return u';'.join(str(id) for id in sorted(ids))
+
+
+def _report_table(status_id, report=None):
+    """
+    Returns the materialized table of a report
+
+    The columns are the same as the report's, so the table can be used in
+    its place.
+    """
+    columns = [] if report is None else [
+        sa.Column(column.name, column.type, primary_key=column.name == 'id')
+        for column in report.columns]
+    return sa.Table('report_%d' % status_id, sa.MetaData(), *columns)
+
+
+def fetch_report(db_session, name, ids=None):
+    """
+    Returns the report of a form, materialized if possible
+
+    Takes the same arguments as the default ``build_report`` and returns
+    the materialized table if it is fresh, otherwise the built report.
+    """
+    status = models.report_status_table
+    change = models.report_change_table
+
+    report = build_report(db_session, name, ids=ids)
+
+    if ids is None:
+        ids = published_ids(db_session, name)
+
+    if not ids:
+        return report
+
+    query = (
+        sa.select([
+            status.c.id,
+            status.c.schema_ids,
+            sa.exists().where(change.c.schema_id.in_(ids)).label('is_dirty')])
+        .where(status.c.name == name))
+
+    record = db_session.execute(query).first()
+
+    if (record is None
+            or record.is_dirty
+            or record.schema_ids != _format_ids(ids)):
+        return report
+
+    return _report_table(record.id, report)
+
+
+def rebuild(db_session, name):
+    """
+    Materializes the report of a form from scratch
+
+    Returns the number of rows materialized
+    """
+    status = models.report_status_table
+    change = models.report_change_table
+    schema = datastore.Schema.__table__
+
+    ids = published_ids(db_session, name)
+    now = datetime.now()
+
+    status_id = db_session.execute(
+        sa.select([status.c.id]).where(status.c.name == name)).scalar()
+
+    if status_id is None:
+        status_id = db_session.execute(
+            status.insert()
+            .values(name=name, schema_ids=_format_ids(ids), refresh_date=now)
+            .returning(status.c.id)).scalar()
+    else:
+        db_session.execute(
+            status.update()
+            .where(status.c.id == status_id)
+            .values(schema_ids=_format_ids(ids), refresh_date=now))
+        _report_table(status_id).drop(
+            db_session.connection(), checkfirst=True)
+
+    # Cleared before the report is built, so changes committed while it is
+    # being built are applied by the next refresh rather than lost
+    db_session.execute(
+        change.delete()
+        .where(change.c.schema_id.in_(
+            sa.select([schema.c.id]).where(schema.c.name == name))))
+
+    report = build_report(db_session, name, ids=ids)
+    table = _report_table(status_id, report)
+
+    db_session.execute(CreateTableAs(table.name, sa.select([report])))
+    db_session.execute(sa.DDL(
+        'ALTER TABLE %s ADD PRIMARY KEY (id)' % table.name))
+    mark_changed(db_session)
+
+    return db_session.execute(
+        sa.select([sa.func.count()]).select_from(table)).scalar()
+
+
+def drop(db_session, name):
+    """
+    Removes the materialized report of a form, if any
+    """
+    status = models.report_status_table
+
+    status_id = db_session.execute(
+        sa.select([status.c.id]).where(status.c.name == name)).scalar()
+
+    if status_id is None:
+        return
+
+    _report_table(status_id).drop(db_session.connection(), checkfirst=True)
+    db_session.execute(status.delete().where(status.c.id == status_id))
+    mark_changed(db_session)
+
+
+def refresh(db_session, names=None):
+    """
+    Re-pivots the entities that changed since their report was refreshed
+
+    Reports of forms with newly published (or retracted) versions are
+    rebuilt instead, and those of forms no longer published are dropped.
+    Changes to forms that are not materialized are discarded.
+
+    Arguments:
+    db_session -- the current database session
+    names -- (optional) only refresh the reports of these forms
+
+    Returns the number of entities refreshed
+    """
+    status = models.report_status_table
+    change = models.report_change_table
+    schema = datastore.Schema.__table__
+
+    query = sa.select([status.c.id, status.c.name, status.c.schema_ids])
+    if names is not None:
+        query = query.where(status.c.name.in_(names))
+
+    count = 0
+
+    for status_id, name, schema_ids in db_session.execute(query).fetchall():
+        ids = published_ids(db_session, name)
+
+        if not ids:
+            drop(db_session, name)
+            continue
+
+        if _format_ids(ids) != schema_ids:
+            count += rebuild(db_session, name)
+            continue
+
+        # Claim the pending changes, changes made concurrently are kept for
+        # the next refresh
+        entity_ids = set(entity_id for (entity_id,) in db_session.execute(
+            change.delete()
+            .where(change.c.schema_id.in_(ids))
+            .returning(change.c.entity_id)))
+
+        report = build_report(db_session, name, ids=ids)
+        table = _report_table(status_id, report)
+
+        for chunk in chunked(sorted(entity_ids), CHUNK_SIZE):
+            db_session.execute(table.delete().where(table.c.id.in_(chunk)))
+            db_session.execute(table.insert().from_select(
+                [column.name for column in report.columns],
+                sa.select([report]).where(report.c.id.in_(chunk))))
+
+        db_session.execute(
+            status.update()
+            .where(status.c.id == status_id)
+            .values(refresh_date=datetime.now()))
+
+        count += len(entity_ids)
+
+    if names is None:
+        db_session.execute(change.delete().where(~sa.exists().where(
+            (schema.c.id == change.c.schema_id)
+            & (schema.c.publish_date != sa.null())
+            & (schema.c.retract_date == sa.null())
+            & schema.c.name.in_(sa.select([status.c.name])))))
+
+    mark_changed(db_session)
+
+    return count
@@ -14,9 +14,11 @@ def includeme(config):
     config.add_static_view(path='occams_studies:static',    name='/static', cache_max_age=3600)
 
     config.add_route('studies.settings',                    '/settings')
+    config.add_route('studies.settings_profiling',          '/settings/profiling')
 
     config.add_route('studies.sites',                       '/sites',                           factory=models.SiteFactory)
     config.add_route('studies.site',                        '/sites/{site}',                    factory=models.SiteFactory, traverse='/{site}')
+    config.add_route('studies.site_visit_schedule',         '/sites/{site}/visit-schedule',     factory=models.SiteFactory, traverse='/{site}')
 
     config.add_route('studies.reference_types',             '/reference_types',                 factory=models.ReferenceTypeFactory)
     config.add_route('studies.reference_type',              '/reference_types/{reference_type}', factory=models.ReferenceTypeFactory, traverse='/{reference_type}')
@@ -27,11 +29,14 @@ def includeme(config):
     config.add_route('studies.exports_notifications',       '/exports/notifications',           factory=models.ExportFactory)
     config.add_route('studies.exports_faq',                 '/exports/faq',                     factory=models.ExportFactory)
     config.add_route('studies.exports_codebook',            '/exports/codebook',                factory=models.ExportFactory)
+    config.add_route('studies.exports_metrics',             '/exports/metrics',                 factory=models.ExportFactory)
     config.add_route('studies.export',                      '/exports/{export:\d+}',            factory=models.ExportFactory, traverse='/{export}')
     config.add_route('studies.export_download',             '/exports/{export:\d+}/download',   factory=models.ExportFactory, traverse='/{export}')
 
     config.add_route('studies.patients',                    '/patients',                        factory=models.PatientFactory)
     config.add_route('studies.patients_forms',              '/patients/forms',                  factory=models.PatientFactory)
+    config.add_route('studies.patients_imports',            '/patients/imports',                factory=models.PatientFactory)
+    config.add_route('studies.patients_import',             '/patients/imports/{import_id}',    factory=models.PatientFactory)
     config.add_route('studies.patient',                     '/patients/{patient}',              factory=models.PatientFactory, traverse='/{patient}')
     config.add_route('studies.patient_forms',               '/patients/{patient}/forms',        factory=models.PatientFactory, traverse='/{patient}/forms')
     config.add_route('studies.patient_form',                '/patients/{patient}/forms/{form}', factory=models.PatientFactory, traverse='/{patient}/forms/{form}')
@@ -64,5 +69,9 @@ def includeme(config):
     config.add_route('studies.study_visits_cycle',          '/{study}/visits/{cycle}',              factory=models.StudyFactory, traverse='/{study}')
     config.add_route('studies.study_schemata',              '/{study}/schemata',                    factory=models.StudyFactory, traverse='/{study}')
     config.add_route('studies.study_schema',                '/{study}/schemata/{schema}',           factory=models.StudyFactory, traverse='/{study}')
+    config.add_route('studies.study_strata',                '/{study}/strata',                      factory=models.StudyFactory, traverse='/{study}')
+    config.add_route('studies.study_randomization_upload',  '/{study}/randomization-uploads/{upload}', factory=models.StudyFactory, traverse='/{study}')
+    config.add_route('studies.study_visit_batch',           '/{study}/visit-batches/{batch}',       factory=models.StudyFactory, traverse='/{study}')
+    config.add_route('studies.study_visit_schedule',        '/{study}/visit-schedule',              factory=models.StudyFactory, traverse='/{study}')
 
     log.debug('Routes configured')
@@ -0,0 +1,95 @@
+"""
+Visit schedule
+
+Every active enrollment is expected to have a visit for each (non-interim)
+cycle of its study, ``week`` weeks after consent. A visit is:
+
+    due -- from ``threshold`` days before the expected date until the
+           expected date itself
+    overdue -- past the expected date, but by no more than ``threshold``
+               days
+    missed -- past the expected date by more than ``threshold`` days
+
+Cycles without a threshold are due on the expected date and overdue from
+then on, they are never missed.
+
+The expected visits are kept in the ``visit_schedule`` table, which is
+updated by triggers as enrollments, visits and cycles change (see
+``models.VISIT_SCHEDULE_TRIGGERS``). Listings are then a single indexed
+query against it.
+"""
+
+from collections import OrderedDict
+from datetime import date
+
+import sqlalchemy as sa
+
+from . import models
+
+
+def statuses(today=None):
+    """
+    Returns the conditions of each visit status as of ``today``
+    """
+    if today is None:
+        today = date.today()
+    table = models.visit_schedule_table
+    pending = table.c.visit_id == sa.null()
+    return OrderedDict([
+        ('due',
+            pending
+            & (table.c.window_start <= today)
+            & (table.c.expected_date >= today)),
+        ('overdue',
+            pending
+            & (table.c.expected_date < today)
+            & ((table.c.window_end == sa.null())
+               | (table.c.window_end >= today))),
+        ('missed',
+            pending
+            & (table.c.window_end < today)),
+    ])
+
+
+def query_schedule(db_session, status=None, today=None):
+    """
+    Queries outstanding visits
+
+    Arguments:
+    db_session -- the current database session
+    status -- (optional) only include visits of this status, otherwise
+              visits that are due, overdue or missed are included
+    today -- (optional) the date to evaluate statuses as of
+
+    Returns a query of (pid, study, cycle, expected date, window start,
+    window end and status) ordered by expected date. Callers are expected
+    to filter it by study and/or site.
+    """
+    table = models.visit_schedule_table
+    conditions = statuses(today)
+
+    if status is not None:
+        conditions = OrderedDict([(status, conditions[status])])
+
+    query = (
+        db_session.query(
+            models.Patient.pid.label('pid'),
+            models.Study.name.label('study'),
+            models.Cycle.name.label('cycle'),
+            models.Cycle.title.label('cycle_title'),
+            table.c.site_id,
+            table.c.expected_date,
+            table.c.window_start,
+            table.c.window_end,
+            sa.case(list(conditions.items())).label('status'))
+        .select_from(table)
+        .join(models.Patient, models.Patient.id == table.c.patient_id)
+        .join(models.Study, models.Study.id == table.c.study_id)
+        .join(models.Cycle, models.Cycle.id == table.c.cycle_id)
+        .filter(sa.or_(*conditions.values()))
+        .order_by(
+            table.c.expected_date,
+            models.Patient.pid,
+            models.Cycle.week))
+
+    return query
@@ -0,0 +1,74 @@
+"""
+Command-line interface for compiling web assets
+
+Builds every bundle into a content-hashed file in ``static/gen``, writes
+gzip (and, if the ``brotli`` package is installed, brotli) compressed
+copies next to it, and records the versions in the manifest the
+application loads at startup (see ``occams_studies.assets``).
+"""
+
+import argparse
+import gzip
+import json
+import os
+import shutil
+import sys
+
+from webassets import Environment
+
+from .. import assets
+
+
+def parse_args(argv=sys.argv):
+    parser = argparse.ArgumentParser(description='Compile web assets.')
+    parser.add_argument(
+        '-l', '--list',
+        action='store_true',
+        help='List the compiled bundles, then exit.')
+    return parser.parse_args(argv)
+
+
+def main(argv=sys.argv):
+    args = parse_args(argv[1:])
+
+    if args.list:
+        for name, version in sorted((assets.load_manifest() or {}).items()):
+            print('{0}\t{1}'.format(name, version))
+        return
+
+    env = Environment(
+        os.path.join(assets.HERE, 'static'),
+        '/studies/static',
+        versions='hash',
+        auto_build=False,
+        debug=False)
+
+    manifest = {}
+
+    for name, bundle in assets.make_bundles().items():
+        env.register(name, bundle)
+        bundle.build(force=True)
+        manifest[name] = bundle.version
+        path = bundle.resolve_output(version=bundle.version)
+        compress(path)
+        print('{0}: {1}'.format(name, os.path.relpath(path, assets.HERE)))
+
+    # Written last, so that a failed build keeps serving the previous one
+    with open(assets.MANIFEST, 'w') as fp:
+        json.dump(manifest, fp, indent=2, sort_keys=True)
+
+
+def compress(path):
+    """
+    Writes precompressed copies of a file next to it
+    """
+    with open(path, 'rb') as src, gzip.open(path + '.gz', 'wb', 9) as dst:
+        shutil.copyfileobj(src, dst)
+
+    try:
+        import brotli
+    except ImportError:  # pragma: nocover
+        return
+
+    with open(path, 'rb') as src, open(path + '.br', 'wb') as dst:
+        dst.write(brotli.compress(src.read()))
@@ -11,9 +11,9 @@ import uuid
 
 from pyramid.paster import bootstrap, setup_logging
 from six import itervalues
-from tabulate import tabulate
+import transaction
 
-from .. import exports
+from .. import exports, replica
 
 
 def parse_args(argv=sys.argv):
@@ -91,16 +91,25 @@ def main(argv=sys.argv):
     setup_logging(args.config)
     env = bootstrap(args.config)
 
-    if args.list:
-        print_list(args, env)
-    else:
-        make_export(args, env)
+    settings = env['registry'].settings
+    primary = env['request'].db_session
+
+    # Exports only read, so they may run on the replica
+    with replica.read_session(settings, primary) as db_session:
+        if args.list:
+            print_list(args, env, db_session)
+        else:
+            make_export(args, env, db_session)
+
+    # Commit the recorded export metrics
+    transaction.commit()
 
 
-def print_list(args, env):
+def print_list(args, env, db_session):
     """
     Prints tabulated list of available data files
     """
+    from tabulate import tabulate
 
     def star(condition):
         return '*' if condition else ''
@@ -109,14 +118,13 @@ def print_list(args, env):
         return star(row.is_system), star(row.has_private), star(row.has_rand), row.name, row.title  # NOQA
 
     header = ['sys', 'priv', 'rand', 'name', 'title']
-    db_session = env['request'].db_session
     plans = env['registry'].settings['studies.export.plans']
     rows = iter(format(e) for e in itervalues(
         exports.list_all(plans, db_session)))
     print(tabulate(rows, header, tablefmt='simple'))
 
 
-def make_export(args, env):
+def make_export(args, env, db_session):
     """
     Generates the export data files
     """
@@ -128,7 +136,6 @@ def make_export(args, env):
             or args.names):
         sys.exit('You must specifiy something to export!')
 
-    db_session = env['request'].db_session
     plans = env['registry'].settings['studies.export.plans']
     exportables = exports.list_all(plans, db_session)
 
@@ -151,10 +158,13 @@ def make_export(args, env):
                 or (args.all_rand and plan.has_rand)
                 or (args.names and plan.name in args.names)):
             with open(os.path.join(out_dir, plan.file_name), 'w+b') as fp:
-                exports.write_data(fp, plan.data(
+                stats = exports.write_data(fp, plan.data(
                     use_choice_labels=args.use_choice_labels,
                     expand_collections=args.expand_collections,
                     ignore_private=not args.show_private))
+            # Recorded on the primary, the replica is read-only
+            exports.metrics.record(
+                env['request'].db_session, plan.name, stats, 'cli')
 
     with open(os.path.join(out_dir, exports.codebook.FILE_NAME), 'w+b') as fp:
         codebooks = [p.codebook() for p in itervalues(exportables)]
@@ -0,0 +1,83 @@
+"""
+Command-line interface for importing patient rosters
+"""
+
+import argparse
+import sys
+
+from pyramid.paster import bootstrap, setup_logging
+import transaction
+
+from .. import patient_import
+
+
+def parse_args(argv=sys.argv):
+    parser = argparse.ArgumentParser(description='Import patient rosters.')
+
+    conn_group = parser.add_argument_group('Connection options')
+    conn_group.add_argument(
+        '-c', '--config',
+        metavar='INI',
+        dest='config',
+        help='Application INI file')
+
+    main_group = parser.add_argument_group('General Options')
+    main_group.add_argument(
+        '-u', '--user',
+        metavar='KEY',
+        dest='user',
+        required=True,
+        help='The user to blame for the new patients')
+    main_group.add_argument(
+        '--dry-run',
+        dest='dry_run',
+        action='store_true',
+        help='Only validate the roster, then exit.')
+    main_group.add_argument(
+        'path',
+        metavar='PATH',
+        help='CSV or JSON roster file')
+
+    return parser.parse_args(argv)
+
+
+def main(argv=sys.argv):
+    args = parse_args(argv[1:])
+
+    setup_logging(args.config)
+    env = bootstrap(args.config)
+
+    db_session = env['request'].db_session
+
+    def progress(count):
+        sys.stderr.write('\r{0} rows'.format(count))
+        sys.stderr.flush()
+
+    with open(args.path, 'rb') as fp:
+        try:
+            roster = patient_import.PatientList(db_session, fp)
+            total, errors = roster.validate(progress=progress)
+        except patient_import.UploadError as e:
+            sys.exit(e.message.interpolate())
+
+        sys.stderr.write('\n')
+
+        if errors:
+            for error in errors:
+                print('line {0}, {1}: {2}'.format(
+                    error['line'],
+                    error['column'],
+                    error['message'].interpolate()))
+            sys.exit('Roster not imported, {0} problems found'.format(
+                len(errors)))
+
+        if args.dry_run:
+            print('{0} patients would be imported'.format(total))
+            return
+
+        pids = roster.load(progress=progress, user=args.user)
+        transaction.commit()
+
+        sys.stderr.write('\n')
+
+    print('{0} patients imported'.format(len(pids)))
@@ -0,0 +1,102 @@
+"""
+Command-line interface for materializing form reports
+"""
+
+import argparse
+import sys
+
+from pyramid.paster import bootstrap, setup_logging
+import sqlalchemy as sa
+import transaction
+
+from occams_datastore import models as datastore
+
+from .. import models, reports
+
+
+def parse_args(argv=sys.argv):
+    parser = argparse.ArgumentParser(
+        description='Materialize form reports for exports.')
+
+    conn_group = parser.add_argument_group('Connection options')
+    conn_group.add_argument(
+        '-c', '--config',
+        metavar='INI',
+        dest='config',
+        help='Application INI file')
+
+    main_group = parser.add_argument_group('General Options')
+    main_group.add_argument(
+        '-l', '--list',
+        action='store_true',
+        help='List materialized reports, then exit.')
+    main_group.add_argument(
+        '--refresh',
+        action='store_true',
+        help='Only apply pending changes to materialized reports')
+    main_group.add_argument(
+        '--all',
+        action='store_true',
+        help='Rebuild the reports of all published forms')
+    main_group.add_argument(
+        'names',
+        metavar='NAME',
+        nargs='*',
+        help='Only rebuild the reports of specified forms.')
+
+    return parser.parse_args(argv)
+
+
+def main(argv=sys.argv):
+    args = parse_args(argv[1:])
+
+    setup_logging(args.config)
+    env = bootstrap(args.config)
+
+    db_session = env['request'].db_session
+
+    if args.list:
+        print_list(db_session)
+        return
+
+    if args.refresh:
+        count = reports.refresh(db_session, args.names or None)
+        transaction.commit()
+        print('{0} entries refreshed'.format(count))
+        return
+
+    if not (args.all or args.names):
+        sys.exit('You must specifiy something to rebuild!')
+
+    names = reports.published_names(db_session) if args.all else args.names
+
+    for name in names:
+        count = reports.rebuild(db_session, name)
+        print('{0}: {1} rows'.format(name, count))
+
+    transaction.commit()
+
+
+def print_list(db_session):
+    """
+    Prints tabulated list of materialized reports
+    """
+    from tabulate import tabulate
+
+    status = models.report_status_table
+    change = models.report_change_table
+    schema = datastore.Schema.__table__
+
+    query = (
+        sa.select([
+            status.c.name,
+            status.c.refresh_date,
+            sa.select([sa.func.count()])
+            .select_from(
+                change.join(schema, schema.c.id == change.c.schema_id))
+            .where(schema.c.name == status.c.name)
+            .as_scalar()])
+        .order_by(status.c.name))
+
+    header = ['name', 'refreshed', 'pending']
+    print(tabulate(db_session.execute(query), header, tablefmt='simple'))
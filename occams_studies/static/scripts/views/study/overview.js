@@ -119,22 +119,61 @@ function StudyView(studyData, scheduleUrl){
           headers: {'X-CSRF-Token': $.cookie('csrf_token')},
           processData: false,  // tell jQuery not to process the data
           contentType: false,  // tell jQuery not to set contentType
-          error: handleXHRError({logger: self.errorMessage}),
+          error: function(jqXHR, textStatus, errorThrown){
+            if (jqXHR.responseJSON && $.isArray(jqXHR.responseJSON.errors)){
+              self.errorMessage(formatUploadErrors(jqXHR.responseJSON.errors));
+            } else {
+              handleXHRError({logger: self.errorMessage})(jqXHR, textStatus, errorThrown);
+            }
+          },
           beforeSend: function(){
             self.isUploading(true);
           },
           success: function(data, textStatus, jqXHR){
+            if (data && data.__status_url__){
+              // Large files are loaded in the background
+              self.isUploading(true);
+              pollUploadStatus(data.__status_url__);
+              return;
+            }
             self.clear();
             self.successMessage('Successfully uploaded');
           },
           complete: function(jqXHR, textStatus){
             $(event.target).remove();
-            self.isUploading(false);
+            if (!(jqXHR.responseJSON && jqXHR.responseJSON.__status_url__)){
+              self.isUploading(false);
+            }
           }
         });
     }).click();
   };
 
+  var formatUploadErrors = function(errors){
+    return $.map(errors, function(error){
+      return 'Line ' + error.line + ' (' + error.column + '): ' + error.message;
+    }).join('; ');
+  };
+
+  var pollUploadStatus = function(url){
+    $.getJSON(url, function(data){
+      if (data.status == 'complete'){
+        self.isUploading(false);
+        self.clear();
+        self.successMessage('Successfully uploaded ' + data.total + ' RIDs');
+      } else if (data.status == 'failed'){
+        self.isUploading(false);
+        self.errorMessage(
+          data.errors.length ? formatUploadErrors(data.errors) : (data.message || 'Upload failed'));
+      } else {
+        setTimeout(function(){ pollUploadStatus(url); }, 2000);
+      }
+    }).fail(function(jqXHR, textStatus, errorThrown){
+      self.isUploading(false);
+      handleXHRError({logger: self.errorMessage})(jqXHR, textStatus, errorThrown);
+    });
+  };
+
   self.saveStudy = function(form){
     if (!$(form).validate().form()){
       return;
@@ -15,6 +15,7 @@ try:
 except ImportError:  # pragma: nocover
     from ordereddict import OrderedDict  # NOQA
 from contextlib import closing
+from datetime import datetime, timedelta
 from itertools import chain
 import json
 import os
@@ -22,12 +23,19 @@ import tempfile
 from zipfile import ZipFile, ZIP_DEFLATED
 
 import celery.signals
-import humanize
 import six
+import transaction
 
 from occams.celery import app, Session, log, with_transaction
+from occams_datastore import models as datastore
 
-from . import models, exports
+from . import \
+    models, bulk, exports, jobs, patient_import, randomization, replica, \
+    reports, visit_batches
+
+
+#: How often beat applies pending changes to the materialized form reports
+REPORTS_REFRESH_INTERVAL = timedelta(minutes=15)
 
 
 def includeme(config):
@@ -110,11 +118,26 @@ def make_export(name):
     export_id -- export to process
 
     """
+    from humanize import naturalsize
 
     redis = app.redis
 
     export = Session.query(models.Export).filter_by(name=name).one()
 
+    # How long the export waited for a worker
+    queue_wait = (datetime.now() - export.create_date).total_seconds()
+
+    # Apply pending changes so the exported forms are read from their
+    # materialized reports. The refresh is committed on its own so that the
+    # replica can see it and its locks are not held for the whole export.
+    reports.refresh(Session, [item['name'] for item in export.contents])
+    transaction.commit()
+
+    # The replica is only used once it has replayed the refresh
+    lsn = replica.current_lsn(Session)
+
+    export = Session.query(models.Export).filter_by(name=name).one()
+
     redis.hmset(export.redis_key, {
         'export_id': export.id,
         'owner_user': export.owner_user.key,
@@ -123,20 +146,30 @@ def make_export(name):
         'total': len(export.contents),
     })
 
-    with closing(ZipFile(export.path, 'w', ZIP_DEFLATED)) as zfp:
+    # The data files are read from the replica, if there is one, so the
+    # primary is not held up for the duration of the export
+    with closing(ZipFile(export.path, 'w', ZIP_DEFLATED)) as zfp, \
+            replica.read_session(
+                app.settings, Session, lsn=lsn) as read_session:
 
         plans = app.settings['studies.export.plans']
-        exportables = exports.list_all(plans, Session)
+        exportables = exports.list_all(plans, read_session)
 
         for item in export.contents:
             plan = exportables[item['name']]
 
             with tempfile.NamedTemporaryFile() as tfp:
-                exports.write_data(tfp, plan.data(
+                stats = exports.write_data(tfp, plan.data(
                     use_choice_labels=export.use_choice_labels,
                     expand_collections=export.expand_collections))
                 zfp.write(tfp.name, plan.file_name)
 
+            # Recorded on the primary, the replica is read-only
+            exports.metrics.record(
+                Session, plan.name, stats, 'task',
+                export_id=export.id,
+                queue_wait=queue_wait)
+
             redis.hincrby(export.redis_key, 'count')
             data = redis.hgetall(export.redis_key)
             # redis-py returns everything as string, so we need to clean it
@@ -155,7 +188,7 @@ def make_export(name):
     export.status = 'complete'
     redis.hmset(export.redis_key, {
         'status': export.status,
-        'file_size': humanize.naturalsize(export.file_size)
+        'file_size': naturalsize(export.file_size)
     })
     redis.publish('export', json.dumps(redis.hgetall(export.redis_key)))
 
@@ -168,13 +201,225 @@ def make_codebook(task):
     """
     try:
         plans = app.settings['studies.export.plans']
-        codebook_chain = \
-            [p.codebook() for p in six.itervalues(
-                exports.list_all(plans, Session))]
         path = os.path.join(app.settings['studies.export.dir'],
                             exports.codebook.FILE_NAME)
-        with open(path, 'w+b') as fp:
-            exports.write_codebook(fp, chain.from_iterable(codebook_chain))
+        with replica.read_session(app.settings, Session) as read_session:
+            codebook_chain = \
+                [p.codebook() for p in six.itervalues(
+                    exports.list_all(plans, read_session))]
+            with open(path, 'w+b') as fp:
+                exports.write_codebook(
+                    fp, chain.from_iterable(codebook_chain))
     except Exception as exc:
         # Need to keep retrying (default is every 3 min)
         task.retry(exc=exc)
+
+
+@celery.task.periodic_task(
+    name='refresh_reports',
+    ignore_result=True,
+    run_every=REPORTS_REFRESH_INTERVAL)
+@with_transaction
+def refresh_reports():
+    """
+    Applies pending changes to the materialized form reports
+
+    Run periodically by beat so that few changes are left for exports to
+    apply, and so that changes to forms that are not materialized are
+    discarded rather than accumulating.
+    """
+    count = reports.refresh(Session)
+    log.info('Refreshed {0} report entries'.format(count))
+
+
+class JobTask(celery.Task):
+    """
+    Base class for tasks that report their progress via ``jobs.JobStatus``
+
+    Subclasses (or the task decorator) set ``job_kind``, the task id is
+    used as the job id.
+    """
+
+    abstract = True
+
+    job_kind = None
+
+    def on_failure(self, exc, task_id, args, kwargs, einfo):
+        log.error('Task {0} raised exception: {1!r}\n{2!r}'.format(
+                  task_id, exc, einfo))
+        jobs.JobStatus(app.redis, self.job_kind, task_id).update(
+            status='failed')
+
+
+def _translate(message):
+    # Workers have no request to negotiate a locale with
+    return message.interpolate()
+
+
+@celery.task(
+    name='load_randomization',
+    base=JobTask,
+    job_kind='randomization',
+    ignore_result=True)
+@with_transaction
+def load_randomization(upload_id, study_id, path, user_key):
+    """
+    Loads a randomization list that is too large to load during a request.
+
+    Progress is tracked with ``jobs.JobStatus``:
+    status -- one of validating, loading, complete or failed
+    count -- the number of rows processed so far in the current status
+    total -- the total number of rows (once validated)
+    errors -- list of row problems (if validation failed)
+
+    Parameters:
+    upload_id -- the upload being processed (also the task id)
+    study_id -- the study the list is being uploaded for
+    path -- location of the uploaded file, removed once done
+    user_key -- the user who uploaded the file
+
+    """
+
+    status = jobs.JobStatus(app.redis, 'randomization', upload_id)
+
+    study = Session.query(models.Study).filter_by(id=study_id).one()
+    user = Session.query(datastore.User).filter_by(key=user_key).one()
+
+    try:
+        with open(path, 'rb') as fp:
+            upload = randomization.RandomizationList(study, fp)
+
+            status.update(status='validating', count=0)
+            total, errors = upload.validate(Session, progress=status.progress)
+
+            if errors:
+                status.update(
+                    status='failed',
+                    errors=bulk.errors2json(errors, _translate))
+                return
+
+            status.update(status='loading', count=0, total=total)
+            upload.load(Session, progress=status.progress, user=user)
+
+    except randomization.UploadError as e:
+        status.update(
+            status='failed',
+            errors=bulk.errors2json(e.errors, _translate),
+            message=_translate(e.message))
+        raise
+
+    finally:
+        os.remove(path)
+
+    status.update(status='complete')
+    log.info('Loaded {0} strata for study {1}'.format(total, study.name))
+
+
+@celery.task(
+    name='schedule_visits',
+    base=JobTask,
+    job_kind='visits',
+    ignore_result=True)
+@with_transaction
+def schedule_visits(batch_id, study_id, records, include_forms, user_key):
+    """
+    Creates a batch of visits that is too large to create during a request.
+
+    Progress is tracked with ``jobs.JobStatus``:
+    status -- one of validating, loading, complete or failed
+    count -- the number of visits created so far
+    total -- the number of records in the batch
+    results -- the result of each record (once complete)
+
+    Parameters:
+    batch_id -- the batch being processed (also the task id)
+    study_id -- the study the visits are scheduled for
+    records -- the batch records (already checked for permissions)
+    include_forms -- whether to add the cycles' forms to the visits
+    user_key -- the user to blame for the new visits
+
+    """
+
+    status = jobs.JobStatus(app.redis, 'visits', batch_id)
+
+    study = Session.query(models.Study).filter_by(id=study_id).one()
+    user = Session.query(datastore.User).filter_by(key=user_key).one()
+
+    batch = visit_batches.VisitBatch(study, records)
+
+    status.update(status='validating', count=0)
+    checked = batch.validate(Session)
+
+    status.update(status='loading', count=0)
+    results = batch.create(
+        Session, checked,
+        include_forms=include_forms,
+        progress=status.progress,
+        user=user)
+
+    status.update(
+        status='complete',
+        results=visit_batches.results2json(results, _translate))
+    log.info('Scheduled {0} visits for study {1}'.format(
+        sum(1 for r in results if r['status'] == 'created'), study.name))
+
+
+@celery.task(
+    name='import_patients',
+    base=JobTask,
+    job_kind='patients',
+    ignore_result=True)
+@with_transaction
+def import_patients(import_id, path, site_ids, user_key):
+    """
+    Imports a patient roster that is too large to import during a request.
+
+    Progress is tracked with ``jobs.JobStatus``:
+    status -- one of validating, loading, complete or failed
+    count -- the number of rows processed so far in the current status
+    total -- the total number of rows (once validated)
+    errors -- list of row problems (if validation failed)
+
+    Parameters:
+    import_id -- the import being processed (also the task id)
+    path -- the uploaded roster file, removed once processed
+    site_ids -- the sites the user is allowed to add patients to
+    user_key -- the user to blame for the new patients
+
+    """
+
+    status = jobs.JobStatus(app.redis, 'patients', import_id)
+
+    user = Session.query(datastore.User).filter_by(key=user_key).one()
+    site_ids = set(site_ids)
+
+    try:
+        with open(path, 'rb') as fp:
+            roster = patient_import.PatientList(Session, fp)
+
+            status.update(status='validating', count=0)
+            total, errors = roster.validate(
+                is_allowed=lambda site: site.id in site_ids,
+                progress=status.progress)
+
+            if errors:
+                status.update(
+                    status='failed',
+                    errors=bulk.errors2json(errors, _translate))
+                return
+
+            status.update(status='loading', count=0, total=total)
+            roster.load(progress=status.progress, user=user)
+
+    except patient_import.UploadError as e:
+        status.update(
+            status='failed',
+            errors=bulk.errors2json(e.errors, _translate),
+            message=_translate(e.message))
+        raise
+
+    finally:
+        os.remove(path)
+
+    status.update(status='complete')
+    log.info('Imported {0} patients'.format(total))
@@ -0,0 +1,293 @@
+"""Add visit schedule
+
+Revision ID: 3f8c6b2a9e17
+Revises: e5d07a3c1b48
+Create Date: 2026-10-19 18:52:09.617340
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '3f8c6b2a9e17'
+down_revision = 'e5d07a3c1b48'
+branch_labels = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+TRIGGERS = [
+    """
+    CREATE OR REPLACE FUNCTION visit_schedule_refresh(
+      target_patients INTEGER[], target_cycles INTEGER[])
+    RETURNS VOID AS $$
+    BEGIN
+      -- NULL targets everything, an empty list nothing
+      IF target_patients = '{}' OR target_cycles = '{}' THEN
+        RETURN;
+      END IF;
+
+      DELETE FROM visit_schedule
+      WHERE (target_patients IS NULL OR patient_id = ANY(target_patients))
+      AND (target_cycles IS NULL OR cycle_id = ANY(target_cycles));
+
+      INSERT INTO visit_schedule (
+        enrollment_id, cycle_id, patient_id, study_id, site_id,
+        expected_date, window_start, window_end, visit_id, visit_date)
+      SELECT
+        enrollment.id,
+        cycle.id,
+        enrollment.patient_id,
+        enrollment.study_id,
+        patient.site_id,
+        enrollment.consent_date + cycle.week * 7,
+        enrollment.consent_date + cycle.week * 7
+          - COALESCE(cycle.threshold, 0),
+        enrollment.consent_date + cycle.week * 7 + cycle.threshold,
+        visit.id,
+        visit.visit_date
+      FROM enrollment
+      JOIN patient ON patient.id = enrollment.patient_id
+      JOIN cycle ON cycle.study_id = enrollment.study_id
+      LEFT JOIN LATERAL (
+        SELECT visit.id, visit.visit_date
+        FROM visit
+        JOIN visit_cycle ON visit_cycle.visit_id = visit.id
+        WHERE visit.patient_id = enrollment.patient_id
+        AND visit_cycle.cycle_id = cycle.id
+        ORDER BY visit.visit_date
+        LIMIT 1
+      ) AS visit ON TRUE
+      WHERE enrollment.termination_date IS NULL
+      AND cycle.week IS NOT NULL
+      AND cycle.is_interim IS NOT TRUE
+      AND (target_patients IS NULL
+           OR enrollment.patient_id = ANY(target_patients))
+      AND (target_cycles IS NULL OR cycle.id = ANY(target_cycles));
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE OR REPLACE FUNCTION visit_schedule_on_patient()
+    RETURNS TRIGGER AS $$
+    BEGIN
+      PERFORM visit_schedule_refresh(ARRAY(
+        SELECT new_rows.id
+        FROM new_rows
+        JOIN old_rows ON old_rows.id = new_rows.id
+        WHERE new_rows.site_id IS DISTINCT FROM old_rows.site_id), NULL);
+      RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE OR REPLACE FUNCTION visit_schedule_on_child()
+    RETURNS TRIGGER AS $$
+    BEGIN
+      IF TG_OP = 'INSERT' THEN
+        PERFORM visit_schedule_refresh(ARRAY(
+          SELECT DISTINCT patient_id FROM new_rows), NULL);
+      ELSE
+        PERFORM visit_schedule_refresh(ARRAY(
+          SELECT DISTINCT patient_id FROM old_rows), NULL);
+      END IF;
+      RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE OR REPLACE FUNCTION visit_schedule_on_enrollment_update()
+    RETURNS TRIGGER AS $$
+    BEGIN
+      PERFORM visit_schedule_refresh(ARRAY(
+        SELECT DISTINCT changed.patient_id
+        FROM new_rows
+        JOIN old_rows ON old_rows.id = new_rows.id
+        CROSS JOIN LATERAL (
+          VALUES (old_rows.patient_id), (new_rows.patient_id)
+        ) AS changed (patient_id)
+        WHERE (new_rows.patient_id, new_rows.study_id,
+               new_rows.consent_date, new_rows.termination_date)
+          IS DISTINCT FROM (old_rows.patient_id, old_rows.study_id,
+                            old_rows.consent_date, old_rows.termination_date)
+        ), NULL);
+      RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE OR REPLACE FUNCTION visit_schedule_on_visit_update()
+    RETURNS TRIGGER AS $$
+    BEGIN
+      PERFORM visit_schedule_refresh(ARRAY(
+        SELECT DISTINCT changed.patient_id
+        FROM new_rows
+        JOIN old_rows ON old_rows.id = new_rows.id
+        CROSS JOIN LATERAL (
+          VALUES (old_rows.patient_id), (new_rows.patient_id)
+        ) AS changed (patient_id)
+        WHERE (new_rows.patient_id, new_rows.visit_date)
+          IS DISTINCT FROM (old_rows.patient_id, old_rows.visit_date)
+        ), NULL);
+      RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE OR REPLACE FUNCTION visit_schedule_on_visit_cycle()
+    RETURNS TRIGGER AS $$
+    BEGIN
+      -- Visits deleted along with their cycles are handled by the visit
+      IF TG_OP = 'INSERT' THEN
+        PERFORM visit_schedule_refresh(ARRAY(
+          SELECT DISTINCT visit.patient_id
+          FROM new_rows
+          JOIN visit ON visit.id = new_rows.visit_id), NULL);
+      ELSE
+        PERFORM visit_schedule_refresh(ARRAY(
+          SELECT DISTINCT visit.patient_id
+          FROM old_rows
+          JOIN visit ON visit.id = old_rows.visit_id), NULL);
+      END IF;
+      RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE OR REPLACE FUNCTION visit_schedule_on_cycle()
+    RETURNS TRIGGER AS $$
+    BEGIN
+      -- Only the changed cycles' expected visits are recomputed, those of
+      -- deleted cycles are removed by the foreign key
+      IF TG_OP = 'INSERT' THEN
+        PERFORM visit_schedule_refresh(NULL, ARRAY(SELECT id FROM new_rows));
+      ELSE
+        PERFORM visit_schedule_refresh(NULL, ARRAY(
+          SELECT new_rows.id
+          FROM new_rows
+          JOIN old_rows ON old_rows.id = new_rows.id
+          WHERE (new_rows.study_id, new_rows.week,
+                 new_rows.threshold, new_rows.is_interim)
+            IS DISTINCT FROM (old_rows.study_id, old_rows.week,
+                              old_rows.threshold, old_rows.is_interim)));
+      END IF;
+      RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE TRIGGER visit_schedule_patient_update
+    AFTER UPDATE ON patient
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE visit_schedule_on_patient()
+    """,
+    """
+    CREATE TRIGGER visit_schedule_enrollment_insert
+    AFTER INSERT ON enrollment
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE visit_schedule_on_child()
+    """,
+    """
+    CREATE TRIGGER visit_schedule_enrollment_update
+    AFTER UPDATE ON enrollment
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE visit_schedule_on_enrollment_update()
+    """,
+    """
+    CREATE TRIGGER visit_schedule_enrollment_delete
+    AFTER DELETE ON enrollment
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE visit_schedule_on_child()
+    """,
+    """
+    CREATE TRIGGER visit_schedule_visit_update
+    AFTER UPDATE ON visit
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE visit_schedule_on_visit_update()
+    """,
+    """
+    CREATE TRIGGER visit_schedule_visit_delete
+    AFTER DELETE ON visit
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE visit_schedule_on_child()
+    """,
+    """
+    CREATE TRIGGER visit_schedule_visit_cycle_insert
+    AFTER INSERT ON visit_cycle
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE visit_schedule_on_visit_cycle()
+    """,
+    """
+    CREATE TRIGGER visit_schedule_visit_cycle_delete
+    AFTER DELETE ON visit_cycle
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE visit_schedule_on_visit_cycle()
+    """,
+    """
+    CREATE TRIGGER visit_schedule_cycle_insert
+    AFTER INSERT ON cycle
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE visit_schedule_on_cycle()
+    """,
+    """
+    CREATE TRIGGER visit_schedule_cycle_update
+    AFTER UPDATE ON cycle
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE visit_schedule_on_cycle()
+    """,
+]
+
+FUNCTIONS = [
+    'visit_schedule_refresh(INTEGER[], INTEGER[])',
+    'visit_schedule_on_patient()',
+    'visit_schedule_on_child()',
+    'visit_schedule_on_enrollment_update()',
+    'visit_schedule_on_visit_update()',
+    'visit_schedule_on_visit_cycle()',
+    'visit_schedule_on_cycle()',
+]
+
+
+def upgrade():
+    op.create_table(
+        'visit_schedule',
+        sa.Column('enrollment_id', sa.Integer, primary_key=True),
+        sa.Column('cycle_id', sa.Integer, primary_key=True),
+        sa.Column('patient_id', sa.Integer, nullable=False),
+        sa.Column('study_id', sa.Integer, nullable=False),
+        sa.Column('site_id', sa.Integer, nullable=False),
+        sa.Column('expected_date', sa.Date, nullable=False),
+        sa.Column('window_start', sa.Date, nullable=False),
+        sa.Column('window_end', sa.Date),
+        sa.Column('visit_id', sa.Integer),
+        sa.Column('visit_date', sa.Date),
+        sa.ForeignKeyConstraint(
+            ['enrollment_id'], ['enrollment.id'],
+            name='fk_visit_schedule_enrollment_id',
+            ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(
+            ['cycle_id'], ['cycle.id'],
+            name='fk_visit_schedule_cycle_id',
+            ondelete='CASCADE'))
+
+    op.create_index(
+        'ix_visit_schedule_patient_id', 'visit_schedule', ['patient_id'])
+    op.create_index(
+        'ix_visit_schedule_study_id_expected_date',
+        'visit_schedule', ['study_id', 'expected_date'],
+        postgresql_where=sa.text('visit_id IS NULL'))
+    op.create_index(
+        'ix_visit_schedule_site_id_expected_date',
+        'visit_schedule', ['site_id', 'expected_date'],
+        postgresql_where=sa.text('visit_id IS NULL'))
+
+    for statement in TRIGGERS:
+        op.execute(statement)
+
+    # Schedule existing enrollments
+    op.execute('SELECT visit_schedule_refresh(NULL, NULL)')
+
+
+def downgrade():
+    for function in FUNCTIONS:
+        op.execute('DROP FUNCTION IF EXISTS %s CASCADE' % function)
+    op.drop_table('visit_schedule')
@@ -0,0 +1,169 @@
+"""Add stratum allocation table
+
+Revision ID: 4b9e2d61c0a7
+Revises: fa6460f5386f
+Create Date: 2026-10-19 09:12:40.518231
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '4b9e2d61c0a7'
+down_revision = 'fa6460f5386f'
+branch_labels = None
+
+from collections import defaultdict
+from datetime import datetime
+from decimal import Decimal
+import hashlib
+import json
+
+from alembic import op
+import six
+import sqlalchemy as sa
+
+
+CHUNK_SIZE = 1000
+
+# Tables the values of each attribute type are stored in
+VALUE_TABLES = {
+    'choice': 'value_choice',
+    'date': 'value_datetime',
+    'datetime': 'value_datetime',
+    'number': 'value_decimal',
+    'string': 'value_string',
+    'text': 'value_text',
+}
+
+
+def upgrade():
+    op.create_table(
+        'stratum_allocation',
+        sa.Column('stratum_id', sa.Integer, primary_key=True, nullable=False),
+        sa.Column('study_id', sa.Integer, nullable=False),
+        sa.Column('criteria_hash', sa.String(40), nullable=False),
+        sa.Column('criteria', sa.Unicode, nullable=False),
+        sa.ForeignKeyConstraint(
+            ['stratum_id'], ['stratum.id'],
+            name='fk_stratum_allocation_stratum_id',
+            ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(
+            ['study_id'], ['study.id'],
+            name='fk_stratum_allocation_study_id',
+            ondelete='CASCADE'),
+        sa.Index(
+            'ix_stratum_allocation_study_id_criteria_hash',
+            'study_id', 'criteria_hash', 'stratum_id'))
+
+    index_strata()
+
+
+def canonical_criteria(attributes, data):
+    """
+    Must produce the same text as
+    ``occams_studies.randomization.canonical_criteria``
+    """
+    criteria = {}
+    for name, type_ in attributes.items():
+        value = data.get(name)
+        if value is None or value == u'':
+            value = None
+        elif type_ == 'number':
+            value = u'{0:f}'.format(Decimal(str(value)).normalize())
+        elif type_ == 'date':
+            if isinstance(value, datetime):
+                value = value.date()
+            value = value.isoformat()
+        elif type_ == 'datetime':
+            value = value.isoformat()
+        else:
+            value = six.text_type(value)
+        criteria[name] = value
+    return six.text_type(json.dumps(criteria, sort_keys=True))
+
+
+def index_strata():
+    """
+    Indexes the unassigned strata of every randomized study
+    """
+    conn = op.get_bind()
+
+    allocation_table = sa.sql.table(
+        'stratum_allocation',
+        sa.sql.column('stratum_id'),
+        sa.sql.column('study_id'),
+        sa.sql.column('criteria_hash'),
+        sa.sql.column('criteria'))
+
+    studies = conn.execute(sa.text(
+        """
+        SELECT id, randomization_schema_id
+        FROM study
+        WHERE randomization_schema_id IS NOT NULL
+        """)).fetchall()
+
+    for study_id, schema_id in studies:
+        attributes = dict(conn.execute(
+            sa.text('SELECT name, type FROM attribute WHERE schema_id = :id'),
+            id=schema_id).fetchall())
+
+        # Unassigned strata and their randomization entities
+        strata = sa.text(
+            """
+            SELECT stratum.id AS stratum_id, entity.id AS entity_id
+            FROM stratum
+            JOIN context
+              ON context.external = 'stratum'
+             AND context.key = stratum.id
+            JOIN entity
+              ON entity.id = context.entity_id
+             AND entity.schema_id = :schema_id
+            WHERE stratum.study_id = :study_id
+            AND stratum.patient_id IS NULL
+            """)
+
+        data = defaultdict(dict)
+
+        for table_name in sorted(set(VALUE_TABLES.values())):
+            if table_name == 'value_choice':
+                value = 'choice.name'
+                join = 'JOIN choice ON choice.id = value_choice.value'
+            else:
+                value = '{0}.value'.format(table_name)
+                join = ''
+            values = conn.execute(sa.text(
+                """
+                SELECT strata.stratum_id, attribute.name, {value}
+                FROM ({strata}) AS strata
+                JOIN {table} ON {table}.entity_id = strata.entity_id
+                JOIN attribute ON attribute.id = {table}.attribute_id
+                {join}
+                """.format(
+                    value=value,
+                    strata=strata.text,
+                    table=table_name,
+                    join=join)),
+                study_id=study_id,
+                schema_id=schema_id)
+            for stratum_id, name, value in values:
+                if VALUE_TABLES.get(attributes.get(name)) == table_name:
+                    data[stratum_id][name] = value
+
+        stratum_ids = sorted(set(
+            stratum_id for stratum_id, entity_id
+            in conn.execute(strata, study_id=study_id, schema_id=schema_id)))
+
+        for offset in range(0, len(stratum_ids), CHUNK_SIZE):
+            rows = []
+            for stratum_id in stratum_ids[offset:offset + CHUNK_SIZE]:
+                criteria = canonical_criteria(attributes, data[stratum_id])
+                rows.append({
+                    'stratum_id': stratum_id,
+                    'study_id': study_id,
+                    'criteria': criteria,
+                    'criteria_hash':
+                        hashlib.sha1(criteria.encode('utf-8')).hexdigest()})
+            conn.execute(allocation_table.insert(), rows)
+
+
+def downgrade():
+    op.drop_table('stratum_allocation')
@@ -0,0 +1,50 @@
+"""Record export metrics
+
+Revision ID: 7c2e9d41b5a3
+Revises: 3f8c6b2a9e17
+Create Date: 2026-10-19 21:14:37.280514
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '7c2e9d41b5a3'
+down_revision = '3f8c6b2a9e17'
+branch_labels = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table(
+        'export_metric',
+        sa.Column('id', sa.Integer, primary_key=True, nullable=False),
+        sa.Column(
+            'export_id',
+            sa.Integer,
+            sa.ForeignKey(
+                'export.id',
+                name='fk_export_metric_export_id',
+                ondelete='SET NULL')),
+        sa.Column('plan_name', sa.String, nullable=False),
+        sa.Column('source', sa.String, nullable=False),
+        sa.Column('create_date', sa.DateTime, nullable=False),
+        sa.Column('queue_wait', sa.Float),
+        sa.Column('query_time', sa.Float, nullable=False),
+        sa.Column('write_time', sa.Float, nullable=False),
+        sa.Column('rows', sa.Integer, nullable=False),
+        sa.Column('bytes', sa.BigInteger, nullable=False),
+        sa.Column('memory_growth', sa.BigInteger))
+
+    op.create_index(
+        'ix_export_metric_plan_name_create_date',
+        'export_metric',
+        ['plan_name', 'create_date'])
+    op.create_index(
+        'ix_export_metric_create_date', 'export_metric', ['create_date'])
+    op.create_index(
+        'ix_export_metric_export_id', 'export_metric', ['export_id'])
+
+
+def downgrade():
+    op.drop_table('export_metric')
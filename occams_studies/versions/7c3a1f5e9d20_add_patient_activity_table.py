@@ -0,0 +1,222 @@
+"""Add patient activity summary
+
+Revision ID: 7c3a1f5e9d20
+Revises: 4b9e2d61c0a7
+Create Date: 2026-10-19 14:02:11.204518
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '7c3a1f5e9d20'
+down_revision = '4b9e2d61c0a7'
+branch_labels = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+TRIGGERS = [
+    """
+    CREATE OR REPLACE FUNCTION patient_activity_refresh(targets INTEGER[])
+    RETURNS VOID AS $$
+    BEGIN
+      INSERT INTO patient_activity (
+        patient_id, site_id, last_visit_date, last_modified,
+        enrollment_count, open_form_count)
+      SELECT
+        patient.id,
+        patient.site_id,
+        (SELECT MAX(visit.visit_date)
+         FROM visit
+         WHERE visit.patient_id = patient.id),
+        patient.modify_date,
+        (SELECT COUNT(*)
+         FROM enrollment
+         WHERE enrollment.patient_id = patient.id),
+        (SELECT COUNT(*)
+         FROM context
+         JOIN entity ON entity.id = context.entity_id
+         LEFT JOIN state ON state.id = entity.state_id
+         WHERE context.external = 'patient'
+         AND context.key = patient.id
+         AND state.name IS DISTINCT FROM 'complete')
+      FROM patient
+      WHERE patient.id = ANY(targets)
+      ON CONFLICT (patient_id) DO UPDATE SET
+        site_id = EXCLUDED.site_id,
+        last_visit_date = EXCLUDED.last_visit_date,
+        last_modified = EXCLUDED.last_modified,
+        enrollment_count = EXCLUDED.enrollment_count,
+        open_form_count = EXCLUDED.open_form_count;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE OR REPLACE FUNCTION patient_activity_on_patient()
+    RETURNS TRIGGER AS $$
+    BEGIN
+      PERFORM patient_activity_refresh(ARRAY(SELECT id FROM new_rows));
+      RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE OR REPLACE FUNCTION patient_activity_on_child()
+    RETURNS TRIGGER AS $$
+    BEGIN
+      IF TG_OP = 'INSERT' THEN
+        PERFORM patient_activity_refresh(ARRAY(
+          SELECT DISTINCT patient_id FROM new_rows));
+      ELSIF TG_OP = 'DELETE' THEN
+        PERFORM patient_activity_refresh(ARRAY(
+          SELECT DISTINCT patient_id FROM old_rows));
+      ELSE
+        PERFORM patient_activity_refresh(ARRAY(
+          SELECT patient_id FROM old_rows
+          UNION
+          SELECT patient_id FROM new_rows));
+      END IF;
+      RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE OR REPLACE FUNCTION patient_activity_on_context()
+    RETURNS TRIGGER AS $$
+    BEGIN
+      IF TG_OP = 'INSERT' THEN
+        PERFORM patient_activity_refresh(ARRAY(
+          SELECT DISTINCT key FROM new_rows WHERE external = 'patient'));
+      ELSE
+        PERFORM patient_activity_refresh(ARRAY(
+          SELECT DISTINCT key FROM old_rows WHERE external = 'patient'));
+      END IF;
+      RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE OR REPLACE FUNCTION patient_activity_on_entity()
+    RETURNS TRIGGER AS $$
+    BEGIN
+      PERFORM patient_activity_refresh(ARRAY(
+        SELECT DISTINCT context.key
+        FROM new_rows
+        JOIN old_rows ON old_rows.id = new_rows.id
+        JOIN context ON context.entity_id = new_rows.id
+        WHERE context.external = 'patient'
+        AND new_rows.state_id IS DISTINCT FROM old_rows.state_id));
+      RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE TRIGGER patient_activity_patient_insert
+    AFTER INSERT ON patient
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE patient_activity_on_patient()
+    """,
+    """
+    CREATE TRIGGER patient_activity_patient_update
+    AFTER UPDATE ON patient
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE patient_activity_on_patient()
+    """,
+    """
+    CREATE TRIGGER patient_activity_visit_insert
+    AFTER INSERT ON visit
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE patient_activity_on_child()
+    """,
+    """
+    CREATE TRIGGER patient_activity_visit_update
+    AFTER UPDATE ON visit
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE patient_activity_on_child()
+    """,
+    """
+    CREATE TRIGGER patient_activity_visit_delete
+    AFTER DELETE ON visit
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE patient_activity_on_child()
+    """,
+    """
+    CREATE TRIGGER patient_activity_enrollment_insert
+    AFTER INSERT ON enrollment
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE patient_activity_on_child()
+    """,
+    """
+    CREATE TRIGGER patient_activity_enrollment_update
+    AFTER UPDATE ON enrollment
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE patient_activity_on_child()
+    """,
+    """
+    CREATE TRIGGER patient_activity_enrollment_delete
+    AFTER DELETE ON enrollment
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE patient_activity_on_child()
+    """,
+    """
+    CREATE TRIGGER patient_activity_context_insert
+    AFTER INSERT ON context
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE patient_activity_on_context()
+    """,
+    """
+    CREATE TRIGGER patient_activity_context_delete
+    AFTER DELETE ON context
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE patient_activity_on_context()
+    """,
+    """
+    CREATE TRIGGER patient_activity_entity_update
+    AFTER UPDATE ON entity
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE patient_activity_on_entity()
+    """,
+]
+
+FUNCTIONS = [
+    'patient_activity_refresh(INTEGER[])',
+    'patient_activity_on_patient()',
+    'patient_activity_on_child()',
+    'patient_activity_on_context()',
+    'patient_activity_on_entity()',
+]
+
+
+def upgrade():
+    op.create_table(
+        'patient_activity',
+        sa.Column('patient_id', sa.Integer, primary_key=True, nullable=False),
+        sa.Column('site_id', sa.Integer, nullable=False),
+        sa.Column('last_visit_date', sa.Date),
+        sa.Column('last_modified', sa.DateTime, nullable=False),
+        sa.Column(
+            'enrollment_count', sa.Integer,
+            nullable=False, server_default='0'),
+        sa.Column(
+            'open_form_count', sa.Integer,
+            nullable=False, server_default='0'),
+        sa.ForeignKeyConstraint(
+            ['patient_id'], ['patient.id'],
+            name='fk_patient_activity_patient_id',
+            ondelete='CASCADE'),
+        sa.Index(
+            'ix_patient_activity_site_id_last_modified',
+            'site_id', 'last_modified'))
+
+    for statement in TRIGGERS:
+        op.execute(statement)
+
+    # Summarize existing patients
+    op.execute(
+        'SELECT patient_activity_refresh(ARRAY(SELECT id FROM patient))')
+
+
+def downgrade():
+    for function in FUNCTIONS:
+        op.execute('DROP FUNCTION IF EXISTS %s CASCADE' % function)
+    op.drop_table('patient_activity')
@@ -0,0 +1,41 @@
+"""Add composite indexes for listings and dashboards
+
+Revision ID: b81d0e4f6a93
+Revises: 7c3a1f5e9d20
+Create Date: 2026-10-19 16:40:27.881342
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'b81d0e4f6a93'
+down_revision = '7c3a1f5e9d20'
+branch_labels = None
+
+from alembic import op
+
+
+def upgrade():
+    op.create_index(
+        'ix_context_external_key_entity_id',
+        'context', ['external', 'key', 'entity_id'])
+
+    op.create_index(
+        'ix_enrollment_study_id_consent_date',
+        'enrollment', ['study_id', 'consent_date'])
+
+    op.create_index(
+        'ix_enrollment_study_id_termination_date',
+        'enrollment', ['study_id', 'termination_date'])
+
+    # Was mistakenly declared on the block number
+    op.drop_index('ix_stratum_patient_id', 'stratum')
+    op.create_index('ix_stratum_patient_id', 'stratum', ['patient_id'])
+
+
+def downgrade():
+    op.drop_index('ix_stratum_patient_id', 'stratum')
+    op.create_index('ix_stratum_patient_id', 'stratum', ['block_number'])
+
+    op.drop_index('ix_enrollment_study_id_termination_date', 'enrollment')
+    op.drop_index('ix_enrollment_study_id_consent_date', 'enrollment')
+    op.drop_index('ix_context_external_key_entity_id', 'context')
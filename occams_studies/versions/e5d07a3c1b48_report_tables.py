@@ -0,0 +1,127 @@
+"""Track changes for materialized form reports
+
+Revision ID: e5d07a3c1b48
+Revises: b81d0e4f6a93
+Create Date: 2026-10-19 17:25:43.106219
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'e5d07a3c1b48'
+down_revision = 'b81d0e4f6a93'
+branch_labels = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+VALUE_TABLES = [
+    'value_blob',
+    'value_choice',
+    'value_datetime',
+    'value_decimal',
+    'value_integer',
+    'value_string',
+    'value_text',
+]
+
+TRIGGERS = [
+    """
+    CREATE OR REPLACE FUNCTION report_change_on_entity()
+    RETURNS TRIGGER AS $$
+    BEGIN
+      IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        INSERT INTO report_change (entity_id, schema_id)
+        VALUES (OLD.id, OLD.schema_id)
+        ON CONFLICT DO NOTHING;
+      END IF;
+      IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO report_change (entity_id, schema_id)
+        VALUES (NEW.id, NEW.schema_id)
+        ON CONFLICT DO NOTHING;
+      END IF;
+      RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE OR REPLACE FUNCTION report_change_on_value()
+    RETURNS TRIGGER AS $$
+    BEGIN
+      IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        INSERT INTO report_change (entity_id, schema_id)
+        SELECT entity.id, entity.schema_id
+        FROM entity
+        WHERE entity.id = OLD.entity_id
+        ON CONFLICT DO NOTHING;
+      END IF;
+      IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO report_change (entity_id, schema_id)
+        SELECT entity.id, entity.schema_id
+        FROM entity
+        WHERE entity.id = NEW.entity_id
+        ON CONFLICT DO NOTHING;
+      END IF;
+      RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE TRIGGER report_change_entity
+    AFTER INSERT OR UPDATE OR DELETE ON entity
+    FOR EACH ROW EXECUTE PROCEDURE report_change_on_entity()
+    """,
+] + [
+    """
+    CREATE TRIGGER report_change_%(table)s
+    AFTER INSERT OR UPDATE OR DELETE ON %(table)s
+    FOR EACH ROW EXECUTE PROCEDURE report_change_on_value()
+    """ % {'table': table}
+    for table in VALUE_TABLES]
+
+FUNCTIONS = [
+    'report_change_on_entity()',
+    'report_change_on_value()',
+]
+
+
+def upgrade():
+    op.create_table(
+        'report_status',
+        sa.Column('id', sa.Integer, primary_key=True, nullable=False),
+        sa.Column('name', sa.String, nullable=False),
+        sa.Column('schema_ids', sa.String, nullable=False),
+        sa.Column('refresh_date', sa.DateTime, nullable=False),
+        sa.UniqueConstraint('name', name='uq_report_status_name'))
+
+    op.create_table(
+        'report_change',
+        sa.Column('entity_id', sa.Integer, primary_key=True, nullable=False),
+        sa.Column('schema_id', sa.Integer, primary_key=True, nullable=False),
+        sa.Index('ix_report_change_schema_id', 'schema_id'))
+
+    for statement in TRIGGERS:
+        op.execute(statement)
+
+    # Reports are materialized afterwards with os_reports
+
+
+def downgrade():
+    for function in FUNCTIONS:
+        op.execute('DROP FUNCTION IF EXISTS %s CASCADE' % function)
+
+    # Materialized reports are named after their status entry
+    op.execute("""
+        DO $$
+        DECLARE
+          report RECORD;
+        BEGIN
+          FOR report IN SELECT id FROM report_status LOOP
+            EXECUTE 'DROP TABLE IF EXISTS report_' || report.id;
+          END LOOP;
+        END;
+        $$
+        """)
+
+    op.drop_table('report_change')
+    op.drop_table('report_status')
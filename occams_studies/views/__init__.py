@@ -1,4 +1,8 @@
 from pyramid.events import subscriber, NewResponse
+import wtforms_json
+
+# monkey-patch wtforms to accept JSON data, only the views need it
+wtforms_json.init()
 
 
 @subscriber(NewResponse)
@@ -3,19 +3,40 @@ from pyramid.session import check_csrf_token
 from pyramid.view import view_config
 import six
 from slugify import slugify
+import sqlalchemy as sa
 import wtforms
 
 from occams.utils.forms import wtferrors, Form
+from occams_datastore import models as datastore
 from occams_forms.renderers import form2json
 
 from .. import _, models
+from ..caching import conditional_get
+
+
+def view_sources(context, request):
+    """
+    Returns the records serialized by ``view_json`` (see ``conditional_get``)
+    """
+    cycle = context
+    table = models.cycle_schema_table
+    schemata = (
+        sa.select([table.c.schema_id])
+        .where(table.c.cycle_id == cycle.id))
+    return [
+        (models.Cycle, models.Cycle.id == cycle.id),
+        (models.Study, models.Study.id == cycle.study_id),
+        (table, table.c.cycle_id == cycle.id),
+        (datastore.Schema, datastore.Schema.id.in_(schemata)),
+    ]
 
 
 @view_config(
     route_name='studies.cycle',
     permission='view',
     xhr=True,
-    renderer='json')
+    renderer='fastjson',
+    decorator=conditional_get(view_sources))
 def view_json(context, request):
     cycle = context
     return {
@@ -36,13 +57,13 @@ def view_json(context, request):
     permission='add',
     request_method='POST',
     xhr=True,
-    renderer='json')
+    renderer='fastjson')
 @view_config(
     route_name='studies.cycle',
     permission='edit',
     request_method='PUT',
     xhr=True,
-    renderer='json')
+    renderer='fastjson')
 def edit_json(context, request):
     check_csrf_token(request)
     db_session = request.db_session
@@ -73,7 +94,7 @@ def edit_json(context, request):
     permission='delete',
     request_method='DELETE',
     xhr=True,
-    renderer='json')
+    renderer='fastjson')
 def delete_json(context, request):
     check_csrf_token(request)
     db_session = request.db_session
@@ -16,9 +16,9 @@ from occams.utils.forms import wtferrors, ModelField, Form
 from occams_forms.renderers import \
     make_form, render_form, apply_data, entity_data, modes
 from occams_datastore import models as datastore
-from occams_datastore.reporting import build_report
 
-from .. import _, log, models
+from .. import _, log, models, randomization
+from ..caching import conditional_get
 
 
 RAND_CHALLENGE, RAND_ENTER, RAND_VERIFY = range(3)
@@ -26,16 +26,44 @@ RAND_CHALLENGE, RAND_ENTER, RAND_VERIFY = range(3)
 RAND_INFO_KEY = 'randomization_info'
 
 
+def list_sources(context, request):
+    """
+    Returns the records serialized by ``list_json`` (see ``conditional_get``)
+    """
+    patient = context.__parent__
+    enrollments = (
+        sa.select([models.Enrollment.id])
+        .where(models.Enrollment.patient_id == patient.id))
+    studies = (
+        sa.select([models.Enrollment.study_id])
+        .where(models.Enrollment.patient_id == patient.id))
+    arms = (
+        sa.select([models.Stratum.arm_id])
+        .where(models.Stratum.patient_id == patient.id))
+    entities = (
+        sa.select([datastore.Context.entity_id])
+        .where(datastore.Context.external == u'enrollment')
+        .where(datastore.Context.key.in_(enrollments)))
+    return [
+        (models.Enrollment, models.Enrollment.patient_id == patient.id),
+        (models.Study, models.Study.id.in_(studies)),
+        (models.Stratum, models.Stratum.patient_id == patient.id),
+        (models.Arm, models.Arm.id.in_(arms)),
+        (datastore.Entity, datastore.Entity.id.in_(entities)),
+    ]
+
+
 @view_config(
     route_name='studies.enrollments',
     permission='view',
     xhr=True,
-    renderer='json')
+    renderer='fastjson',
+    decorator=conditional_get(list_sources))
 def list_json(context, request):
     db_session = request.db_session
     patient = context.__parent__
     enrollments_query = (
-        db_session.query(models.Enrollment)
+        db_session.query(models.Enrollment, has_stratum_column())
         .filter_by(patient=patient)
         .options(
             orm.joinedload('patient').joinedload('site'),
@@ -44,20 +72,70 @@ def list_json(context, request):
         .order_by(models.Enrollment.consent_date.desc()))
 
     return {
-        'enrollments': [view_json(e, request) for e in enrollments_query]
+        'enrollments': [
+            view_json(e, request, has_stratum=has_stratum)
+            for e, has_stratum in enrollments_query]
         }
 
 
+def has_stratum_column():
+    """
+    Returns a column indicating whether an enrollment has been randomized
+
+    That is, whether the enrollment has an entry of its study's
+    randomization form, determined without loading the enrollment's forms.
+    """
+    randomization_schema = orm.aliased(datastore.Schema)
+    return (
+        sa.exists()
+        .where(datastore.Context.external == u'enrollment')
+        .where(datastore.Context.key == models.Enrollment.id)
+        .where(datastore.Context.entity_id == datastore.Entity.id)
+        .where(datastore.Entity.schema_id == datastore.Schema.id)
+        .where(models.Study.id == models.Enrollment.study_id)
+        .where(randomization_schema.id ==
+               models.Study.randomization_schema_id)
+        .where(datastore.Schema.name == randomization_schema.name)
+        .label('has_stratum'))
+
+
+def get_permissions(enrollment, request):
+    """
+    Returns the current user's permissions for the enrollment
+
+    Enrollment ACLs only vary by site, so they are only evaluated once per
+    site for the duration of the request.
+    """
+    cache = request.environ.setdefault(
+        'occams_studies.enrollment_permissions', {})
+    site_id = enrollment.patient.site_id
+    try:
+        permissions = cache[site_id]
+    except KeyError:
+        permissions = cache[site_id] = dict(
+            (name, bool(request.has_permission(name, enrollment)))
+            for name in ('edit', 'terminate', 'randomize', 'delete'))
+    return permissions
+
+
 @view_config(
     route_name='studies.enrollment',
     permission='view',
     xhr=True,
-    renderer='json')
-def view_json(context, request):
+    renderer='fastjson')
+def view_json(context, request, has_stratum=None):
+    """
+    Converts an enrollment to JSON
+
+    Listings should pass ``has_stratum`` (see ``has_stratum_column``),
+    otherwise it is looked up separately.
+    """
+    db_session = request.db_session
     enrollment = context
     study = context.study
     patient = context.patient
-    can_randomize = bool(request.has_permission('randomize', context))
+    permissions = get_permissions(enrollment, request)
+    can_randomize = permissions['randomize']
     data = {
         '__url__': request.route_path(
             'studies.enrollment',
@@ -71,14 +149,11 @@ def view_json(context, request):
             'studies.enrollment_termination',
             patient=patient.pid,
             enrollment=enrollment.id),
-        '__can_edit__':
-            bool(request.has_permission('edit', context)),
+        '__can_edit__': permissions['edit'],
         '__can_terminate__': bool(
-            request.has_permission('terminate', context) and
-            study.termination_schema),
+            permissions['terminate'] and study.termination_schema),
         '__can_randomize__': can_randomize,
-        '__can_delete__':
-            bool(request.has_permission('delete', context)),
+        '__can_delete__': permissions['delete'],
         'id': enrollment.id,
         'study': {
             'id': study.id,
@@ -97,26 +172,29 @@ def view_json(context, request):
     }
 
     if study.is_randomized:
-        has_stratum = any(
-            entity.schema.name == study.randomization_schema.name
-            for entity in enrollment.entities
-        )
+        if has_stratum is None:
+            (has_stratum,) = (
+                db_session.query(has_stratum_column())
+                .select_from(models.Enrollment)
+                .filter(models.Enrollment.id == enrollment.id)
+                .one())
         if has_stratum:
+            stratum = enrollment.stratum
             data['stratum'] = {
-                'id': enrollment.stratum.id,
+                'id': stratum.id,
                 'arm': None,
                 'randid': None
             }
 
             if not study.is_blinded and can_randomize:
                 data['stratum']['arm'] = {
-                    'id': enrollment.stratum.arm.id,
-                    'name': enrollment.stratum.arm.name,
-                    'title': enrollment.stratum.arm.title,
+                    'id': stratum.arm.id,
+                    'name': stratum.arm.name,
+                    'title': stratum.arm.title,
                 }
 
             if not study.is_blinded:
-                data['stratum']['randid'] = enrollment.stratum.randid
+                data['stratum']['randid'] = stratum.randid
 
     return data
 
@@ -126,13 +204,13 @@ def view_json(context, request):
     permission='add',
     xhr=True,
     request_method='POST',
-    renderer='json')
+    renderer='fastjson')
 @view_config(
     route_name='studies.enrollment',
     permission='edit',
     xhr=True,
     request_method='PUT',
-    renderer='json')
+    renderer='fastjson')
 def edit_json(context, request):
     check_csrf_token(request)
     db_session = request.db_session
@@ -165,7 +243,7 @@ def edit_json(context, request):
     permission='delete',
     request_method='DELETE',
     xhr=True,
-    renderer='json')
+    renderer='fastjson')
 def delete_json(context, request):
     db_session = request.db_session
     list(map(db_session.delete, context.entities))
@@ -340,7 +418,7 @@ def randomize_print(context, request):
     route_name='studies.enrollment_randomization',
     permission='randomize',
     xhr=True,
-    renderer='json')
+    renderer='fastjson')
 def randomize_ajax(context, request):
     """
     Procesess a patient's randomiation by completing randomization form
@@ -471,31 +549,20 @@ def randomize_ajax(context, request):
                         return HTTPFound(location=request.current_route_path(
                             _query={'procid': internal_procid}))
                 else:
-                    report = build_report(
-                        db_session, enrollment.study.randomization_schema.name)
-                    data = form.data
-
-                    # Get an unassigned entity that matches the input criteria
-                    query = (
-                        db_session.query(models.Stratum)
-                        .filter(models.Stratum.study == enrollment.study)
-                        .filter(models.Stratum.patient == sa.null())
-                        .join(models.Stratum.contexts)
-                        .join(datastore.Context.entity)
-                        .add_entity(datastore.Entity)
-                        .join(report, report.c.id == datastore.Entity.id)
-                        .filter(sa.and_(
-                            *[(getattr(report.c, k) == v)
-                                for k, v in data.items()]))
-                        .order_by(models.Stratum.id.asc())
-                        .limit(1))
-
-                    try:
-                        (stratum, entity) = query.one()
-                    except orm.exc.NoResultFound:
+                    # Claim an unassigned stratum for the input criteria
+                    stratum = randomization.allocate_stratum(
+                        db_session, enrollment.study, form.data)
+
+                    if stratum is None:
                         raise HTTPBadRequest(
                             body=_(u'Randomization numbers depleted'))
 
+                    entity = (
+                        db_session.query(datastore.Entity)
+                        .join(datastore.Entity.contexts)
+                        .filter_by(external='stratum', key=stratum.id)
+                        .one())
+
                     # so far so good, set the contexts and complete the request
                     stratum.patient = enrollment.patient
                     entity.state = (
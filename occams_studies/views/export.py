@@ -3,8 +3,6 @@ import json
 import os
 import uuid
 
-from babel.dates import format_datetime
-from humanize import naturalsize
 from pyramid.i18n import get_localizer, negotiate_locale_name
 from pyramid.httpexceptions import HTTPBadRequest, HTTPFound, HTTPOk
 from pyramid.response import FileResponse
@@ -18,7 +16,7 @@ from occams.utils.forms import wtferrors, Form
 from occams.utils.pagination import Pagination
 from occams_datastore import models as datastore
 
-from .. import _, log, models, exports, tasks
+from .. import _, log, models, exports, renderers, tasks
 
 
 @view_config(
@@ -127,7 +125,7 @@ def codebook(context, request):
     """
     Codebook viewer
     """
-    db_session = request.db_session
+    db_session = request.read_db_session
     plans = request.registry.settings['studies.export.plans']
     return {'exportables': exports.list_all(plans, db_session).values()}
 
@@ -136,19 +134,12 @@ def codebook(context, request):
     route_name='studies.exports_codebook',
     permission='view',
     xhr=True,
-    renderer='json')
+    renderer='fastjson')
 def codebook_json(context, request):
     """
     Loads codebook rows for the specified data file
     """
-    db_session = request.db_session
-
-    def massage(row):
-        publish_date = row['publish_date']
-        if publish_date:
-            row['publish_date'] = publish_date.isoformat()
-        return row
-
+    db_session = request.read_db_session
     plans = request.registry.settings['studies.export.plans']
     exportables = exports.list_all(plans, db_session)
 
@@ -158,7 +149,7 @@ def codebook_json(context, request):
         raise HTTPBadRequest(u'File specified does not exist')
 
     plan = exportables[file]
-    return [massage(row) for row in plan.codebook()]
+    return renderers.stream(list(plan.codebook()))
 
 
 @view_config(
@@ -180,6 +171,56 @@ def codebook_download(context, request):
     return response
 
 
+def _metrics_params(request):
+    """
+    Parses the plan and period (in days) requested from the metrics report
+    """
+    try:
+        days = int(request.GET.get('days') or exports.metrics.DEFAULT_DAYS)
+    except ValueError:
+        raise HTTPBadRequest(u'Invalid number of days')
+    if days < 1:
+        raise HTTPBadRequest(u'Invalid number of days')
+    return request.GET.get('plan') or None, days
+
+
+@view_config(
+    route_name='studies.exports_metrics',
+    permission='admin',
+    renderer='../templates/export/metrics.pt')
+def metrics(context, request):
+    """
+    Ranks export plans by cost, and trends the selected plan's costs
+    """
+    return metrics_json(context, request)
+
+
+@view_config(
+    route_name='studies.exports_metrics',
+    permission='admin',
+    xhr=True,
+    renderer='fastjson')
+def metrics_json(context, request):
+    """
+    Returns the costs of each export plan, most expensive first
+
+    Times are in seconds, sizes in bytes. See ``exports.metrics``.
+
+    GET parameters:
+        days -- (optional) only consider the most recent number of days
+        plan -- (optional) also returns this plan's daily costs
+    """
+    db_session = request.read_db_session
+    plan, days = _metrics_params(request)
+    return {
+        'days': days,
+        'plan': plan,
+        'plans': exports.metrics.rank(db_session, days),
+        'trend':
+            exports.metrics.trend(db_session, plan, days) if plan else None,
+    }
+
+
 @view_config(
     route_name='studies.exports_status',
     permission='view',
@@ -197,11 +238,14 @@ def status(context, request):
     route_name='studies.exports_status',
     permission='view',
     xhr=True,
-    renderer='json')
+    renderer='fastjson')
 def status_json(context, request):
     """
     Returns the current exports statuses.
     """
+    # Only needed here, so not imported at worker boot
+    from babel.dates import format_datetime
+    from humanize import naturalsize
 
     exports_query = query_exports(request)
     exports_count = exports_query.count()
@@ -32,7 +32,7 @@ def view(context, request):
     route_name='studies.external_services',
     permission='view',
     xhr=True,
-    renderer='json'
+    renderer='fastjson'
 )
 def list_(context, request):
     """
@@ -56,7 +56,7 @@ def list_(context, request):
     route_name='studies.external_service',
     permission='view',
     xhr=True,
-    renderer='json'
+    renderer='fastjson'
 )
 def view_json(context, request):
     """
@@ -81,7 +81,7 @@ def view_json(context, request):
     permission='delete',
     xhr=True,
     request_method='DELETE',
-    renderer='json'
+    renderer='fastjson'
 )
 def delete_json(context, request):
     """
@@ -110,14 +110,14 @@ def delete_json(context, request):
     permission='add',
     xhr=True,
     request_method='POST',
-    renderer='json'
+    renderer='fastjson'
 )
 @view_config(
     route_name='studies.external_service',
     permission='edit',
     xhr=True,
     request_method='PUT',
-    renderer='json'
+    renderer='fastjson'
 )
 def edit_json(context, request):
     """
@@ -3,7 +3,6 @@ from pyramid.httpexceptions import HTTPBadRequest, HTTPOk
 from pyramid.session import check_csrf_token
 from pyramid.view import view_config
 import sqlalchemy as sa
-from sqlalchemy import orm
 import wtforms
 from wtforms.ext.dateutil.fields import DateField
 from wtforms_components import DateRange
@@ -17,32 +16,129 @@ from occams_forms.renderers import \
 from .. import _, models
 
 
+# Number of forms in each page of paged form listings
+FORMS_PER_PAGE = 100
+
+
+@view_config(
+    route_name='studies.patient_forms',
+    permission='view',
+    xhr=True,
+    renderer='fastjson')
+@view_config(
+    route_name='studies.visit_forms',
+    permission='view',
+    xhr=True,
+    renderer='fastjson')
 def list_json(context, request):
+    """
+    Lists the forms of a patient, visit or enrollment
+
+    Only the columns needed for the listing are fetched (rather than the
+    entities themselves) and URLs are built from the already-traversed
+    parent, so patients with thousands of forms list in a single query.
+
+    GET parameters:
+        page -- (optional) only returns the given page of forms
+
+    Returns a JSON object containing the following properties:
+        entities -- the form listing, see ``view_json`` for more info.
+        __has_next__ -- (if paged) flag indicating more pages to fetch
+        __has_previous__ -- (if paged) flag indicating it's not page 1
+        __page__ -- (if paged) the current page
+    """
     db_session = request.db_session
 
     external = context.__parent__
 
+    if isinstance(external, models.Visit):
+        params = {
+            'patient': external.patient.pid,
+            'visit': external.visit_date.isoformat()
+        }
+
+        def url(entity_id):
+            return request.route_path(
+                'studies.visit_form', form=entity_id, **params)
+
+    elif isinstance(external, models.Patient):
+        def url(entity_id):
+            return request.route_path(
+                'studies.patient_form', patient=external.pid, form=entity_id)
+
+    else:
+        def url(entity_id):
+            return None
+
+    phi = models.patient_schema_table
+
     query = (
-        db_session.query(datastore.Entity)
-        .options(orm.joinedload('schema'), orm.joinedload('state'))
-        .join(datastore.Schema)
-        .join(datastore.Context)
-        .filter_by(external=external.__tablename__, key=external.id)
+        db_session.query(
+            datastore.Entity.id,
+            datastore.Entity.collect_date,
+            datastore.Entity.not_done,
+            datastore.Schema.name.label('schema_name'),
+            datastore.Schema.title.label('schema_title'),
+            datastore.Schema.publish_date.label('schema_publish_date'),
+            datastore.State.id.label('state_id'),
+            datastore.State.name.label('state_name'),
+            datastore.State.title.label('state_title'))
+        .join(datastore.Entity.schema)
+        .outerjoin(datastore.Entity.state)
+        .join(datastore.Entity.contexts)
+        .filter(datastore.Context.external == external.__tablename__)
+        .filter(datastore.Context.key == external.id)
         # Do not show PHI forms since there are dedicated tabs for them
-        .filter(~datastore.Schema.id.in_(
-            db_session.query(models.patient_schema_table.c.schema_id)
-            .subquery()))
-        .order_by(datastore.Schema.name, datastore.Entity.collect_date))
+        .outerjoin(phi, phi.c.schema_id == datastore.Schema.id)
+        .filter(phi.c.schema_id == sa.null())
+        .order_by(
+            datastore.Schema.name,
+            datastore.Entity.collect_date,
+            datastore.Entity.id))
+
+    def row2json(row):
+        return {
+            '__url__': url(row.id),
+            'id': row.id,
+            'schema': {
+                'name': row.schema_name,
+                'title': row.schema_title,
+                'publish_date': row.schema_publish_date.isoformat()
+            },
+            'collect_date': row.collect_date.isoformat(),
+            'not_done': row.not_done,
+            'state': None if row.state_id is None else {
+                'id': row.state_id,
+                'name': row.state_name,
+                'title': row.state_title,
+            }
+        }
+
+    if 'page' not in request.GET:
+        return {'entities': [row2json(row) for row in query]}
+
+    class PageForm(Form):
+        page = wtforms.IntegerField(
+            validators=[wtforms.validators.Optional()],
+            filters=[lambda v: 1 if not v or v < 1 else v],
+            default=1)
+
+    form = PageForm(request.GET)
+    form.validate()
+
+    # Fetch one record past the page to determine if there are more
+    query = (
+        query
+        .offset((form.page.data - 1) * FORMS_PER_PAGE)
+        .limit(FORMS_PER_PAGE + 1))
 
-    def fake_traverse(entity):
-        entity.__parent__ = context
-        return entity
+    entities = [row2json(row) for row in query]
 
     return {
-        'entities': [
-            view_json(fake_traverse(entity), request)
-            for entity in query
-        ]
+        '__has_previous__': form.page.data > 1,
+        '__has_next__': len(entities) > FORMS_PER_PAGE,
+        '__page__': form.page.data,
+        'entities': entities[:FORMS_PER_PAGE]
     }
 
 
@@ -95,25 +191,25 @@ def view_json(context, request):
     permission='edit',
     xhr=True,
     request_param='vocabulary=available_schemata',
-    renderer='json')
+    renderer='fastjson')
 @view_config(
     route_name='studies.patient_form',
     permission='edit',
     xhr=True,
     request_param='vocabulary=available_schemata',
-    renderer='json')
+    renderer='fastjson')
 @view_config(
     route_name='studies.visit',
     permission='edit',
     xhr=True,
     request_param='vocabulary=available_schemata',
-    renderer='json')
+    renderer='fastjson')
 @view_config(
     route_name='studies.visit_form',
     permission='edit',
     xhr=True,
     request_param='vocabulary=available_schemata',
-    renderer='json')
+    renderer='fastjson')
 def available_schemata(context, request):
     """
     Returns a list of available schemata for the given context
@@ -213,13 +309,13 @@ def markup_ajax(context, request):
     xhr=True,
     permission='add',
     request_method='POST',
-    renderer='json')
+    renderer='fastjson')
 @view_config(
     route_name='studies.patient_forms',
     xhr=True,
     permission='add',
     request_method='POST',
-    renderer='json')
+    renderer='fastjson')
 def add_json(context, request):
     check_csrf_token(request)
     db_session = request.db_session
@@ -303,13 +399,13 @@ def add_json(context, request):
     xhr=True,
     permission='delete',
     request_method='DELETE',
-    renderer='json')
+    renderer='fastjson')
 @view_config(
     route_name='studies.patient_forms',
     xhr=True,
     permission='delete',
     request_method='DELETE',
-    renderer='json')
+    renderer='fastjson')
 def bulk_delete_json(context, request):
     """
     Deletes forms in bulk
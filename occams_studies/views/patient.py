@@ -1,13 +1,18 @@
 from collections import OrderedDict
 
 from datetime import datetime
+import os
+import shutil
+import uuid
+
 from pyramid.httpexceptions import \
-    HTTPBadRequest, HTTPFound, HTTPForbidden, HTTPOk
+    HTTPBadRequest, HTTPFound, HTTPForbidden, HTTPNotFound, HTTPOk
 from pyramid.session import check_csrf_token
 from pyramid.view import view_config
 import six
 import sqlalchemy as sa
 from sqlalchemy import orm
+import transaction
 import wtforms
 from zope.sqlalchemy import mark_changed
 
@@ -18,7 +23,9 @@ from occams_forms.renderers import \
     make_form, render_form, apply_data, entity_data, \
     form2json, modes
 
-from .. import _, log, models
+from .. import \
+    _, bulk, capabilities, jobs, log, models, patient_import, tasks
+from ..caching import conditional_get
 from . import (
     site as site_views,
     enrollment as enrollment_views,
@@ -29,6 +36,13 @@ from . import (
 from .external_service import render_url
 
 
+# Rosters over 1MB (roughly 20,000 patients) are imported in the background
+PATIENTS_ASYNC_SIZE = 1024 * 1024
+
+# Number of forms deleted at a time when deleting a patient
+DELETE_CHUNK_SIZE = 1000
+
+
 @view_config(
     route_name='studies.patients',
     permission='view',
@@ -54,7 +68,7 @@ def search_view(context, request):
     route_name='studies.patients',
     permission='view',
     xhr=True,
-    renderer='json')
+    renderer='fastjson')
 def search_json(context, request):
     """
     Generates a search result listing based on a string term.
@@ -74,7 +88,7 @@ def search_json(context, request):
                     __last_visit_date__ -- indicates the last interaction
                                            with the patient
     """
-    db_session = request.db_session
+    db_session = request.read_db_session
     per_page = 10
 
     class SearchForm(Form):
@@ -93,15 +107,13 @@ def search_json(context, request):
     sites = db_session.query(models.Site)
     site_ids = [s.id for s in sites if request.has_permission('view', s)]
 
+    activity = models.patient_activity_table
+
     query = (
         db_session.query(models.Patient)
         .options(orm.joinedload(models.Patient.site))
-        .add_column(
-            db_session.query(models.Visit.visit_date)
-            .filter(models.Visit.patient_id == models.Patient.id)
-            .order_by(models.Visit.visit_date.desc())
-            .limit(1)
-            .as_scalar())
+        .outerjoin(activity, activity.c.patient_id == models.Patient.id)
+        .add_column(activity.c.last_visit_date)
         .filter(models.Patient.site_id.in_(site_ids)))
 
     if form.query.data:
@@ -170,15 +182,12 @@ def view(context, request):
     # TODO: Need to limit PHI
     return {
         'phi': get_phi_entities(context, request),
-        'available_studies': (
-            db_session.query(models.Study)
-            .order_by(models.Study.title.asc())),
         'patient': view_json(context, request),
         'enrollments': enrollment_views.list_json(
             context['enrollments'], request)['enrollments'],
         'visits': visit_views.list_json(
             context['visits'], request)['visits'],
-        'is_lab_enabled': db_session.bind.has_table('specimen')
+        'is_lab_enabled': capabilities.get(db_session).lab
         }
 
 
@@ -187,7 +196,7 @@ def view(context, request):
     permission='edit',
     xhr=True,
     request_param='vocabulary=available_studies',
-    renderer='json')
+    renderer='fastjson')
 def available_studies(context, request):
     """
     Returns a list of studies that the patient can participate in
@@ -209,12 +218,36 @@ def available_studies(context, request):
     }
 
 
+def view_sources(context, request):
+    """
+    Returns the records serialized by ``view_json`` (see ``conditional_get``)
+    """
+    patient = context
+    enrolled_studies = (
+        sa.select([models.Enrollment.study_id])
+        .where(models.Enrollment.patient_id == patient.id))
+    reference_types = (
+        sa.select([models.PatientReference.reference_type_id])
+        .where(models.PatientReference.patient_id == patient.id))
+    return [
+        (models.Patient, models.Patient.id == patient.id),
+        (models.Site, models.Site.id == patient.site_id),
+        (models.PatientReference,
+            models.PatientReference.patient_id == patient.id),
+        (models.ReferenceType, models.ReferenceType.id.in_(reference_types)),
+        (models.Enrollment, models.Enrollment.patient_id == patient.id),
+        (models.ExternalService,
+            models.ExternalService.study_id.in_(enrolled_studies)),
+    ]
+
+
 @view_config(
     route_name='studies.patient',
     permission='view',
     request_method='GET',
     xhr=True,
-    renderer='json')
+    renderer='fastjson',
+    decorator=conditional_get(view_sources))
 def view_json(context, request):
     db_session = request.db_session
     patient = context
@@ -255,7 +288,7 @@ def view_json(context, request):
     route_name='studies.patients_forms',
     permission='admin',
     xhr=True,
-    renderer='json')
+    renderer='fastjson')
 def forms_list_json(context, request):
     """
     Returns a listing of available patient forms
@@ -278,7 +311,7 @@ def forms_list_json(context, request):
     permission='admin',
     request_method='POST',
     xhr=True,
-    renderer='json')
+    renderer='fastjson')
 def forms_add_json(context, request):
     """
     Updates the available patient forms
@@ -363,7 +396,7 @@ def forms_add_json(context, request):
     permission='admin',
     request_method='DELETE',
     xhr=True,
-    renderer='json')
+    renderer='fastjson')
 def forms_delete_json(context, request):
     """
     Removes a required patient form.
@@ -409,13 +442,13 @@ def forms_delete_json(context, request):
     permission='add',
     xhr=True,
     request_method='POST',
-    renderer='json')
+    renderer='fastjson')
 @view_config(
     route_name='studies.patient',
     permission='edit',
     xhr=True,
     request_method='PUT',
-    renderer='json')
+    renderer='fastjson')
 def edit_json(context, request):
     check_csrf_token(request)
     db_session = request.db_session
@@ -476,27 +509,147 @@ def edit_json(context, request):
     return view_json(patient, request)
 
 
+@view_config(
+    route_name='studies.patients_imports',
+    permission='add',
+    xhr=True,
+    request_method='POST',
+    renderer='fastjson')
+def import_json(context, request):
+    """
+    Imports a roster of patients from a CSV or JSON file
+
+    The file is validated as a whole, if any problems are found nothing
+    is imported and the problems are returned in the ``errors`` list of
+    the response.
+
+    Files larger than ``studies.patients.async_size`` bytes are imported
+    in the background, in which case the response contains the URL
+    to poll for the import's progress.
+    """
+    check_csrf_token(request)
+    db_session = request.db_session
+
+    input_file = request.POST['upload'].file
+
+    try:
+        roster = patient_import.PatientList(db_session, input_file)
+    except patient_import.UploadError as e:
+        raise HTTPBadRequest(body=e.message)
+
+    settings = request.registry.settings
+    async_size = int(settings.get(
+        'studies.patients.async_size', PATIENTS_ASYNC_SIZE))
+
+    input_file.seek(0, os.SEEK_END)
+    if input_file.tell() > async_size:
+        return defer_import(context, request, input_file)
+
+    try:
+        total, errors = roster.validate(
+            is_allowed=lambda site: request.has_permission('view', site))
+
+        if errors:
+            raise HTTPBadRequest(json={
+                'errors': bulk.errors2json(
+                    errors, request.localizer.translate)})
+
+        pids = roster.load()
+    except patient_import.UploadError as e:
+        raise HTTPBadRequest(body=e.message)
+
+    return {'count': len(pids), 'pids': pids}
+
+
+def defer_import(context, request, input_file):
+    """
+    Schedules a background task to import the roster
+    """
+    db_session = request.db_session
+    settings = request.registry.settings
+    import_id = six.text_type(str(uuid.uuid4()))
+    userid = request.authenticated_userid
+
+    # The export directory is already shared with the celery workers
+    path = os.path.join(
+        settings['studies.export.dir'],
+        'patients-{0}.dat'.format(import_id))
+
+    input_file.seek(0)
+    with open(path, 'wb') as fp:
+        shutil.copyfileobj(input_file, fp)
+
+    # Workers have no request to check permissions against
+    site_ids = [
+        site.id for site in db_session.query(models.Site)
+        if request.has_permission('view', site)]
+
+    jobs.JobStatus(request.redis, 'patients', import_id).start(userid)
+
+    def apply_after_commit(success):
+        if success:
+            tasks.import_patients.apply_async(
+                args=[import_id, path, site_ids, userid],
+                task_id=import_id)
+        else:
+            os.remove(path)
+
+    # Avoid race-condition by executing the task after succesful commit
+    transaction.get().addAfterCommitHook(apply_after_commit)
+
+    request.response.status_code = 202
+    return {
+        'import_id': import_id,
+        '__status_url__': request.route_path(
+            'studies.patients_import', import_id=import_id),
+    }
+
+
+@view_config(
+    route_name='studies.patients_import',
+    permission='add',
+    xhr=True,
+    renderer='fastjson')
+def import_status_json(context, request):
+    """
+    Returns the progress of a background roster import
+    """
+    status = jobs.JobStatus(
+        request.redis, 'patients', request.matchdict['import_id'])
+    data = status.to_json(request.authenticated_userid)
+
+    if data is None:
+        raise HTTPNotFound()
+
+    return data
+
+
 @view_config(
     route_name='studies.patient',
     permission='delete',
     xhr=True,
     request_method='DELETE',
-    renderer='json')
+    renderer='fastjson')
 def delete_json(context, request):
+    """
+    Deletes the patient along with all of their data
+
+    If the ``dry_run`` parameter is set, nothing is deleted and the
+    response contains the number of records that would be deleted.
+    """
     check_csrf_token(request)
     db_session = request.db_session
 
-    for entity in context.entities:
-        db_session.delete(entity)
-    db_session.flush()
+    if request.params.get('dry_run'):
+        return {'counts': delete_patient(db_session, context, dry_run=True)}
 
-    db_session.delete(context)
-    db_session.flush()
+    pid = context.pid
+    delete_patient(db_session, context)
 
     viewed = request.session.setdefault('viewed', OrderedDict())
 
     try:
-        del viewed[context.pid]
+        del viewed[pid]
     except KeyError:
         log.warn('This patient was never viewed in the browser')
     else:
@@ -504,13 +657,91 @@ def delete_json(context, request):
 
     msg = request.localizer.translate(
         _('Patient ${pid} was successfully removed'),
-        mapping={'pid': context.pid})
+        mapping={'pid': pid})
     request.session.flash(msg, 'success')
     return {
         '__next__': request.current_route_path(_route_name='studies.index')
     }
 
 
+def delete_patient(db_session, patient, dry_run=False):
+    """
+    Deletes a patient and their data using set-based DELETE statements
+
+    Patients followed for years accumulate thousands of forms, which
+    are too many to delete one object at a time through the ORM.
+
+    Returns the number of records (that would be) deleted by type
+    """
+    db_session.flush()
+
+    visit_ids = (
+        sa.select([models.Visit.id])
+        .where(models.Visit.patient_id == patient.id))
+    enrollment_ids = (
+        sa.select([models.Enrollment.id])
+        .where(models.Enrollment.patient_id == patient.id))
+    partner_ids = (
+        sa.select([models.Partner.id])
+        .where(models.Partner.patient_id == patient.id))
+
+    owners = [
+        (models.Patient.__tablename__, [patient.id]),
+        (models.Visit.__tablename__, visit_ids),
+        (models.Enrollment.__tablename__, enrollment_ids),
+        (models.Partner.__tablename__, partner_ids),
+    ]
+
+    entity_ids = [
+        entity_id for (entity_id,) in (
+            db_session.query(datastore.Context.entity_id)
+            .filter(sa.or_(*[
+                (datastore.Context.external == external)
+                & datastore.Context.key.in_(keys)
+                for external, keys in owners]))
+            .distinct())]
+
+    value_tables = sorted(
+        set(m.__table__ for m in six.itervalues(datastore.nameModelMap)),
+        key=lambda t: t.name)
+
+    # Values are counted together regardless of their type
+    counts = OrderedDict([('values', 0), ('context', 0), ('entity', 0)])
+
+    for chunk in bulk.chunked(entity_ids, DELETE_CHUNK_SIZE):
+        for table in value_tables:
+            counts['values'] += bulk.delete_many(
+                db_session, table, table.c.entity_id.in_(chunk), dry_run)
+        table = datastore.Context.__table__
+        counts[table.name] += bulk.delete_many(
+            db_session, table, table.c.entity_id.in_(chunk), dry_run)
+        table = datastore.Entity.__table__
+        counts[table.name] += bulk.delete_many(
+            db_session, table, table.c.id.in_(chunk), dry_run)
+
+    table = models.visit_cycle_table
+    counts[table.name] = bulk.delete_many(
+        db_session, table, table.c.visit_id.in_(visit_ids), dry_run)
+
+    for model in (models.Visit,
+                  models.Enrollment,
+                  models.Partner,
+                  models.PatientReference):
+        table = model.__table__
+        counts[table.name] = bulk.delete_many(
+            db_session, table, table.c.patient_id == patient.id, dry_run)
+
+    table = models.Patient.__table__
+    counts[table.name] = bulk.delete_many(
+        db_session, table, table.c.id == patient.id, dry_run)
+
+    if not dry_run:
+        # Loaded objects no longer reflect the database
+        db_session.expire_all()
+
+    return counts
+
+
 @view_config(
     route_name='studies.patient_forms',
     permission='view',
@@ -12,7 +12,7 @@ from .. import _, models
 @view_config(
     route_name='studies.reference_types',
     permission='view',
-    renderer='json')
+    renderer='fastjson')
 def list_json(context, request):
     db_session = request.db_session
     query = (
@@ -26,7 +26,7 @@ def list_json(context, request):
 @view_config(
     route_name='studies.reference_type',
     permission='view',
-    renderer='json')
+    renderer='fastjson')
 def view_json(context, request):
     return {
         '__url__': request.route_path(
@@ -44,12 +44,12 @@ def view_json(context, request):
     route_name='studies.reference_types',
     request_method='POST',
     permission='add',
-    renderer='json')
+    renderer='fastjson')
 @view_config(
     route_name='studies.reference_type',
     request_method='PUT',
     permission='edit',
-    renderer='json')
+    renderer='fastjson')
 def edit_json(context, request):
     check_csrf_token(request)
 
@@ -109,7 +109,7 @@ def edit_json(context, request):
     route_name='studies.reference_type',
     request_method='DELETE',
     permission='delete',
-    renderer='json')
+    renderer='fastjson')
 def delete_json(context, request):
     check_csrf_token(request)
     db_session = request.db_session
@@ -133,7 +133,7 @@ def delete_json(context, request):
     permission='view',
     xhr=True,
     request_param='vocabulary=available_reference_types',
-    renderer='json')
+    renderer='fastjson')
 def available_reference_types(context, request):
     db_session = request.db_session
     term = (request.GET.get('term') or '').strip()
@@ -1,3 +1,5 @@
+from pyramid.httpexceptions import HTTPOk
+from pyramid.session import check_csrf_token
 from pyramid.view import view_config
 import sqlalchemy as sa
 import wtforms
@@ -6,7 +8,7 @@ from occams.utils.forms import Form
 from occams_datastore import models as datastore
 from occams_forms.renderers import form2json, version2json
 
-from .. import models
+from .. import models, profiling
 
 
 @view_config(
@@ -17,13 +19,48 @@ def view(context, request):
     return {}
 
 
+@view_config(
+    route_name='studies.settings_profiling',
+    permission='admin',
+    request_method='GET',
+    renderer='fastjson')
+def profiling_json(context, request):
+    """
+    Summarizes the latency, SQL and serialization costs of each route
+
+    Routes are listed slowest (by 99th percentile latency) first. Times are
+    in milliseconds. Only sampled requests are included (see
+    ``occams_studies.profiling``).
+    """
+    return {
+        'sample_rate':
+            request.registry.settings['studies.profiling.sample_rate'],
+        'routes': profiling.summarize(request.redis),
+    }
+
+
+@view_config(
+    route_name='studies.settings_profiling',
+    permission='admin',
+    request_method='DELETE',
+    xhr=True,
+    renderer='fastjson')
+def profiling_reset_json(context, request):
+    """
+    Discards the recorded measurements
+    """
+    check_csrf_token(request)
+    profiling.reset(request.redis)
+    return HTTPOk()
+
+
 # TODO: cleverly join this with the other available_schmata running around
 @view_config(
     route_name='studies.settings',
     permission='admin',
     xhr=True,
     request_param='vocabulary=available_schemata',
-    renderer='json')
+    renderer='fastjson')
 def available_schemata(context, request):
     """
     Returns a listing of available schemata for the study
@@ -6,13 +6,14 @@ import wtforms
 from occams.utils.forms import wtferrors, Form
 
 from .. import _, models
+from . import study as study_views
 
 
 @view_config(
     route_name='studies.sites',
     permission='view',
     xhr=True,
-    renderer='json')
+    renderer='fastjson')
 def list_json(context, request):
     db_session = request.db_session
 
@@ -31,7 +32,7 @@ def list_json(context, request):
     route_name='studies.site',
     xhr=True,
     permission='view',
-    renderer='json')
+    renderer='fastjson')
 def view_json(context, request):
     return {
         '__url__': request.route_path('studies.site', site=context.name),
@@ -41,12 +42,32 @@ def view_json(context, request):
     }
 
 
+@view_config(
+    route_name='studies.site_visit_schedule',
+    permission='view',
+    xhr=True,
+    renderer='fastjson')
+def visit_schedule_json(context, request):
+    """
+    Lists the site's visits that are due, overdue or missed
+
+    Expects the following GET parameters:
+        status -- (optional) only list visits of this status
+        page -- (optional) the page of the listing to fetch (default: 1)
+    """
+    table = models.visit_schedule_table
+    return study_views.visit_schedule_page(
+        request,
+        request.read_db_session,
+        table.c.site_id == context.id)
+
+
 @view_config(
     route_name='studies.sites',
     permission='view',
     xhr=True,
     request_param='vocabulary=available_sites',
-    renderer='json')
+    renderer='fastjson')
 def available_sites(context, request):
     db_session = request.db_session
     term = (request.GET.get('term') or '').strip()
@@ -71,13 +92,13 @@ def available_sites(context, request):
     permission='add',
     request_method='POST',
     xhr=True,
-    renderer='json')
+    renderer='fastjson')
 @view_config(
     route_name='studies.site',
     permission='edit',
     request_method='PUT',
     xhr=True,
-    renderer='json')
+    renderer='fastjson')
 def edit_json(context, request):
     db_session = request.db_session
     check_csrf_token(request)
@@ -105,7 +126,7 @@ def edit_json(context, request):
     permission='delete',
     request_method='DELETE',
     xhr=True,
-    renderer='json')
+    renderer='fastjson')
 def delete_json(context, request):
     check_csrf_token(request)
     db_session = request.db_session
@@ -1,8 +1,8 @@
-try:
-    import unicodecsv as csv
-except ImportError:  # pragma: nocover
-    import csv
+from collections import namedtuple
 from datetime import date, timedelta
+import os
+import shutil
+import uuid
 
 from slugify import slugify
 from pyramid.events import subscriber, BeforeRender
@@ -10,8 +10,10 @@ from pyramid.httpexceptions import \
     HTTPBadRequest, HTTPForbidden, HTTPNotFound, HTTPOk
 from pyramid.session import check_csrf_token
 from pyramid.view import view_config
+import six
 import sqlalchemy as sa
 from sqlalchemy import orm
+import transaction
 import wtforms
 from wtforms.ext.dateutil.fields import DateField
 from wtforms_components import DateRange
@@ -22,10 +24,48 @@ from occams.utils.pagination import Pagination
 from occams_datastore import models as datastore
 from occams_forms.renderers import form2json, version2json
 
-from .. import _, models
+from .. import \
+    _, bulk, jobs, models, randomization, schedule, tasks, visit_batches
+from ..caching import VersionedCache, conditional_get
 from . import cycle as cycle_views
 
 
+# Lightweight study record for rendering the menu
+StudyMenuItem = namedtuple(
+    'StudyMenuItem', ['id', 'name', 'title', 'short_title'])
+
+study_menu_cache = VersionedCache('study_menu')
+
+# Randomization lists over 1MB (roughly 10,000 rows) load in the background
+RANDOMIZATION_ASYNC_SIZE = 1024 * 1024
+
+# Outstanding visits listed per page
+VISIT_SCHEDULE_PER_PAGE = 25
+
+# Visit batches over this many records are created in the background
+VISITS_ASYNC_COUNT = 200
+
+
+def get_study_menu(request):
+    """
+    Returns the (cached) listing of studies used to render the menu
+    """
+    db_session = request.db_session
+
+    def creator():
+        query = (
+            db_session.query(
+                models.Study.id,
+                models.Study.name,
+                models.Study.title,
+                models.Study.short_title)
+            .order_by(models.Study.title))
+        return [list(row) for row in query]
+
+    rows = study_menu_cache.get(request.redis, creator)
+    return [StudyMenuItem(*row) for row in rows]
+
+
 @subscriber(BeforeRender)
 def add_studies(event):
     """
@@ -38,11 +78,7 @@ def add_studies(event):
 
     # Some calls to pyramid.renderers.render may not have specified a request
     if request is not None:
-        db_session = request.db_session
-        studies_query = (
-            db_session.query(models.Study)
-            .order_by(models.Study.title))
-        event.rendering_val['available_studies'] = studies_query.all()
+        event.rendering_val['available_studies'] = get_study_menu(request)
 
 
 @view_config(
@@ -64,13 +100,17 @@ def list_(request):
 
     else:
 
+        activity = models.patient_activity_table
+
         modified_query = (
             db_session.query(models.Patient)
-            .filter(models.Patient.site.has(models.Site.id.in_(site_ids)))
-            .order_by(models.Patient.modify_date.desc())
-            .limit(10))
+            .join(activity, activity.c.patient_id == models.Patient.id)
+            .filter(activity.c.site_id.in_(site_ids))
+            .order_by(activity.c.last_modified.desc())
+            .limit(10)
+            .all())
 
-        modified_count = modified_query.count()
+        modified_count = len(modified_query)
 
     viewed = sorted((request.session.get('viewed') or {}).values(),
                     key=lambda v: v['view_date'],
@@ -101,11 +141,39 @@ def view(context, request):
     }
 
 
+def view_sources(context, request):
+    """
+    Returns the records serialized by ``view_json`` (see ``conditional_get``)
+    """
+    study = context
+    study_schema = models.study_schema_table
+    cycle_schema = models.cycle_schema_table
+    cycles = (
+        sa.select([models.Cycle.id])
+        .where(models.Cycle.study_id == study.id))
+    schemata = sa.union(
+        sa.select([study_schema.c.schema_id])
+        .where(study_schema.c.study_id == study.id),
+        sa.select([cycle_schema.c.schema_id])
+        .where(cycle_schema.c.cycle_id.in_(cycles)))
+    return [
+        (models.Study, models.Study.id == study.id),
+        (models.Cycle, models.Cycle.study_id == study.id),
+        (study_schema, study_schema.c.study_id == study.id),
+        (cycle_schema, cycle_schema.c.cycle_id.in_(cycles)),
+        (datastore.Schema,
+            datastore.Schema.id.in_(schemata)
+            | (datastore.Schema.id == study.termination_schema_id)
+            | (datastore.Schema.id == study.randomization_schema_id)),
+    ]
+
+
 @view_config(
     route_name='studies.study',
     permission='view',
     xhr=True,
-    renderer='json')
+    renderer='fastjson',
+    decorator=conditional_get(view_sources))
 def view_json(context, request, deep=True):
     study = context
     data = {
@@ -245,7 +313,7 @@ def visits(context, request):
         * enrollment activity
         * randomization stats
     """
-    db_session = request.db_session
+    db_session = request.read_db_session
     today = date.today()
     this_month_begin = date(today.year, today.month, 1)
     last_month_end = this_month_begin - timedelta(days=1)
@@ -294,39 +362,53 @@ def visits(context, request):
         .group_by(models.Cycle.name, models.Cycle.title, models.Cycle.week)
         .order_by(models.Cycle.week.asc()))
 
-    cycles_count = context.cycles.count()
+    def count_enrollments(condition=None):
+        expr = sa.func.count(models.Enrollment.id)
+        if condition is not None:
+            expr = expr.filter(condition)
+        return expr
 
-    return {
-        'arms': arms_query,
-        'start_this_month': (
-            context.enrollments
-            .filter(models.Enrollment.consent_date >= this_month_begin)
-            .count()),
-        'start_last_month': (
-            context.enrollments
-            .filter(
+    # Compute all enrollment statistics in a single pass
+    stats = (
+        db_session.query(
+            count_enrollments(
+                models.Enrollment.consent_date >= this_month_begin)
+            .label('start_this_month'),
+            count_enrollments(
                 (models.Enrollment.consent_date >= last_month_begin)
                 & (models.Enrollment.consent_date < this_month_begin))
-            .count()),
-        'end_this_month': (
-            context.enrollments
-            .filter(models.Enrollment.termination_date >= this_month_begin)
-            .count()),
-        'end_last_month': (
-            context.enrollments
-            .filter(
+            .label('start_last_month'),
+            count_enrollments(
+                models.Enrollment.termination_date >= this_month_begin)
+            .label('end_this_month'),
+            count_enrollments(
                 (models.Enrollment.termination_date >= last_month_begin)
                 & (models.Enrollment.termination_date < this_month_begin))
-            .count()),
-        'active': (
-            context.enrollments
-            .filter_by(termination_date=sa.null())
-            .count()),
-        'all_time': context.enrollments.count(),
+            .label('end_last_month'),
+            count_enrollments(
+                models.Enrollment.termination_date == sa.null())
+            .label('active'),
+            count_enrollments().label('all_time'),
+            db_session.query(sa.func.count(models.Cycle.id))
+            .filter(models.Cycle.study_id == context.id)
+            .as_scalar()
+            .label('cycles_count'))
+        .select_from(models.Enrollment)
+        .filter(models.Enrollment.study_id == context.id)
+        .one())
+
+    return {
+        'arms': arms_query,
+        'start_this_month': stats.start_this_month,
+        'start_last_month': stats.start_last_month,
+        'end_this_month': stats.end_this_month,
+        'end_last_month': stats.end_last_month,
+        'active': stats.active,
+        'all_time': stats.all_time,
         'states': states,
         'cycles': cycles_query,
-        'cycles_count': cycles_count,
-        'has_cycles': cycles_count > 0}
+        'cycles_count': stats.cycles_count,
+        'has_cycles': stats.cycles_count > 0}
 
 
 @view_config(
@@ -338,7 +420,7 @@ def visits_cycle(context, request):
     This view displays summary statistics about visits that are related to
     this cycle, as well as a listing of those visits for reference.
     """
-    db_session = request.db_session
+    db_session = request.read_db_session
 
     cycle = (
         db_session.query(models.Cycle)
@@ -350,31 +432,45 @@ def visits_cycle(context, request):
 
     states = db_session.query(datastore.State).order_by('id').all()
 
+    visit_count = (
+        db_session.query(sa.func.count())
+        .select_from(models.visit_cycle_table)
+        .filter(models.visit_cycle_table.c.cycle_id == cycle.id)
+        .scalar())
+
     data = {
         'states': states,
-        'visit_count': cycle.visits.count(),
-        'data_summary': {},
-        'visits_summary': {}
+        'visit_count': visit_count,
+        'data_summary': dict((state.name, 0) for state in states),
+        'visits_summary': dict((state.name, 0) for state in states)
         }
 
     by_state = (request.GET.get('by_state') or '').strip()
     by_state = next(
         (state for state in states if state.name == by_state), None)
 
-    for state in states:
-        data['visits_summary'][state.name] = (
-            cycle.visits.filter(models.Visit.entities.any(state=state))
-            .count())
-        data['data_summary'][state.name] = (
-            db_session.query(datastore.Entity)
-            .join(datastore.Entity.contexts)
-            .join(
-                models.Visit,
-                (datastore.Context.external == 'visit')
-                & (models.Visit.id == datastore.Context.key))
-            .filter(models.Visit.cycles.any(id=cycle.id))
-            .filter(datastore.Entity.state == state)
-            .count())
+    # Summarize both visits and forms by state in a single pass
+    summary_query = (
+        db_session.query(
+            datastore.State.name,
+            sa.func.count(models.Visit.id.distinct()).label('visits_count'),
+            sa.func.count(datastore.Entity.id).label('entities_count'))
+        .select_from(models.Visit)
+        .join(
+            models.visit_cycle_table,
+            (models.visit_cycle_table.c.visit_id == models.Visit.id)
+            & (models.visit_cycle_table.c.cycle_id == cycle.id))
+        .join(
+            datastore.Context,
+            (datastore.Context.external == sa.sql.literal_column(u"'visit'"))
+            & (datastore.Context.key == models.Visit.id))
+        .join(datastore.Context.entity)
+        .join(datastore.Entity.state)
+        .group_by(datastore.State.name))
+
+    for state_name, visits_count, entities_count in summary_query:
+        data['visits_summary'][state_name] = visits_count
+        data['data_summary'][state_name] = entities_count
 
     def count_state_exp(name):
         return sa.func.count(
@@ -386,6 +482,13 @@ def visits_cycle(context, request):
                 for site in db_session.query(models.Site)
                 if request.has_permission('view', site)]
 
+    try:
+        page = max(int((request.GET.get('page') or '').strip()), 1)
+    except ValueError:
+        page = 1
+
+    per_page = 25
+
     if site_ids:
         visits_query = (
             db_session.query(
@@ -414,27 +517,34 @@ def visits_cycle(context, request):
             visits_query = visits_query.having(
                 count_state_exp(by_state.name) > 0)
 
-        total_visits = visits_query.count()
+        # The total is computed along with the page itself, by counting
+        # the grouped rows with a window function
+        def fetch_page(offset):
+            return (
+                visits_query
+                .add_column(sa.func.count().over().label('total_visits'))
+                .offset(offset)
+                .limit(per_page)
+                .all())
+
+        visits = fetch_page((page - 1) * per_page)
+
+        if visits:
+            total_visits = visits[0].total_visits
+        elif page > 1:
+            # Out of range, we need the total to find the last page
+            total_visits = visits_query.count()
+        else:
+            total_visits = 0
 
     else:
-
+        visits = []
         total_visits = 0
 
-    try:
-        page = int((request.GET.get('page') or '').strip())
-    except ValueError:
-        page = 1
-
-    pagination = Pagination(page, 25, total_visits)
+    pagination = Pagination(page, per_page, total_visits)
 
-    if site_ids:
-        visits = (
-            visits_query
-            .offset(pagination.offset)
-            .limit(pagination.per_page)
-            .all())
-    else:
-        visits = []
+    if site_ids and pagination.offset != (page - 1) * per_page:
+        visits = fetch_page(pagination.offset)
 
     def make_page_url(page):
         return request.current_route_path(_query={
@@ -455,18 +565,81 @@ def visits_cycle(context, request):
     return data
 
 
+@view_config(
+    route_name='studies.study_visit_schedule',
+    permission='view',
+    xhr=True,
+    renderer='fastjson')
+def visit_schedule_json(context, request):
+    """
+    Lists the study's visits that are due, overdue or missed
+
+    Only patients of sites the user has access to are included.
+
+    Expects the following GET parameters:
+        status -- (optional) only list visits of this status
+        page -- (optional) the page of the listing to fetch (default: 1)
+    """
+    db_session = request.read_db_session
+    table = models.visit_schedule_table
+
+    site_ids = [site.id
+                for site in db_session.query(models.Site)
+                if request.has_permission('view', site)]
+
+    return visit_schedule_page(
+        request,
+        db_session,
+        (table.c.study_id == context.id) & table.c.site_id.in_(site_ids))
+
+
+def visit_schedule_page(request, db_session, criterion):
+    """
+    Returns a page of the outstanding visits matching ``criterion``
+    """
+    status = request.GET.get('status') or None
+
+    if status is not None and status not in schedule.statuses():
+        raise HTTPBadRequest(u'Invalid visit status')
+
+    query = (
+        schedule.query_schedule(db_session, status=status)
+        .filter(criterion))
+
+    pagination = Pagination(
+        request.GET.get('page', 1), VISIT_SCHEDULE_PER_PAGE, query.count())
+
+    query = query.offset(pagination.offset).limit(pagination.per_page)
+
+    return {
+        '__query__': {'status': status},
+        'pager': pagination.serialize(),
+        'visits': [{
+            '__url__': request.route_path('studies.patient', patient=row.pid),
+            'pid': row.pid,
+            'study': row.study,
+            'cycle': row.cycle,
+            'cycle_title': row.cycle_title,
+            'expected_date': row.expected_date.isoformat(),
+            'window_start': row.window_start.isoformat(),
+            'window_end': row.window_end and row.window_end.isoformat(),
+            'status': row.status,
+            } for row in query]
+    }
+
+
 @view_config(
     route_name='studies.index',
     permission='add',
     request_method='POST',
     xhr=True,
-    renderer='json')
+    renderer='fastjson')
 @view_config(
     route_name='studies.study',
     permission='edit',
     request_method='PUT',
     xhr=True,
-    renderer='json')
+    renderer='fastjson')
 def edit_json(context, request):
     check_csrf_token(request)
     db_session = request.db_session
@@ -496,6 +669,8 @@ def edit_json(context, request):
 
     db_session.flush()
 
+    study_menu_cache.invalidate_after_commit(request.redis)
+
     return view_json(study, request)
 
 
@@ -504,13 +679,13 @@ def edit_json(context, request):
     permission='edit',
     xhr=True,
     request_param='vocabulary=available_schemata',
-    renderer='json')
+    renderer='fastjson')
 @view_config(
     route_name='studies.study',
     permission='edit',
     xhr=True,
     request_param='vocabulary=available_schemata',
-    renderer='json')
+    renderer='fastjson')
 def available_schemata(context, request):
     """
     Returns a listing of available schemata for the study
@@ -592,7 +767,7 @@ def available_schemata(context, request):
     permission='delete',
     request_method='DELETE',
     xhr=True,
-    renderer='json')
+    renderer='fastjson')
 def delete_json(context, request):
     check_csrf_token(request)
 
@@ -610,6 +785,8 @@ def delete_json(context, request):
     db_session.delete(context)
     db_session.flush()
 
+    study_menu_cache.invalidate_after_commit(request.redis)
+
     msg = _(u'Successfully deleted ${study}',
             mapping={'study': context.title})
     request.session.flash(msg, 'success')
@@ -622,7 +799,7 @@ def delete_json(context, request):
     permission='edit',
     request_method='POST',
     xhr=True,
-    renderer='json')
+    renderer='fastjson')
 def add_schema_json(context, request):
     check_csrf_token(request)
     db_session = request.db_session
@@ -717,7 +894,7 @@ def add_schema_json(context, request):
     permission='edit',
     request_method='DELETE',
     xhr=True,
-    renderer='json')
+    renderer='fastjson')
 def delete_schema_json(context, request):
     check_csrf_token(request)
     db_session = request.db_session
@@ -770,7 +947,7 @@ def delete_schema_json(context, request):
     permission='edit',
     request_method='PUT',
     xhr=True,
-    renderer='json')
+    renderer='fastjson')
 def edit_schedule_json(context, request):
     """
     Enables/Disables a form for a cycle
@@ -840,7 +1017,7 @@ def edit_schedule_json(context, request):
     permission='edit',
     request_method='POST',
     request_param='upload',
-    renderer='json')
+    renderer='fastjson')
 def upload_randomization_json(context, request):
     """
     Handles RANDID file uploads.
@@ -851,6 +1028,10 @@ def upload_randomization_json(context, request):
         * RANDID
     In addition, the CSV file must have the columns as the form
     it is using for randomization.
+
+    Files larger than ``studies.randomization.async_size`` bytes are loaded
+    in the background, in which case the response contains the URL
+    to poll for the upload's progress.
     """
 
     check_csrf_token(request)
@@ -861,76 +1042,242 @@ def upload_randomization_json(context, request):
         raise HTTPBadRequest(body=_(u'This study is not randomized'))
 
     input_file = request.POST['upload'].file
-    input_file.seek(0)
 
-    # Ensure we can read the CSV
     try:
-        csv.Sniffer().sniff(input_file.read(1024))
-    except csv.Error:
-        raise HTTPBadRequest(body=_(u'Invalid file-type, must be CSV'))
-    else:
-        input_file.seek(0)
-
-    reader = csv.DictReader(input_file)
-
-    # Case-insensitive lookup
-    fieldnames = dict((name.upper(), name) for name in reader.fieldnames)
-    stratumkeys = ['ARM', 'BLOCKID', 'RANDID']
-    formkeys = context.randomization_schema.attributes.keys()
-
-    # Ensure the CSV defines all required columns
-    required = stratumkeys + formkeys
-    missing = [name for name in required if name.upper() not in fieldnames]
-    if missing:
-        raise HTTPBadRequest(body=_(
-            u'File upload is missing the following columns ${columns}',
-            mapping={'columns': ', '.join(missing)}))
-
-    # We'll be using this to create new arms as needed
-    arms = dict([(arm.name, arm) for arm in context.arms])
-
-    # Default to comple state since they're generated by a statistician
-    complete = (
-        db_session.query(datastore.State)
-        .filter_by(name=u'complete')
-        .one())
-
-    for row in reader:
-        arm_name = row[fieldnames['ARM']]
-        if arm_name not in arms:
-            arms[arm_name] = models.Arm(
-                study=context, name=arm_name, title=arm_name)
+        upload = randomization.RandomizationList(context, input_file)
+    except randomization.UploadError as e:
+        raise HTTPBadRequest(body=e.message)
 
-        stratum = models.Stratum(
-            study=context,
-            arm=arms[arm_name],
-            block_number=int(row[fieldnames['BLOCKID']]),
-            randid=row[fieldnames['RANDID']])
+    settings = request.registry.settings
+    async_size = int(settings.get(
+        'studies.randomization.async_size', RANDOMIZATION_ASYNC_SIZE))
 
-        if 'STRATA' in fieldnames:
-            stratum.label = row[fieldnames['STRATA']]
+    input_file.seek(0, os.SEEK_END)
+    if input_file.tell() > async_size:
+        return defer_randomization_upload(context, request, input_file)
 
-        db_session.add(stratum)
+    total, errors = upload.validate(db_session)
 
-        entity = datastore.Entity(
-            schema=context.randomization_schema, state=complete)
-
-        for key in formkeys:
-            entity[key] = row[fieldnames[key.upper()]]
-
-        stratum.entities.add(entity)
+    if errors:
+        raise HTTPBadRequest(json={
+            'errors': bulk.errors2json(
+                errors, request.localizer.translate)})
 
     try:
-        db_session.flush()
+        upload.load(db_session)
     except sa.exc.IntegrityError as e:
-        if 'uq_stratum_reference_number' in e.message:
+        # Another upload got to the same reference numbers first
+        if 'uq_stratum_reference_number' in str(e):
             raise HTTPBadRequest(body=_(
                 u'The submitted file contains existing reference numbers. '
                 u'Please upload a file with new reference numbers.'))
+        raise
 
     return HTTPOk()
 
 
+def defer_randomization_upload(context, request, input_file):
+    """
+    Schedules a background task to load the randomization list
+    """
+    settings = request.registry.settings
+    upload_id = six.text_type(str(uuid.uuid4()))
+
+    # The export directory is already shared with the celery workers
+    path = os.path.join(
+        settings['studies.export.dir'],
+        'randomization-{0}.csv'.format(upload_id))
+
+    input_file.seek(0)
+    with open(path, 'wb') as fp:
+        shutil.copyfileobj(input_file, fp)
+
+    jobs.JobStatus(request.redis, 'randomization', upload_id).start(context.id)
+
+    userid = request.authenticated_userid
+
+    def apply_after_commit(success):
+        if success:
+            tasks.load_randomization.apply_async(
+                args=[upload_id, context.id, path, userid],
+                task_id=upload_id)
+        else:
+            os.remove(path)
+
+    # Avoid race-condition by executing the task after succesful commit
+    transaction.get().addAfterCommitHook(apply_after_commit)
+
+    request.response.status_code = 202
+    return {
+        'upload_id': upload_id,
+        '__status_url__': request.route_path(
+            'studies.study_randomization_upload',
+            study=context.name,
+            upload=upload_id),
+    }
+
+
+@view_config(
+    route_name='studies.study_randomization_upload',
+    permission='edit',
+    xhr=True,
+    renderer='fastjson')
+def randomization_upload_status_json(context, request):
+    """
+    Returns the progress of a background randomization list upload
+    """
+    status = jobs.JobStatus(
+        request.redis, 'randomization', request.matchdict['upload'])
+    data = status.to_json(context.id)
+
+    if data is None:
+        raise HTTPNotFound()
+
+    return data
+
+
+@view_config(
+    route_name='studies.study_strata',
+    permission='edit',
+    xhr=True,
+    renderer='fastjson')
+def strata_json(context, request):
+    """
+    Returns the number of unassigned strata left for each set of
+    randomization criteria
+    """
+    db_session = request.db_session
+
+    if not context.is_randomized:
+        raise HTTPNotFound()
+
+    return {
+        'strata': [{
+            'criteria': criteria,
+            'remaining': remaining
+        } for criteria, remaining in randomization.remaining_strata(
+            db_session, context)]
+    }
+
+
+@view_config(
+    route_name='studies.study_visits',
+    permission='view',
+    request_method='POST',
+    xhr=True,
+    renderer='fastjson')
+def add_visits_json(context, request):
+    """
+    Schedules visits for many patients at once
+
+    The JSON body contains:
+    visits -- list of records with a pid, visit_date and cycles (names)
+    include_forms -- whether to add the cycles' forms to the new visits
+
+    Records are validated individually, so valid records are scheduled
+    even if others are not. The response contains a result for each
+    record, unless the batch is larger than ``studies.visits.async_count``
+    records, in which case the visits are created in the background and
+    the response contains the URL to poll for the batch's progress.
+    """
+    check_csrf_token(request)
+    db_session = request.db_session
+
+    records = request.json_body.get('visits')
+
+    if not records or not isinstance(records, list):
+        raise HTTPBadRequest(json={
+            'errors': {'visits': request.localizer.translate(
+                _(u'At least one visit is required'))}})
+
+    include_forms = bool(request.json_body.get('include_forms'))
+
+    allowed_sites = {}
+
+    def is_allowed(patient):
+        if patient.site_id not in allowed_sites:
+            allowed_sites[patient.site_id] = bool(request.has_permission(
+                'add', models.VisitFactory(request, patient)))
+        return allowed_sites[patient.site_id]
+
+    batch = visit_batches.VisitBatch(context, records)
+    checked = batch.validate(db_session, is_allowed=is_allowed)
+
+    settings = request.registry.settings
+    async_count = int(settings.get(
+        'studies.visits.async_count', VISITS_ASYNC_COUNT))
+
+    valid = [record
+             for record, (item, problems) in zip(records, checked)
+             if not problems]
+
+    if len(valid) > async_count:
+        return defer_visit_batch(
+            context, request, batch, checked, valid, include_forms)
+
+    results = batch.create(db_session, checked, include_forms=include_forms)
+
+    return {
+        'results': visit_batches.results2json(
+            results, request.localizer.translate)
+    }
+
+
+def defer_visit_batch(context, request, batch, checked, valid, include_forms):
+    """
+    Schedules a background task to create the valid records of a batch
+
+    Rejected records are reported immediately, the rest are pending until
+    the task (which validates them again in case they were taken in the
+    meantime) completes.
+    """
+    batch_id = six.text_type(str(uuid.uuid4()))
+
+    jobs.JobStatus(request.redis, 'visits', batch_id).start(
+        context.id, total=len(valid))
+
+    userid = request.authenticated_userid
+
+    def apply_after_commit(success):
+        if success:
+            tasks.schedule_visits.apply_async(
+                args=[batch_id, context.id, valid, include_forms, userid],
+                task_id=batch_id)
+
+    # Avoid race-condition by executing the task after succesful commit
+    transaction.get().addAfterCommitHook(apply_after_commit)
+
+    request.response.status_code = 202
+    return {
+        'batch_id': batch_id,
+        'results': visit_batches.results2json(
+            batch.results(checked), request.localizer.translate),
+        '__status_url__': request.route_path(
+            'studies.study_visit_batch',
+            study=context.name,
+            batch=batch_id),
+    }
+
+
+@view_config(
+    route_name='studies.study_visit_batch',
+    permission='view',
+    xhr=True,
+    renderer='fastjson')
+def visit_batch_status_json(context, request):
+    """
+    Returns the progress of a background visit batch
+    """
+    status = jobs.JobStatus(
+        request.redis, 'visits', request.matchdict['batch'])
+    data = status.to_json(context.id)
+
+    if data is None:
+        raise HTTPNotFound()
+
+    return data
+
+
 def StudySchema(context, request):
     """
     Returns a validator for incoming study modification data
@@ -14,15 +14,47 @@ from occams_datastore import models as datastore
 from occams_forms.renderers import \
     make_form, render_form, apply_data, entity_data, modes
 
-from .. import _, models
+from .. import _, bulk, capabilities, models
+from ..caching import conditional_get
 from . import form as form_views
 
 
+def list_sources(context, request):
+    """
+    Returns the records serialized by ``list_json`` (see ``conditional_get``)
+    """
+    patient = context.__parent__
+    visits = (
+        sa.select([models.Visit.id])
+        .where(models.Visit.patient_id == patient.id))
+    cycles = (
+        sa.select([models.visit_cycle_table.c.cycle_id])
+        .where(models.visit_cycle_table.c.visit_id.in_(visits)))
+    studies = (
+        sa.select([models.Cycle.study_id])
+        .where(models.Cycle.id.in_(cycles)))
+    entities = (
+        sa.select([datastore.Context.entity_id])
+        .where(datastore.Context.external == u'visit')
+        .where(datastore.Context.key.in_(visits)))
+    return [
+        (models.Patient, models.Patient.id == patient.id),
+        (models.Site, models.Site.id == patient.site_id),
+        (models.Visit, models.Visit.patient_id == patient.id),
+        (models.visit_cycle_table,
+            models.visit_cycle_table.c.visit_id.in_(visits)),
+        (models.Cycle, models.Cycle.id.in_(cycles)),
+        (models.Study, models.Study.id.in_(studies)),
+        (datastore.Entity, datastore.Entity.id.in_(entities)),
+    ]
+
+
 @view_config(
     route_name='studies.visits',
     permission='view',
     xhr=True,
-    renderer='json')
+    renderer='fastjson',
+    decorator=conditional_get(list_sources))
 def list_json(context, request):
     db_session = request.db_session
     patient = context.__parent__
@@ -48,7 +80,7 @@ def view(context, request):
     db_session = request.db_session
     return {
         'visit': view_json(context, request),
-        'is_lab_enabled': db_session.bind.has_table('specimen')
+        'is_lab_enabled': capabilities.get(db_session).lab
         }
 
 
@@ -56,7 +88,7 @@ def view(context, request):
     route_name='studies.visit',
     permission='view',
     xhr=True,
-    renderer='json')
+    renderer='fastjson')
 def view_json(context, request):
     visit = context
     return {
@@ -93,7 +125,7 @@ def view_json(context, request):
     route_name='studies.visits_cycles',
     permission='view',
     xhr=True,
-    renderer='json')
+    renderer='fastjson')
 def cycles_json(context, request):
     """
     AJAX handler for cycle field options
@@ -133,14 +165,14 @@ def cycles_json(context, request):
     request_method='GET',
     request_param='cycles',
     xhr=True,
-    renderer='json')
+    renderer='fastjson')
 @view_config(
     route_name='studies.visit',
     permission='view',
     request_method='GET',
     request_param='cycles',
     xhr=True,
-    renderer='json')
+    renderer='fastjson')
 def validate_cycles(context, request):
     """
     jQuery Validation callback
@@ -165,13 +197,13 @@ def validate_cycles(context, request):
     permission='add',
     request_method='POST',
     xhr=True,
-    renderer='json')
+    renderer='fastjson')
 @view_config(
     route_name='studies.visit',
     permission='edit',
     request_method='PUT',
     xhr=True,
-    renderer='json')
+    renderer='fastjson')
 def edit_json(context, request):
     check_csrf_token(request)
     db_session = request.db_session
@@ -229,27 +261,38 @@ def edit_json(context, request):
         )
 
         schemata_query = (
-            db_session.query(datastore.Schema)
+            db_session.query(datastore.Schema.id)
             .join(relative_schema, relative_schema.c.id == datastore.Schema.id)
             .filter(relative_schema.c.row_number == 1)
         )
 
         # Ignore already-added schemata
-        if isinstance(context, models.Visit) and visit.entities:
+        if not is_new:
+            added_names = (
+                db_session.query(datastore.Schema.name)
+                .select_from(datastore.Entity)
+                .join(datastore.Entity.schema)
+                .join(datastore.Entity.contexts)
+                .filter(datastore.Context.external == visit.__tablename__)
+                .filter(datastore.Context.key == visit.id))
             schemata_query = schemata_query.filter(
-                ~datastore.Schema.name.in_(
-                    [entity.schema.name for entity in visit.entities]))
+                ~datastore.Schema.name.in_(added_names.subquery()))
+
+        schema_ids = [schema_id for (schema_id,) in schemata_query]
 
-        for schema in schemata_query:
-            entity = datastore.Entity(
-                schema=schema,
-                collect_date=visit.visit_date,
-                state=default_state)
-            visit.patient.entities.add(entity)
-            visit.entities.add(entity)
+        # Forms belong to both the visit and the patient
+        bulk.insert_entities(
+            db_session,
+            [{'schema_id': schema_id,
+              'state_id': default_state.id,
+              'collect_date': visit.visit_date}
+             for schema_id in schema_ids],
+            [[(visit.__tablename__, visit.id),
+              (visit.patient.__tablename__, visit.patient.id)]
+             for schema_id in schema_ids])
 
     # Lab might not be enabled on a environments, check first
-    if form.include_specimen.data and db_session.bind.has_table('specimen'):
+    if form.include_specimen.data and capabilities.get(db_session).lab:
         from occams_lims import models as lab
         drawstate = (
             db_session.query(lab.SpecimenState)
@@ -277,7 +320,7 @@ def edit_json(context, request):
     route_name='studies.visit',
     permission='delete',
     request_method='DELETE',
-    renderer='json')
+    renderer='fastjson')
 def delete_json(context, request):
     check_csrf_token(request)
     db_session = request.db_session
@@ -0,0 +1,330 @@
+"""
+Bulk visit scheduling
+
+Coordinators often schedule the same visit (e.g. week 12) for every
+patient of a study at once. Batches are validated with a fixed number of
+set-based queries (instead of the per-visit queries of the visit form),
+and the visits, their cycles and their forms are created with multi-row
+INSERT statements.
+"""
+
+from datetime import date, datetime
+
+import six
+import sqlalchemy as sa
+
+from occams_datastore import models as datastore
+
+from . import _, models
+from .bulk import \
+    audit_values, chunked, insert_entities, insert_many, reserve_ids
+
+
+#: Number of records looked up/created at a time
+CHUNK_SIZE = 500
+
+#: Earliest acceptable visit date (same as the visit form)
+MIN_VISIT_DATE = date(1900, 1, 1)
+
+
+class VisitBatch(object):
+    """
+    A batch of visits to schedule for the patients of a study
+
+    Each record is a dictionary with:
+    pid -- the patient's PID
+    visit_date -- the ISO-formatted visit date
+    cycles -- names of the study's cycles the visit is for
+    """
+
+    def __init__(self, study, records):
+        self.study = study
+        self.records = records
+
+    def _parse(self, record):
+        problems = []
+
+        if not isinstance(record, dict):
+            return None, [_(u'Invalid record')]
+
+        pid = record.get('pid')
+        if not pid or not isinstance(pid, six.string_types):
+            problems.append(_(u'Missing PID'))
+
+        try:
+            visit_date = datetime.strptime(
+                record.get('visit_date') or '', '%Y-%m-%d').date()
+        except (TypeError, ValueError):
+            visit_date = None
+            problems.append(_(u'Invalid visit date'))
+        else:
+            if visit_date < MIN_VISIT_DATE:
+                problems.append(_(u'Invalid visit date'))
+
+        cycles = record.get('cycles')
+        if not cycles or not isinstance(cycles, list):
+            cycles = []
+            problems.append(_(u'At least one cycle is required'))
+
+        return {'pid': pid, 'visit_date': visit_date, 'cycles': cycles}, \
+            problems
+
+    def validate(self, db_session, is_allowed=None):
+        """
+        Checks every record using a fixed number of queries
+
+        Arguments:
+        db_session -- the current database session
+        is_allowed -- (optional) called with a patient, returns whether
+                      visits may be added for the patient
+
+        Returns for each record a tuple of (values, problems) where
+        ``values`` contains the record's patient, visit date and cycles.
+        """
+        checked = [self._parse(record) for record in self.records]
+
+        pids = set(item['pid'] for item, problems in checked
+                   if item and item['pid'])
+        patients = {}
+        for chunk in chunked(pids, CHUNK_SIZE):
+            query = (
+                db_session.query(models.Patient)
+                .filter(models.Patient.pid.in_(chunk)))
+            patients.update((p.pid, p) for p in query)
+
+        cycles = dict((cycle.name, cycle) for cycle in self.study.cycles)
+
+        # Resolve the records' patients and cycles
+        for item, problems in checked:
+            if item is None:
+                continue
+
+            patient = patients.get(item['pid'])
+            if item['pid'] and patient is None:
+                problems.append(_(
+                    u'Patient ${pid} does not exist',
+                    mapping={'pid': item['pid']}))
+            elif patient is not None and \
+                    is_allowed is not None and not is_allowed(patient):
+                problems.append(_(
+                    u'You are not allowed to add visits for ${pid}',
+                    mapping={'pid': item['pid']}))
+            item['patient'] = patient
+
+            item['cycles'] = resolved = []
+            for name in item['cycles']:
+                cycle = cycles.get(name)
+                if cycle is None:
+                    problems.append(_(
+                        u'"${cycle}" is not a cycle of this study',
+                        mapping={'cycle': name}))
+                else:
+                    resolved.append(cycle)
+
+        candidates = [item for item, problems in checked if not problems]
+
+        taken_dates = set()
+        taken_cycles = {}
+
+        for chunk in chunked(candidates, CHUNK_SIZE):
+            query = (
+                db_session.query(
+                    models.Visit.patient_id, models.Visit.visit_date)
+                .filter(sa.tuple_(
+                    models.Visit.patient_id,
+                    models.Visit.visit_date).in_([
+                        (item['patient'].id, item['visit_date'])
+                        for item in chunk])))
+            taken_dates.update(query)
+
+            cycle_ids = set(
+                cycle.id
+                for item in chunk
+                for cycle in item['cycles']
+                if not cycle.is_interim)
+
+            # Interim cycles may be reused, so there's nothing to look up
+            if not cycle_ids:
+                continue
+
+            query = (
+                db_session.query(
+                    models.Visit.patient_id,
+                    models.visit_cycle_table.c.cycle_id,
+                    models.Visit.visit_date)
+                .join(models.visit_cycle_table)
+                .filter(models.Visit.patient_id.in_(
+                    set(item['patient'].id for item in chunk)))
+                .filter(models.visit_cycle_table.c.cycle_id.in_(cycle_ids)))
+            taken_cycles.update(
+                ((patient_id, cycle_id), visit_date)
+                for patient_id, cycle_id, visit_date in query)
+
+        # Records may also conflict with earlier records of the batch
+        for item, problems in checked:
+            if problems:
+                continue
+
+            patient_id = item['patient'].id
+
+            if (patient_id, item['visit_date']) in taken_dates:
+                problems.append(_(u'Visit already exists'))
+
+            for cycle in item['cycles']:
+                if cycle.is_interim:
+                    continue
+                other = taken_cycles.get((patient_id, cycle.id))
+                if other is not None:
+                    problems.append(_(
+                        u'"${cycle}" already in use by visit on ${visit}',
+                        mapping={'cycle': cycle.title, 'visit': other}))
+
+            if not problems:
+                taken_dates.add((patient_id, item['visit_date']))
+                for cycle in item['cycles']:
+                    if not cycle.is_interim:
+                        taken_cycles[patient_id, cycle.id] = \
+                            item['visit_date']
+
+        return checked
+
+    def create(self, db_session, checked, include_forms=False,
+               progress=None, user=None):
+        """
+        Creates the visits for the records that passed validation
+
+        Arguments:
+        db_session -- the current database session
+        checked -- the result of ``validate``
+        include_forms -- whether to add the cycles' forms to the visits
+        progress -- (optional) called with the number of visits created
+        user -- (optional) the user to blame for the new records
+
+        Returns for each record a result dictionary
+        """
+        audit = audit_values(db_session, user)
+        visit_table = models.Visit.__table__
+        valid = [item for item, problems in checked if not problems]
+        visit_ids = {}
+        now = datetime.now()
+        count = 0
+
+        for chunk in chunked(valid, CHUNK_SIZE):
+            ids = reserve_ids(db_session, visit_table, len(chunk))
+
+            insert_many(db_session, visit_table, [
+                dict(
+                    audit,
+                    id=visit_id,
+                    patient_id=item['patient'].id,
+                    visit_date=item['visit_date'])
+                for item, visit_id in zip(chunk, ids)])
+
+            insert_many(db_session, models.visit_cycle_table, [
+                {'visit_id': visit_id, 'cycle_id': cycle.id}
+                for item, visit_id in zip(chunk, ids)
+                for cycle in set(item['cycles'])])
+
+            if include_forms:
+                self._add_forms(db_session, ids, audit)
+
+            for item, visit_id in zip(chunk, ids):
+                visit_ids[id(item)] = visit_id
+                item['patient'].modify_date = now
+
+            count += len(chunk)
+
+            if progress is not None:
+                progress(count)
+
+        db_session.flush()
+
+        return self.results(checked, visit_ids)
+
+    def results(self, checked, visit_ids=None):
+        """
+        Returns a result dictionary for each record
+
+        Records without problems that were not created (yet) are pending.
+        """
+        visit_ids = visit_ids or {}
+        results = []
+
+        for record, (item, problems) in zip(self.records, checked):
+            result = {
+                'pid': item and item['pid'],
+                'visit_date': record.get('visit_date')
+                if isinstance(record, dict) else None,
+            }
+            if problems:
+                result.update(status='error', errors=problems)
+            elif id(item) in visit_ids:
+                result.update(status='created', id=visit_ids[id(item)])
+            else:
+                result.update(status='pending')
+            results.append(result)
+
+        return results
+
+    def _add_forms(self, db_session, visit_ids, audit):
+        """
+        Adds the closest version of each of the visits' cycle forms
+        """
+        default_state = (
+            db_session.query(datastore.State)
+            .filter_by(name=u'pending-entry')
+            .one())
+
+        visit_date = models.Visit.visit_date
+        publish_date = datastore.Schema.publish_date
+
+        relative_schema = (
+            db_session.query(
+                models.Visit.id.label('visit_id'),
+                models.Visit.patient_id.label('patient_id'),
+                visit_date.label('visit_date'),
+                datastore.Schema.id.label('schema_id'),
+                sa.func.row_number().over(
+                    partition_by=(models.Visit.id, datastore.Schema.name),
+                    order_by=(
+                        # Rank by versions before the visit date or closest
+                        (publish_date <= visit_date).desc(),
+                        sa.func.abs(publish_date - visit_date).asc()
+                    ),
+                ).label('row_number'))
+            .join(models.Visit.cycles)
+            .join(models.Cycle.schemata)
+            .filter(models.Visit.id.in_(visit_ids))
+            .filter(datastore.Schema.retract_date == sa.null())
+            .subquery())
+
+        query = (
+            db_session.query(relative_schema)
+            .filter(relative_schema.c.row_number == 1))
+
+        forms = query.all()
+
+        # Forms belong to both the visit and the patient
+        insert_entities(
+            db_session,
+            [{'schema_id': form.schema_id,
+              'state_id': default_state.id,
+              'collect_date': form.visit_date}
+             for form in forms],
+            [[(models.Visit.__tablename__, form.visit_id),
+              (models.Patient.__tablename__, form.patient_id)]
+             for form in forms],
+            audit)
+
+
+def results2json(results, translate):
+    """
+    Serializes batch results using ``translate`` for the problems
+    """
+    serialized = []
+    for result in results:
+        result = dict(result)
+        if 'errors' in result:
+            result['errors'] = [translate(e) for e in result['errors']]
+        serialized.append(result)
+    return serialized
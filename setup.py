@@ -91,6 +91,9 @@ setup(
     cmdclass={'develop': _custom_develop},
     entry_points="""\
     [console_scripts]
+    os_assets = occams_studies.scripts.assets:main
     os_export = occams_studies.scripts.export:main
+    os_import_patients = occams_studies.scripts.import_patients:main
+    os_reports = occams_studies.scripts.reports:main
     """,
 )
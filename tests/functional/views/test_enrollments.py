@@ -651,6 +651,7 @@ class TestPermissionsEnrollmentRandomization:
     @pytest.fixture(autouse=True)
     def populate(self, app, db_session, factories):
         import transaction
+        from occams_studies import models as studies, randomization
 
         with transaction.manager:
             db_session.info['blame'] = factories.UserFactory.create(key=USERID)
@@ -668,6 +669,16 @@ class TestPermissionsEnrollmentRandomization:
                     schema=study.randomization_schema)
             )
 
+            # Uploads index the strata they load
+            criteria = randomization.canonical_criteria(
+                study.randomization_schema.attributes, {})
+            db_session.flush()
+            db_session.execute(studies.stratum_allocation_table.insert({
+                'stratum_id': stratum.id,
+                'study_id': study.id,
+                'criteria': criteria,
+                'criteria_hash': randomization.hash_criteria(criteria)}))
+
             factories.EnrollmentFactory.create(
                 patient=factories.PatientFactory.create(),
                 study=study
@@ -86,6 +86,34 @@ class TestPermissionsCheckout:
         app.get(self.url, status=401)
 
 
+class TestPermissionsMetrics:
+
+    url = '/studies/exports/metrics'
+
+    @pytest.fixture(autouse=True)
+    def populate(self, app, db_session):
+        import transaction
+        from occams_datastore import models as datastore
+
+        # Any view-dependent data goes here
+        # Webtests will use a different scope for its transaction
+        with transaction.manager:
+            db_session.add(datastore.User(key=USERID))
+
+    @pytest.mark.parametrize('group', ['administrator'])
+    def test_allowed(self, app, db_session, group):
+        environ = make_environ(userid=USERID, groups=[group])
+        app.get(self.url, extra_environ=environ, status=200)
+
+    @pytest.mark.parametrize('group', ['manager', 'consumer', None])
+    def test_not_allowed(self, app, db_session, group):
+        environ = make_environ(userid=USERID, groups=[group])
+        app.get(self.url, extra_environ=environ, status=403)
+
+    def test_not_authenticated(self, app, db_session):
+        app.get(self.url, status=401)
+
+
 class TestPermissionsStatus:
 
     url = '/studies/exports/status'
@@ -899,3 +899,99 @@ class TestPermissionsPatientFormsEdit:
             datastore.Entity.schema.has(name=u'test_schema')).scalar()
 
         app.post(self.url.format(entity_id), status=401)
+
+
+class TestConditionalGetPatientView:
+
+    url = '/studies/patients/{}'
+
+    @pytest.fixture(autouse=True)
+    def populate(self, app, db_session):
+        import transaction
+        from occams_studies import models as studies
+        from occams_datastore import models as datastore
+        from datetime import date
+
+        # Any view-dependent data goes here
+        # Webtests will use a different scope for its transaction
+        with transaction.manager:
+            user = datastore.User(key=USERID)
+            db_session.info['blame'] = user
+            db_session.add(user)
+            db_session.flush()
+            site = studies.Site(
+                name=u'UCSD',
+                title=u'UCSD',
+                description=u'UCSD Campus',
+                create_date=date.today())
+
+            db_session.add(studies.Patient(
+                initials=u'ian',
+                nurse=u'imanurse@ucsd.edu',
+                site=site,
+                pid=u'123'
+            ))
+
+    def test_not_modified(self, app, db_session):
+        """
+        It should not re-render the patient if it has not changed
+        """
+        environ = make_environ(userid=USERID, groups=['manager'])
+        res = app.get(self.url.format('123'), extra_environ=environ, xhr=True)
+
+        assert res.etag
+        assert res.last_modified
+
+        res = app.get(
+            self.url.format('123'),
+            extra_environ=environ,
+            headers={'If-None-Match': '"{}"'.format(res.etag)},
+            xhr=True,
+            status=304)
+
+        assert not res.body
+
+    def test_modified(self, app, db_session):
+        """
+        It should re-render the patient once it changes
+        """
+        import transaction
+        from occams_studies import models as studies
+
+        environ = make_environ(userid=USERID, groups=['manager'])
+        res = app.get(self.url.format('123'), extra_environ=environ, xhr=True)
+        etag = res.etag
+
+        with transaction.manager:
+            db_session.add(studies.ReferenceType(
+                name=u'medical_record', title=u'Medical Record'))
+            db_session.flush()
+            patient = db_session.query(studies.Patient).filter_by(
+                pid=u'123').one()
+            patient.references.append(studies.PatientReference(
+                reference_type=db_session.query(studies.ReferenceType).one(),
+                reference_number=u'XYZ'))
+
+        res = app.get(
+            self.url.format('123'),
+            extra_environ=environ,
+            headers={'If-None-Match': '"{}"'.format(etag)},
+            xhr=True)
+
+        assert res.etag != etag
+        assert res.json['references'][0]['reference_number'] == u'XYZ'
+
+    def test_per_user(self, app, db_session):
+        """
+        It should not share validators between users of different groups
+        """
+        environ = make_environ(userid=USERID, groups=['manager'])
+        res = app.get(self.url.format('123'), extra_environ=environ, xhr=True)
+
+        environ = make_environ(userid=USERID, groups=['UCSD:member'])
+        app.get(
+            self.url.format('123'),
+            extra_environ=environ,
+            headers={'If-None-Match': '"{}"'.format(res.etag)},
+            xhr=True,
+            status=200)
@@ -40,6 +40,28 @@ class TestWriteData:
         assert sorted(['anumeric', 'astring']) == sorted(rows[0])
         assert sorted([u'420', u'¿Qué pasa?']) == sorted(rows[1])
 
+    def test_stats(self, db_session):
+        """
+        It should return the costs of writing the file
+        """
+        from contextlib import closing
+        import six
+        from sqlalchemy import literal_column, Integer
+        from occams_studies import exports
+
+        query = db_session.query(
+            literal_column(u"'420'", Integer).label(u'anumeric'))
+
+        with closing(six.BytesIO()) as fp:
+            stats = exports.write_data(fp, query)
+            size = len(fp.getvalue())
+
+        assert stats['rows'] == 1
+        assert stats['bytes'] == size
+        assert stats['query_time'] >= 0
+        assert stats['write_time'] >= 0
+        assert stats['memory_growth'] >= 0
+
 
 class TestDumpCodeBook:
 
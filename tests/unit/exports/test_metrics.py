@@ -0,0 +1,95 @@
+STATS = {
+    'query_time': 1.5, 'write_time': 0.5, 'rows': 10, 'bytes': 100,
+    'memory_growth': 2048}
+
+
+class TestRecord:
+
+    def _call_fut(self, *args, **kw):
+        from occams_studies.exports.metrics import record
+        return record(*args, **kw)
+
+    def test_record(self, db_session):
+        """
+        It should record the costs of a data file
+        """
+        from occams_studies import models
+
+        self._call_fut(db_session, u'vitals', STATS, 'cli')
+
+        metric = db_session.execute(
+            models.export_metric_table.select()).fetchone()
+        assert metric.plan_name == u'vitals'
+        assert metric.source == 'cli'
+        assert metric.export_id is None
+        assert metric.queue_wait is None
+        assert metric.rows == 10
+        assert metric.bytes == 100
+        assert metric.memory_growth == 2048
+
+
+class TestRank:
+
+    def _call_fut(self, *args, **kw):
+        from occams_studies.exports.metrics import rank
+        return rank(*args, **kw)
+
+    def test_order(self, db_session):
+        """
+        It should rank plans by total time, most expensive first
+        """
+        from occams_studies.exports.metrics import record
+
+        record(db_session, u'cheap', STATS, 'cli')
+        record(db_session, u'costly', STATS, 'task', queue_wait=4.0)
+        record(db_session, u'costly', STATS, 'cli')
+
+        plans = self._call_fut(db_session)
+
+        assert [p['name'] for p in plans] == [u'costly', u'cheap']
+        assert plans[0]['runs'] == 2
+        assert plans[0]['total_time'] == 4.0
+        assert plans[0]['avg_queue_wait'] == 4.0
+
+    def test_period(self, db_session):
+        """
+        It should only rank plans exported in the period
+        """
+        from datetime import datetime, timedelta
+        from occams_studies import models
+        from occams_studies.exports.metrics import record
+
+        record(db_session, u'vitals', STATS, 'cli')
+        db_session.execute(
+            models.export_metric_table.update().values(
+                create_date=datetime.now() - timedelta(10)))
+
+        assert len(self._call_fut(db_session, days=30)) == 1
+        assert len(self._call_fut(db_session, days=5)) == 0
+
+
+class TestTrend:
+
+    def _call_fut(self, *args, **kw):
+        from occams_studies.exports.metrics import trend
+        return trend(*args, **kw)
+
+    def test_daily(self, db_session):
+        """
+        It should summarize the plan's costs by day
+        """
+        from datetime import datetime, timedelta
+        from occams_studies import models
+        from occams_studies.exports.metrics import record
+
+        record(db_session, u'vitals', STATS, 'cli')
+        db_session.execute(
+            models.export_metric_table.update().values(
+                create_date=datetime.now() - timedelta(1)))
+        record(db_session, u'vitals', STATS, 'cli')
+        record(db_session, u'vitals', STATS, 'cli')
+        record(db_session, u'other', STATS, 'cli')
+
+        days = self._call_fut(db_session, u'vitals')
+
+        assert [d['runs'] for d in days] == [1, 2]
@@ -45,6 +45,9 @@ class TestPrintList:
                 'registry': req.registry,
             }).start()
 
+        # Leave the test data to the session fixture's rollback
+        mock.patch('occams_studies.scripts.export.transaction').start()
+
         self.dir = tempfile.mkdtemp()
 
         def finalize():
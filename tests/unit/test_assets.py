@@ -0,0 +1,29 @@
+class TestLoadManifest:
+
+    def _call_fut(self, *args, **kw):
+        from occams_studies.assets import load_manifest
+        return load_manifest(*args, **kw)
+
+    def test_not_compiled(self, tmpdir):
+        """
+        It should indicate that the bundles have not been compiled
+        """
+        import mock
+
+        path = str(tmpdir.join('manifest.json'))
+
+        with mock.patch('occams_studies.assets.MANIFEST', path):
+            assert self._call_fut() is None
+
+    def test_compiled(self, tmpdir):
+        """
+        It should return the versions of the compiled bundles
+        """
+        import json
+        import mock
+
+        path = tmpdir.join('manifest.json')
+        path.write(json.dumps({'studies-js': 'abc123'}))
+
+        with mock.patch('occams_studies.assets.MANIFEST', str(path)):
+            assert self._call_fut() == {'studies-js': 'abc123'}
@@ -0,0 +1,58 @@
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def registry(request):
+    """
+    Starts each test without any probed capabilities
+    """
+    from occams_studies import capabilities
+    capabilities.refresh()
+    request.addfinalizer(capabilities.refresh)
+
+
+class TestGet:
+
+    def _call_fut(self, *args, **kw):
+        from occams_studies.capabilities import get
+        return get(*args, **kw)
+
+    def test_probe(self, db_session):
+        """
+        It should probe the database for optional subsystems
+        """
+        capabilities = self._call_fut(db_session)
+        assert not capabilities.lab
+
+    def test_cached(self, db_session):
+        """
+        It should only probe a database once
+        """
+        import mock
+
+        self._call_fut(db_session)
+
+        with mock.patch('occams_studies.capabilities.probe') as probe:
+            self._call_fut(db_session)
+            assert not probe.called
+
+
+class TestRefresh:
+
+    def _call_fut(self, *args, **kw):
+        from occams_studies.capabilities import refresh
+        return refresh(*args, **kw)
+
+    def test_refresh(self, db_session):
+        """
+        It should re-probe the database
+        """
+        from occams_studies import capabilities
+
+        assert not capabilities.get(db_session).lab
+
+        db_session.execute('CREATE TABLE specimen (id SERIAL PRIMARY KEY)')
+
+        assert not capabilities.get(db_session).lab
+        assert self._call_fut(db_session).lab
+        assert capabilities.get(db_session).lab
@@ -0,0 +1,334 @@
+class TestPatientFactoryAcl:
+
+    def _make_one(self, *args, **kw):
+        from occams_studies.models import PatientFactory
+        return PatientFactory(*args, **kw)
+
+    def test_only_principal_sites(self, config, req, db_session):
+        """
+        It should only generate site entries for the user's own sites
+        """
+        from occams_studies import models
+
+        db_session.add_all([
+            models.Site(name=u'ucsd', title=u'UCSD'),
+            models.Site(name=u'ucla', title=u'UCLA')])
+        db_session.flush()
+
+        config.testing_securitypolicy(
+            userid='joe', groupids=['ucsd:coordinator', 'member'])
+
+        acl = self._make_one(req).__acl__
+        principals = set(ace[1] for ace in acl)
+
+        assert 'ucsd:coordinator' in principals
+        assert 'ucsd:member' in principals
+        assert not any(p.startswith('ucla:') for p in principals)
+
+    def test_unknown_site(self, config, req, db_session):
+        """
+        It should not grant access to principals of non-existent sites
+        """
+        config.testing_securitypolicy(
+            userid='joe', groupids=['nowhere:coordinator'])
+
+        acl = self._make_one(req).__acl__
+        principals = set(ace[1] for ace in acl)
+
+        assert 'nowhere:coordinator' not in principals
+
+    def test_site_permissions(self, config, req, db_session):
+        """
+        It should keep the same site-level permissions
+        """
+        from pyramid.authorization import ACLAuthorizationPolicy
+        from occams_studies import models
+
+        db_session.add(models.Site(name=u'ucsd', title=u'UCSD'))
+        db_session.flush()
+
+        config.testing_securitypolicy(
+            userid='joe', groupids=['ucsd:reviewer'])
+        factory = self._make_one(req)
+        policy = ACLAuthorizationPolicy()
+        principals = req.effective_principals
+
+        assert policy.permits(factory, principals, 'view')
+        assert not policy.permits(factory, principals, 'add')
+
+
+class TestPatientFactoryTraversal:
+
+    def _make_one(self, *args, **kw):
+        from occams_studies.models import PatientFactory
+        return PatientFactory(*args, **kw)
+
+    def _count_statements(self, db_session, func):
+        import sqlalchemy as sa
+
+        statements = []
+
+        def count(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        engine = db_session.bind
+        sa.event.listen(engine, 'before_cursor_execute', count)
+        try:
+            result = func()
+        finally:
+            sa.event.remove(engine, 'before_cursor_execute', count)
+        return result, statements
+
+    def test_deep_visit_url(self, req, db_session, factories):
+        """
+        It should resolve the patient and visit in a single query
+        """
+        visit = factories.VisitFactory.create()
+        db_session.flush()
+
+        pid = visit.patient.pid
+        visit_date = visit.visit_date.isoformat()
+        req.matchdict = {'patient': pid, 'visit': visit_date}
+
+        def traverse():
+            patient = self._make_one(req)[pid]
+            return patient['visits'][visit_date]
+
+        result, statements = self._count_statements(db_session, traverse)
+
+        assert result is visit
+        assert len(statements) == 1
+
+    def test_memoized(self, req, db_session, factories):
+        """
+        It should not query again for an already-resolved patient
+        """
+        patient = factories.PatientFactory.create()
+        db_session.flush()
+
+        req.matchdict = {'patient': patient.pid}
+        self._make_one(req)[patient.pid]
+
+        result, statements = self._count_statements(
+            db_session, lambda: self._make_one(req)[patient.pid])
+
+        assert result is patient
+        assert len(statements) == 0
+
+    def test_missing_visit(self, req, db_session, factories):
+        """
+        It should still raise KeyError for a visit that does not exist
+        """
+        import pytest
+
+        patient = factories.PatientFactory.create()
+        db_session.flush()
+
+        req.matchdict = {'patient': patient.pid, 'visit': '2000-01-01'}
+
+        visits = self._make_one(req)[patient.pid]['visits']
+
+        with pytest.raises(KeyError):
+            visits['2000-01-01']
+
+
+class TestPatientActivity:
+
+    def _get_activity(self, db_session, patient):
+        from occams_studies import models
+        db_session.flush()
+        activity = models.patient_activity_table
+        return db_session.execute(
+            activity.select()
+            .where(activity.c.patient_id == patient.id)).fetchone()
+
+    def test_new_patient(self, db_session, factories):
+        """
+        It should summarize newly added patients
+        """
+        patient = factories.PatientFactory.create()
+
+        activity = self._get_activity(db_session, patient)
+
+        assert activity.site_id == patient.site_id
+        assert activity.last_visit_date is None
+        assert activity.enrollment_count == 0
+
+    def test_visits_and_enrollments(self, db_session, factories):
+        """
+        It should keep track of the latest visit and number of enrollments
+        """
+        from datetime import date
+
+        patient = factories.PatientFactory.create()
+        factories.VisitFactory.create(
+            patient=patient, visit_date=date(2015, 1, 1))
+        visit = factories.VisitFactory.create(
+            patient=patient, visit_date=date(2015, 6, 1))
+        factories.EnrollmentFactory.create(patient=patient)
+
+        activity = self._get_activity(db_session, patient)
+
+        assert activity.last_visit_date == date(2015, 6, 1)
+        assert activity.enrollment_count == 1
+
+        db_session.delete(visit)
+
+        activity = self._get_activity(db_session, patient)
+
+        assert activity.last_visit_date == date(2015, 1, 1)
+
+    def test_open_forms(self, db_session, factories):
+        """
+        It should count the patient's forms that are not complete
+        """
+        from occams_datastore import models as datastore
+
+        patient = factories.PatientFactory.create()
+        entity = factories.EntityFactory.create()
+        patient.entities.add(entity)
+
+        activity = self._get_activity(db_session, patient)
+
+        assert activity.open_form_count == 1
+
+        entity.state = (
+            db_session.query(datastore.State)
+            .filter_by(name=u'complete')
+            .one())
+
+        activity = self._get_activity(db_session, patient)
+
+        assert activity.open_form_count == 0
+
+
+class TestVisitSchedule:
+
+    def _get_schedule(self, db_session, enrollment):
+        from occams_studies import models
+        db_session.flush()
+        schedule = models.visit_schedule_table
+        return db_session.execute(
+            schedule.select()
+            .where(schedule.c.enrollment_id == enrollment.id)
+            .order_by(schedule.c.expected_date)).fetchall()
+
+    def test_expected_visits(self, db_session, factories):
+        """
+        It should schedule the study's cycles relative to consent
+        """
+        from datetime import date
+
+        study = factories.StudyFactory.create()
+        factories.CycleFactory.create(study=study, week=2, threshold=7)
+        factories.CycleFactory.create(study=study, week=4)
+        factories.CycleFactory.create(study=study, week=6, is_interim=True)
+        enrollment = factories.EnrollmentFactory.create(
+            study=study, consent_date=date(2015, 1, 1))
+
+        schedule = self._get_schedule(db_session, enrollment)
+
+        assert [(s.expected_date, s.window_start, s.window_end)
+                for s in schedule] == [
+            (date(2015, 1, 15), date(2015, 1, 8), date(2015, 1, 22)),
+            (date(2015, 1, 29), date(2015, 1, 29), None)]
+        assert all(s.site_id == enrollment.patient.site_id for s in schedule)
+
+    def test_visits(self, db_session, factories):
+        """
+        It should match the patient's visits to their cycles
+        """
+        from datetime import date
+
+        cycle = factories.CycleFactory.create(week=2)
+        enrollment = factories.EnrollmentFactory.create(
+            study=cycle.study, consent_date=date(2015, 1, 1))
+        visit = factories.VisitFactory.create(
+            patient=enrollment.patient,
+            visit_date=date(2015, 1, 16),
+            cycles=[cycle])
+
+        (schedule,) = self._get_schedule(db_session, enrollment)
+
+        assert schedule.visit_id == visit.id
+        assert schedule.visit_date == date(2015, 1, 16)
+
+        db_session.delete(visit)
+
+        (schedule,) = self._get_schedule(db_session, enrollment)
+
+        assert schedule.visit_id is None
+
+    def test_multiple_visit_cycles(self, db_session, factories):
+        """
+        It should match visits whose cycles are added in a single statement
+        """
+        from datetime import date
+        from occams_studies import models
+
+        study = factories.StudyFactory.create()
+        cycle1 = factories.CycleFactory.create(study=study, week=2)
+        cycle2 = factories.CycleFactory.create(study=study, week=4)
+        enrollment = factories.EnrollmentFactory.create(
+            study=study, consent_date=date(2015, 1, 1))
+        visit1 = factories.VisitFactory.create(
+            patient=enrollment.patient, visit_date=date(2015, 1, 16))
+        visit2 = factories.VisitFactory.create(
+            patient=enrollment.patient, visit_date=date(2015, 1, 30))
+        db_session.flush()
+
+        db_session.execute(models.visit_cycle_table.insert().values([
+            {'visit_id': visit1.id, 'cycle_id': cycle1.id},
+            {'visit_id': visit2.id, 'cycle_id': cycle2.id}]))
+
+        schedule = self._get_schedule(db_session, enrollment)
+
+        assert [(s.cycle_id, s.visit_id, s.visit_date)
+                for s in schedule] == [
+            (cycle1.id, visit1.id, date(2015, 1, 16)),
+            (cycle2.id, visit2.id, date(2015, 1, 30))]
+
+    def test_terminated(self, db_session, factories):
+        """
+        It should not schedule visits for terminated enrollments
+        """
+        from datetime import date
+
+        cycle = factories.CycleFactory.create(week=2)
+        enrollment = factories.EnrollmentFactory.create(
+            study=cycle.study, consent_date=date(2015, 1, 1))
+
+        assert len(self._get_schedule(db_session, enrollment)) == 1
+
+        enrollment.termination_date = date(2015, 2, 1)
+
+        assert len(self._get_schedule(db_session, enrollment)) == 0
+
+    def test_cycle_changed(self, db_session, factories):
+        """
+        It should only reschedule the changed cycle
+        """
+        from datetime import date
+        from occams_studies import models
+
+        study = factories.StudyFactory.create()
+        cycle1 = factories.CycleFactory.create(study=study, week=2)
+        cycle2 = factories.CycleFactory.create(study=study, week=4)
+        enrollment = factories.EnrollmentFactory.create(
+            study=study, consent_date=date(2015, 1, 1))
+        self._get_schedule(db_session, enrollment)
+
+        # Tag the rows so we can tell which ones were recomputed
+        schedule = models.visit_schedule_table
+        db_session.execute(
+            schedule.update().values(visit_date=date(2000, 1, 1)))
+
+        cycle1.week = 3
+
+        rows = dict(
+            (s.cycle_id, s)
+            for s in self._get_schedule(db_session, enrollment))
+
+        assert rows[cycle1.id].expected_date == date(2015, 1, 22)
+        assert rows[cycle1.id].visit_date is None
+        assert rows[cycle2.id].visit_date == date(2000, 1, 1)
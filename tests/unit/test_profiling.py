@@ -0,0 +1,166 @@
+import pytest
+
+
+@pytest.fixture
+def redis(request):
+    from redis import StrictRedis
+    from tests.conftest import REDIS_URL
+    from occams_studies import profiling
+
+    redis = StrictRedis.from_url(REDIS_URL)
+    profiling.reset(redis)
+    request.addfinalizer(lambda: profiling.reset(redis))
+    return redis
+
+
+class TestPercentiles:
+
+    def _call_fut(self, *args, **kw):
+        from occams_studies.profiling import percentiles
+        return percentiles(*args, **kw)
+
+    def test_empty(self):
+        """
+        It should only count an empty histogram
+        """
+        assert self._call_fut({}) == {'count': 0}
+
+    def test_precision(self):
+        """
+        It should report percentiles to within a bucket of the values
+        """
+        from occams_studies.profiling import bucket, GROWTH
+
+        values = list(range(1, 1001))
+        histogram = {}
+        for value in values:
+            index = bucket(value)
+            histogram[index] = histogram.get(index, 0) + 1
+
+        summary = self._call_fut(histogram)
+
+        assert summary['count'] == 1000
+        for percentile, expected in [('p50', 500), ('p90', 900), ('p99', 990)]:
+            assert expected <= summary[percentile] <= expected * GROWTH
+        assert 1000 <= summary['max'] <= 1000 * GROWTH
+
+
+class TestSummarize:
+
+    def _call_fut(self, *args, **kw):
+        from occams_studies.profiling import summarize
+        return summarize(*args, **kw)
+
+    def test_slowest_first(self, redis):
+        """
+        It should list routes slowest first
+        """
+        from occams_studies.profiling import Profile, record
+
+        for route_name, latency in [
+                ('studies.fast', 5), ('studies.slow', 500)]:
+            profile = Profile()
+            profile.add('latency', latency)
+            profile.add('sql_count', 3)
+            record(redis, route_name, profile)
+
+        routes = self._call_fut(redis)
+
+        assert [r['name'] for r in routes] == ['studies.slow', 'studies.fast']
+        assert routes[0]['count'] == 1
+        assert routes[0]['sql_count']['p50'] >= 3
+
+
+class TestProfilingTween:
+
+    @pytest.fixture(autouse=True)
+    def instrument_sql(self):
+        from occams_studies.profiling import instrument_sql
+        instrument_sql()
+
+    def _make_tween(self, handler, sample_rate=1.0, export_dir='/tmp'):
+        from pyramid.registry import Registry
+        from occams_studies.profiling import profiling_tween_factory
+
+        registry = Registry()
+        registry.settings = {
+            'studies.profiling.sample_rate': sample_rate,
+            'studies.export.dir': export_dir,
+        }
+        return profiling_tween_factory(handler, registry)
+
+    def _make_handler(self, db_session, route_name='studies.test'):
+        import mock
+        from pyramid.response import Response
+
+        def handler(request):
+            request.matched_route = mock.Mock()
+            request.matched_route.name = route_name
+            db_session.execute('SELECT 1')
+            db_session.execute('SELECT 2')
+            return Response()
+
+        return handler
+
+    def test_sampled(self, req, db_session, redis):
+        """
+        It should record the latency and SQL of sampled requests
+        """
+        from occams_studies.profiling import summarize
+
+        req.redis = redis
+        tween = self._make_tween(self._make_handler(db_session))
+
+        tween(req)
+
+        (route,) = summarize(redis)
+        assert route['name'] == 'studies.test'
+        assert route['count'] == 1
+        assert 2 <= route['sql_count']['p50'] <= 2 * 1.05
+
+    def test_not_sampled(self, req, db_session, redis):
+        """
+        It should not record requests that are not sampled
+        """
+        from occams_studies.profiling import summarize
+
+        req.redis = redis
+        tween = self._make_tween(
+            self._make_handler(db_session), sample_rate=0)
+
+        tween(req)
+
+        assert summarize(redis) == []
+
+    def test_capture(self, req, db_session, redis, config, tmpdir):
+        """
+        It should dump a full profile of a request if an admin asks for one
+        """
+        req.redis = redis
+        req.headers['X-Profile'] = '1'
+        config.testing_securitypolicy(permissive=True)
+        tween = self._make_tween(
+            self._make_handler(db_session),
+            sample_rate=0,
+            export_dir=str(tmpdir))
+
+        response = tween(req)
+
+        assert tmpdir.join(response.headers['X-Profile-File']).check()
+
+    def test_capture_not_admin(self, req, db_session, redis, config, tmpdir):
+        """
+        It should ignore profiling requests from other users
+        """
+        req.redis = redis
+        req.headers['X-Profile'] = '1'
+        config.testing_securitypolicy(permissive=False)
+        tween = self._make_tween(
+            self._make_handler(db_session),
+            sample_rate=0,
+            export_dir=str(tmpdir))
+
+        response = tween(req)
+
+        assert 'X-Profile-File' not in response.headers
+        assert tmpdir.listdir() == []
@@ -0,0 +1,124 @@
+"""
+Query plan checks
+
+The main listing, dashboard and export queries are run against a small
+seeded database and then EXPLAINed with sequential scans disabled, so the
+planner falls back to a sequential scan only where no index can be used.
+"""
+
+import pytest
+
+
+def plan_nodes(plan):
+    """
+    Yields every node of an EXPLAIN (FORMAT JSON) plan
+    """
+    yield plan
+    for child in plan.get('Plans', []):
+        for node in plan_nodes(child):
+            yield node
+
+
+@pytest.fixture
+def seq_scans(db_session):
+    """
+    Returns a function that calls ``fn`` and returns the tables that the
+    SELECT statements issued during the call sequentially scan
+    """
+    import sqlalchemy as sa
+
+    def seq_scans(fn):
+        statements = []
+
+        def capture(conn, cursor, statement, parameters, *args):
+            if statement.lstrip().upper().startswith('SELECT'):
+                statements.append((statement, parameters))
+
+        engine = db_session.bind
+        sa.event.listen(engine, 'before_cursor_execute', capture)
+        try:
+            fn()
+        finally:
+            sa.event.remove(engine, 'before_cursor_execute', capture)
+
+        cursor = db_session.connection().connection.cursor()
+        cursor.execute('SET LOCAL enable_seqscan = off')
+
+        tables = set()
+        for statement, parameters in statements:
+            cursor.execute('EXPLAIN (FORMAT JSON) ' + statement, parameters)
+            (result,) = cursor.fetchone()
+            tables.update(
+                node['Relation Name']
+                for node in plan_nodes(result[0]['Plan'])
+                if node['Node Type'] == 'Seq Scan')
+
+        cursor.execute('SET LOCAL enable_seqscan = on')
+        return tables
+
+    return seq_scans
+
+
+class TestQueryPlans:
+
+    def test_visit_forms(self, req, db_session, factories, seq_scans):
+        """
+        It should find the forms of a visit using indexes
+        """
+        from occams_studies.views.form import list_json
+
+        visit = factories.VisitFactory.create()
+        visit.entities.add(factories.EntityFactory.create())
+        db_session.flush()
+
+        tables = seq_scans(lambda: list_json(visit['forms'], req))
+
+        assert not tables & set(['context', 'entity'])
+
+    def test_study_dashboard(self, req, db_session, factories, seq_scans):
+        """
+        It should compute the study dashboard statistics using indexes
+        """
+        from occams_studies.views.study import visits
+
+        study = factories.StudyFactory.create()
+        factories.EnrollmentFactory.create(study=study)
+        db_session.flush()
+
+        tables = seq_scans(lambda: visits(study, req))
+
+        assert 'enrollment' not in tables
+
+    def test_schema_export(self, db_session, factories, seq_scans):
+        """
+        It should look up what exported forms are attached to using indexes
+        """
+        from occams_studies.exports.schema import SchemaPlan
+
+        patient = factories.PatientFactory.create()
+        entity = factories.EntityFactory.create()
+        patient.entities.add(entity)
+        db_session.flush()
+
+        plan = SchemaPlan.from_schema(db_session, entity.schema.name)
+
+        tables = seq_scans(lambda: plan.data().all())
+
+        assert 'context' not in tables
+
+    def test_stratum_patient(self, db_session, factories, seq_scans):
+        """
+        It should find a patient's strata using an index
+        """
+        from occams_studies import models
+
+        stratum = factories.StratumFactory.create(
+            patient=factories.PatientFactory.create())
+        db_session.flush()
+
+        tables = seq_scans(lambda: (
+            db_session.query(models.Stratum)
+            .filter_by(patient_id=stratum.patient_id)
+            .all()))
+
+        assert 'stratum' not in tables
@@ -0,0 +1,134 @@
+import json
+
+import pytest
+
+
+class TestDumps:
+
+    def _call_fut(self, *args, **kw):
+        from occams_studies.renderers import dumps
+        return dumps(*args, **kw)
+
+    def test_native(self):
+        """
+        It should encode dates, datetimes and decimals
+        """
+        from datetime import date, datetime
+        from decimal import Decimal
+
+        value = {
+            'date': date(2016, 1, 2),
+            'datetime': datetime(2016, 1, 2, 3, 4, 5),
+            'decimal': Decimal('1.5'),
+        }
+
+        assert json.loads(self._call_fut(value).decode('utf-8')) == {
+            'date': '2016-01-02',
+            'datetime': '2016-01-02T03:04:05',
+            'decimal': 1.5,
+        }
+
+    def test_json_method(self, req):
+        """
+        It should encode objects that know how to encode themselves
+        """
+        class Thing(object):
+            def __json__(self, request):
+                return {'request': request is req}
+
+        assert json.loads(self._call_fut([Thing()], req).decode('utf-8')) \
+            == [{'request': True}]
+
+    def test_not_serializable(self):
+        """
+        It should refuse values it does not know how to encode
+        """
+        with pytest.raises(TypeError):
+            self._call_fut({'value': object()})
+
+
+class TestRenderer:
+
+    def _call_fut(self, value, request=None):
+        from occams_studies.renderers import renderer_factory
+        return renderer_factory(None)(value, {'request': request})
+
+    def test_content_type(self, req):
+        """
+        It should render JSON
+        """
+        body = self._call_fut({'a': 1}, req)
+        assert req.response.content_type == 'application/json'
+        assert json.loads(body.decode('utf-8')) == {'a': 1}
+
+    @pytest.mark.parametrize('items', [[], [1], list(range(7))])
+    def test_stream(self, req, items):
+        """
+        It should send streamed lists as chunks of a single array
+        """
+        from occams_studies.renderers import stream
+
+        chunks = list(self._call_fut(stream(items, chunk_size=3), req))
+
+        assert len(chunks) == len(items) // 3 + (2 if len(items) % 3 else 1)
+        assert json.loads(b''.join(chunks).decode('utf-8')) == items
+
+    def test_stream_without_request(self):
+        """
+        It should render streamed lists at once outside of requests
+        """
+        from occams_studies.renderers import stream
+
+        body = self._call_fut(stream([1, 2, 3], chunk_size=2))
+        assert json.loads(body.decode('utf-8')) == [1, 2, 3]
+
+
+class TestCodebook:
+
+    @pytest.fixture
+    def codebook(self, db_session):
+        """
+        The codebook of a form with many fields
+        """
+        from datetime import date
+        from occams_datastore import models as datastore
+        from occams_studies.exports.schema import SchemaPlan
+
+        db_session.add(datastore.Schema(
+            name=u'aform',
+            title=u'',
+            publish_date=date.today(),
+            attributes=dict(
+                (u'field{0}'.format(i), datastore.Attribute(
+                    name=u'field{0}'.format(i),
+                    title=u'Field {0}'.format(i),
+                    type=u'string',
+                    order=i))
+                for i in range(500))))
+        db_session.flush()
+
+        return list(SchemaPlan.from_schema(db_session, u'aform').codebook())
+
+    def test_codebook(self, req, codebook):
+        """
+        It should render the codebook as the stock renderer did
+        """
+        from pyramid.renderers import JSON
+        from occams_studies.renderers import renderer_factory, stream
+
+        def massaged(row):
+            row = dict(row)
+            if row['publish_date']:
+                row['publish_date'] = row['publish_date'].isoformat()
+            return row
+
+        def stock():
+            value = [massaged(row) for row in codebook]
+            return JSON()(None)(value, {'request': req}).encode('utf-8')
+
+        def fast():
+            value = stream(codebook)
+            return b''.join(renderer_factory(None)(value, {'request': req}))
+
+        assert json.loads(fast().decode('utf-8')) == \
+            json.loads(stock().decode('utf-8'))
@@ -0,0 +1,170 @@
+import pytest
+
+
+@pytest.fixture
+def replica_url(request):
+    """
+    The database standing in for the replica
+    """
+    url = request.config.getoption('--replica-db')
+    if not url:
+        pytest.skip('Requires --replica-db')
+    return url
+
+
+@pytest.fixture(autouse=True)
+def reset_lags():
+    """
+    Forgets the replication lag measured by other tests
+    """
+    from occams_studies import replica
+    replica._lags.clear()
+
+
+@pytest.fixture
+def settings(config, replica_url):
+    config.registry.settings['studies.db.replica_url'] = replica_url
+    return config.registry.settings
+
+
+class TestOpenSession:
+
+    def _call_fut(self, *args, **kw):
+        from occams_studies.replica import open_session
+        return open_session(*args, **kw)
+
+    def test_not_configured(self, config):
+        """
+        It should not open a session if no replica is configured
+        """
+        assert self._call_fut(config.registry.settings) is None
+
+    def test_replica(self, db_session, settings, replica_url):
+        """
+        It should open a session on the replica
+        """
+        from sqlalchemy.engine.url import make_url
+        from occams_studies import models
+
+        db_session.add(models.Site(name=u'ucsd', title=u'UCSD'))
+        db_session.flush()
+
+        read_session = self._call_fut(settings)
+
+        try:
+            assert str(read_session.bind.url) == str(make_url(replica_url))
+            # The replica is a separate database that never received it
+            assert read_session.query(models.Site).count() == 0
+        finally:
+            read_session.close()
+
+    def test_lagging(self, settings):
+        """
+        It should not use a replica that is too far behind
+        """
+        import mock
+
+        settings['studies.db.replica_max_lag'] = 30
+
+        with mock.patch(
+                'occams_studies.replica.replica_lag', return_value=31):
+            assert self._call_fut(settings) is None
+
+    def test_lag_reused(self, settings):
+        """
+        It should only measure the lag once in a while
+        """
+        import mock
+
+        with mock.patch(
+                'occams_studies.replica.replica_lag', return_value=0) as lag:
+            self._call_fut(settings).close()
+            self._call_fut(settings).close()
+            assert lag.call_count == 1
+
+    def test_replayed(self, db_session, settings):
+        """
+        It should use a replica that has replayed the primary's commits
+        """
+        from occams_studies.replica import current_lsn
+
+        lsn = current_lsn(db_session)
+
+        self._call_fut(settings, lsn=lsn).close()
+
+    def test_not_replayed(self, db_session, settings):
+        """
+        It should not use a replica that has not caught up with a commit
+        """
+        import mock
+        from occams_studies.replica import current_lsn
+
+        lsn = current_lsn(db_session)
+
+        with mock.patch('occams_studies.replica.REPLAY_TIMEOUT', 0), \
+                mock.patch(
+                    'occams_studies.replica.has_replayed',
+                    return_value=False):
+            assert self._call_fut(settings, lsn=lsn) is None
+
+    def test_unavailable(self, config):
+        """
+        It should not use a replica that cannot be reached
+        """
+        settings = config.registry.settings
+        settings['studies.db.replica_url'] = \
+            'postgresql://nobody@localhost:1/nowhere'
+
+        assert self._call_fut(settings) is None
+
+
+class TestReadSession:
+
+    def _call_fut(self, *args, **kw):
+        from occams_studies.replica import read_session
+        return read_session(*args, **kw)
+
+    def test_fallback(self, config, db_session):
+        """
+        It should use the primary if there is no replica
+        """
+        with self._call_fut(config.registry.settings, db_session) as session:
+            assert session is db_session
+
+    def test_replica(self, db_session, settings):
+        """
+        It should use the replica and close it afterwards
+        """
+        import mock
+
+        with mock.patch('sqlalchemy.orm.Session.close') as close:
+            with self._call_fut(settings, db_session) as session:
+                assert session is not db_session
+                assert not close.called
+            assert close.called
+
+
+class TestReadDbSession:
+
+    def _call_fut(self, *args, **kw):
+        from occams_studies.replica import read_db_session
+        return read_db_session(*args, **kw)
+
+    def test_get(self, req, settings, db_session):
+        """
+        It should use the replica for GET requests
+        """
+        req.method = 'GET'
+        read_session = self._call_fut(req)
+        try:
+            assert read_session is not db_session
+            assert read_session.info['request'] is req
+        finally:
+            read_session.close()
+
+    def test_post(self, req, settings, db_session):
+        """
+        It should use the primary for requests that may write
+        """
+        req.method = 'POST'
+        assert self._call_fut(req) is db_session
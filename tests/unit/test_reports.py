@@ -0,0 +1,209 @@
+import re
+
+import pytest
+import sqlalchemy as sa
+
+
+@pytest.fixture
+def schema(db_session):
+    from datetime import date
+    from occams_datastore import models as datastore
+
+    schema = datastore.Schema(
+        name=u'vitals',
+        title=u'Vitals',
+        publish_date=date.today(),
+        attributes={
+            'foo': datastore.Attribute(
+                name='foo',
+                title=u'',
+                type='string',
+                order=0,
+            )})
+    db_session.add(schema)
+    db_session.flush()
+    return schema
+
+
+def add_entity(db_session, schema, value):
+    from datetime import date
+    from occams_datastore import models as datastore
+
+    entity = datastore.Entity(schema=schema, collect_date=date.today())
+    db_session.add(entity)
+    db_session.flush()
+    entity['foo'] = value
+    db_session.flush()
+    return entity
+
+
+class TestFetchReport:
+
+    def _call_fut(self, *args, **kw):
+        from occams_studies.reports import fetch_report
+        return fetch_report(*args, **kw)
+
+    def test_not_materialized(self, db_session, schema):
+        """
+        It should build the report of forms that are not materialized
+        """
+        add_entity(db_session, schema, u'bar')
+
+        report = self._call_fut(db_session, schema.name)
+
+        assert not isinstance(report, sa.Table)
+        assert [r.foo for r in db_session.query(report)] == [u'bar']
+
+    def test_fresh(self, db_session, schema):
+        """
+        It should use the materialized report if it is fresh
+        """
+        from occams_studies import reports
+
+        add_entity(db_session, schema, u'bar')
+        assert reports.rebuild(db_session, schema.name) == 1
+
+        report = self._call_fut(db_session, schema.name)
+
+        assert isinstance(report, sa.Table)
+        assert [r.foo for r in db_session.query(report)] == [u'bar']
+
+    def test_pending_changes(self, db_session, schema):
+        """
+        It should not use the materialized report if it has pending changes
+        """
+        from occams_studies import reports
+
+        entity = add_entity(db_session, schema, u'bar')
+        reports.rebuild(db_session, schema.name)
+
+        entity['foo'] = u'baz'
+        db_session.flush()
+
+        report = self._call_fut(db_session, schema.name)
+
+        assert not isinstance(report, sa.Table)
+        assert [r.foo for r in db_session.query(report)] == [u'baz']
+
+    def test_new_version(self, db_session, schema):
+        """
+        It should not use the materialized report of previous versions
+        """
+        from datetime import date, timedelta
+        from occams_datastore import models as datastore
+        from occams_studies import reports
+
+        reports.rebuild(db_session, schema.name)
+
+        version = datastore.Schema(
+            name=schema.name,
+            title=schema.title,
+            publish_date=date.today() + timedelta(1))
+        db_session.add(version)
+        db_session.flush()
+
+        report = self._call_fut(db_session, schema.name)
+
+        assert not isinstance(report, sa.Table)
+
+
+class TestRefresh:
+
+    def _call_fut(self, *args, **kw):
+        from occams_studies.reports import refresh
+        return refresh(*args, **kw)
+
+    def test_changed_entities(self, db_session, schema):
+        """
+        It should only re-pivot the entities that changed
+        """
+        from occams_studies import reports
+
+        entity = add_entity(db_session, schema, u'bar')
+        add_entity(db_session, schema, u'qux')
+        reports.rebuild(db_session, schema.name)
+
+        entity['foo'] = u'baz'
+        added = add_entity(db_session, schema, u'new')
+
+        assert self._call_fut(db_session) == 2
+
+        report = reports.fetch_report(db_session, schema.name)
+        assert isinstance(report, sa.Table)
+        assert sorted(r.foo for r in db_session.query(report)) == \
+            [u'baz', u'new', u'qux']
+
+        db_session.delete(added)
+        db_session.flush()
+
+        assert self._call_fut(db_session) == 1
+
+        report = reports.fetch_report(db_session, schema.name)
+        assert isinstance(report, sa.Table)
+        assert sorted(r.foo for r in db_session.query(report)) == \
+            [u'baz', u'qux']
+
+    def test_discard_unmaterialized(self, db_session, schema):
+        """
+        It should discard changes to forms that are not materialized
+        """
+        from occams_studies import models
+
+        add_entity(db_session, schema, u'bar')
+
+        assert self._call_fut(db_session) == 0
+
+        table = models.report_change_table
+        assert db_session.query(table).count() == 0
+
+    def test_retracted(self, db_session, schema):
+        """
+        It should drop the reports of forms that are no longer published
+        """
+        from datetime import date
+        from occams_studies import models, reports
+
+        reports.rebuild(db_session, schema.name)
+
+        schema.retract_date = date.today()
+        db_session.flush()
+
+        self._call_fut(db_session)
+
+        table = models.report_status_table
+        assert db_session.query(table).count() == 0
+
+
+class TestSchemaPlanData:
+
+    def test_materialized(self, db_session, schema):
+        """
+        It should export the materialized report of a form
+        """
+        from occams_studies import reports
+        from occams_studies.exports.schema import SchemaPlan
+
+        add_entity(db_session, schema, u'bar')
+        reports.rebuild(db_session, schema.name)
+
+        plan = SchemaPlan.from_schema(db_session, schema.name)
+        query = plan.data()
+
+        assert re.search(r'report_\d+', str(query))
+        assert query.one().foo == u'bar'
+
+    def test_options(self, db_session, schema):
+        """
+        It should build reports for other than the default options
+        """
+        from occams_studies import reports
+        from occams_studies.exports.schema import SchemaPlan
+
+        add_entity(db_session, schema, u'bar')
+        reports.rebuild(db_session, schema.name)
+
+        plan = SchemaPlan.from_schema(db_session, schema.name)
+        query = plan.data(use_choice_labels=True)
+
+        assert not re.search(r'report_\d+', str(query))
+        assert query.one().foo == u'bar'
@@ -0,0 +1,68 @@
+"""
+Startup budgets (see "How do I check startup time?" in the README)
+"""
+
+import json
+import subprocess
+import sys
+from timeit import default_timer
+
+import pytest
+
+
+#: Ceilings of the time (in seconds) a fresh interpreter takes to import
+#: each entry point
+BUDGETS = {
+    'occams_studies': 1.5,
+    'occams_studies.scripts.export': 2.0,
+    'occams_studies.scripts.reports': 2.0,
+}
+
+#: Modules only some code paths need, none of the entry points may load them
+LAZY = [
+    'babel',
+    'humanize',
+    'tabulate',
+    'occams_forms.renderers',
+    'occams_studies.views',
+]
+
+# Imports a module and prints the names of the modules that got loaded
+SCRIPT = '''
+import json, sys
+import {0}
+json.dump([n for n, m in sys.modules.items() if m is not None], sys.stdout)
+'''
+
+
+def import_module(module):
+    """
+    Imports ``module`` in a fresh interpreter
+
+    Returns how long (in seconds) the interpreter took and the names of the
+    modules it loaded.
+    """
+    start = default_timer()
+    output = subprocess.check_output(
+        [sys.executable, '-c', SCRIPT.format(module)],
+        universal_newlines=True)
+    elapsed = default_timer() - start
+    return elapsed, set(json.loads(output))
+
+
+@pytest.mark.parametrize('module', sorted(BUDGETS))
+class TestStartup:
+
+    def test_budget(self, module):
+        """
+        It should import within its budget
+        """
+        elapsed, modules = import_module(module)
+        assert elapsed <= BUDGETS[module]
+
+    def test_lazy(self, module):
+        """
+        It should not load dependencies that only some code paths need
+        """
+        elapsed, modules = import_module(module)
+        assert sorted(name for name in LAZY if name in modules) == []
@@ -104,6 +104,55 @@ class TestViewJson:
         assert res['stratum']['arm'] is not None
 
 
+class TestListJson:
+
+    def _call_fut(self, *args, **kw):
+        from occams_studies.views.enrollment import list_json as view
+        return view(*args, **kw)
+
+    def test_constant_queries(self, req, db_session, factories):
+        """
+        It should not issue queries for each listed enrollment
+        """
+        import sqlalchemy as sa
+        from occams_studies import models
+
+        def count_statements(size):
+            schema = factories.SchemaFactory.create()
+            patient = factories.PatientFactory.create()
+            for i in range(size):
+                study = factories.StudyFactory.create(
+                    randomization_schema=schema,
+                    is_randomized=True)
+                enrollment = factories.EnrollmentFactory(
+                    patient=patient,
+                    study=study,
+                    stratum=factories.StratumFactory(arm__study=study))
+                enrollment.entities.add(
+                    factories.EntityFactory.create(schema=schema))
+            db_session.flush()
+            db_session.expire_all()
+
+            context = models.EnrollmentFactory(req, patient)
+            statements = []
+
+            def count(conn, cursor, statement, *args):
+                statements.append(statement)
+
+            engine = db_session.bind
+            sa.event.listen(engine, 'before_cursor_execute', count)
+            try:
+                res = self._call_fut(context, req)
+            finally:
+                sa.event.remove(engine, 'before_cursor_execute', count)
+
+            assert size == len(res['enrollments'])
+            assert all(e['stratum'] for e in res['enrollments'])
+            return len(statements)
+
+        assert count_statements(1) == count_statements(5)
+
+
 class TestEditJson:
 
     def _call_fut(self, *args, **kw):
@@ -496,3 +496,38 @@ class TestDownload:
 
         with pytest.raises(HTTPBadRequest):
             self._call_fut(export, req)
+
+
+class TestMetricsJSON:
+
+    def _call_fut(self, *args, **kw):
+        from occams_studies.views.export import metrics_json as view
+        return view(*args, **kw)
+
+    def test_trend(self, req, db_session):
+        """
+        It should rank the plans and trend the requested plan
+        """
+        from occams_studies import models
+        from occams_studies.exports.metrics import record
+
+        stats = {'query_time': 1, 'write_time': 1, 'rows': 1, 'bytes': 1}
+        record(db_session, u'vitals', stats, 'cli')
+
+        req.GET = {'plan': u'vitals'}
+        res = self._call_fut(models.ExportFactory(req), req)
+
+        assert [p['name'] for p in res['plans']] == [u'vitals']
+        assert len(res['trend']) == 1
+
+    @pytest.mark.parametrize('days', ['0', 'abc'])
+    def test_invalid_days(self, req, db_session, days):
+        """
+        It should reject an invalid number of days
+        """
+        from pyramid.httpexceptions import HTTPBadRequest
+        from occams_studies import models
+
+        req.GET = {'days': days}
+        with pytest.raises(HTTPBadRequest):
+            self._call_fut(models.ExportFactory(req), req)
@@ -61,6 +61,86 @@ class Test_view_json:
         assert res['state'] is None
 
 
+class Test_list_json:
+
+    def _call_fut(self, *args, **kw):
+        from occams_studies.views.form import list_json as view
+        return view(*args, **kw)
+
+    def _add_visit(self, db_session, count):
+        from datetime import date
+        from occams_datastore import models as datastore
+        from occams_studies import models
+
+        patient = models.Patient(
+            site=models.Site(name=u'la', title=u'LA'),
+            pid=u'12345')
+        visit = models.Visit(patient=patient, visit_date=date(2015, 1, 1))
+        phi = datastore.Schema(
+            name=u'contact', title=u'Contact', publish_date=date.today())
+        db_session.add_all([patient, visit, phi])
+        db_session.flush()
+        db_session.execute(models.patient_schema_table.insert().values(
+            schema_id=phi.id))
+
+        for i in range(count):
+            visit.entities.add(datastore.Entity(
+                collect_date=visit.visit_date,
+                schema=datastore.Schema(
+                    name=u'form%02d' % i,
+                    title=u'',
+                    publish_date=date.today())))
+        visit.entities.add(datastore.Entity(
+            collect_date=visit.visit_date, schema=phi))
+        db_session.flush()
+        return visit
+
+    def test_single_query(self, req, db_session):
+        """
+        It should list non-PHI forms with their URLs in a single query
+        """
+        import sqlalchemy as sa
+
+        visit = self._add_visit(db_session, 3)
+        context = visit['forms']
+
+        statements = []
+
+        def count(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        engine = db_session.bind
+        sa.event.listen(engine, 'before_cursor_execute', count)
+        try:
+            res = self._call_fut(context, req)
+        finally:
+            sa.event.remove(engine, 'before_cursor_execute', count)
+
+        assert 1 == len(statements)
+        assert [u'form00', u'form01', u'form02'] == \
+            [e['schema']['name'] for e in res['entities']]
+        assert res['entities'][0]['__url__'].endswith(
+            '/patients/12345/visits/2015-01-01/forms/%d'
+            % res['entities'][0]['id'])
+
+    def test_paged(self, req, db_session):
+        """
+        It should return pages of forms if requested
+        """
+        import mock
+
+        visit = self._add_visit(db_session, 5)
+        req.GET = {'page': '2'}
+
+        with mock.patch('occams_studies.views.form.FORMS_PER_PAGE', 2):
+            res = self._call_fut(visit['forms'], req)
+
+        assert res['__has_previous__']
+        assert res['__has_next__']
+        assert [u'form02', u'form03'] == \
+            [e['schema']['name'] for e in res['entities']]
+
+
 class Test_available_schemata:
 
     def _call_fut(self, *args, **kw):
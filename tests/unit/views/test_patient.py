@@ -382,6 +382,125 @@ class Test_edit_json:
              for r in res['references']]
 
 
+class Test_import_json:
+
+    def _call_fut(self, *args, **kw):
+        from occams_studies.views.patient import import_json as view
+        return view(*args, **kw)
+
+    def _upload(self, req, lines):
+        import tempfile
+
+        class DummyUpload:
+            pass
+
+        fp = tempfile.NamedTemporaryFile(prefix='nose-', suffix='.csv')
+        fp.write(b'\n'.join(lines) + b'\n')
+        fp.flush()
+        upload = DummyUpload()
+        upload.file = fp
+        upload.filename = fp.name
+        req.POST = {'upload': upload}
+        return fp
+
+    def test_import(self, req, db_session, config, check_csrf_token):
+        """
+        It should create patients with new PIDs, references and PHI forms
+        """
+        from datetime import date
+        import mock
+        from occams_datastore import models as datastore
+        from occams_studies import models
+
+        config.testing_securitypolicy(userid='joe', permissive=True)
+
+        schema = datastore.Schema(
+            name=u'contact', title=u'Contact', publish_date=date.today())
+        db_session.add_all([
+            models.Site(name=u'la', title=u'LA'),
+            models.ReferenceType(name=u'foo', title=u'FOO'),
+            schema])
+        db_session.flush()
+        db_session.execute(models.patient_schema_table.insert().values(
+            schema_id=schema.id))
+
+        fp = self._upload(req, [b'SITE,FOO', b'la,ABC', b'la,XYZ'])
+        with fp, mock.patch('occams_studies.patient_import.generate') as gen:
+            gen.side_effect = [u'P1', u'P2']
+            res = self._call_fut(models.PatientFactory(req), req)
+
+        assert [u'P1', u'P2'] == res['pids']
+
+        patient = db_session.query(models.Patient).filter_by(pid=u'P2').one()
+        assert u'la' == patient.site.name
+        assert [u'XYZ'] == [r.reference_number for r in patient.references]
+        assert [u'contact'] == [e.schema.name for e in patient.entities]
+
+    def test_existing_reference(
+            self, req, db_session, config, check_csrf_token):
+        """
+        It should not import anything if a reference is already assigned
+        """
+        import mock
+        from pyramid.httpexceptions import HTTPBadRequest
+        from occams_studies import models
+
+        config.testing_securitypolicy(userid='joe', permissive=True)
+
+        site = models.Site(name=u'la', title=u'LA')
+        reftype = models.ReferenceType(name=u'foo', title=u'FOO')
+        db_session.add(models.PatientReference(
+            patient=models.Patient(site=site, pid=u'12345'),
+            reference_type=reftype,
+            reference_number=u'ABC'))
+        db_session.flush()
+
+        fp = self._upload(req, [b'SITE,FOO', b'la,XYZ', b'la,ABC', b'la,XYZ'])
+        with fp, mock.patch('occams_studies.patient_import.generate') as gen:
+            with pytest.raises(HTTPBadRequest) as excinfo:
+                self._call_fut(models.PatientFactory(req), req)
+
+        assert not gen.called
+        assert [3, 4] == [e['line'] for e in excinfo.value.json['errors']]
+        assert 1 == db_session.query(models.Patient).count()
+
+    def test_invalid_json(self, req, db_session, config, check_csrf_token):
+        """
+        It should reject a JSON roster that cannot be parsed
+        """
+        from pyramid.httpexceptions import HTTPBadRequest
+        from occams_studies import models
+
+        config.testing_securitypolicy(userid='joe', permissive=True)
+
+        fp = self._upload(req, [b'[{"site": "la",'])
+        with fp, pytest.raises(HTTPBadRequest):
+            self._call_fut(models.PatientFactory(req), req)
+
+        assert 0 == db_session.query(models.Patient).count()
+
+    def test_extra_cells(self, req, db_session, config, check_csrf_token):
+        """
+        It should report CSV rows with more cells than the header
+        """
+        from pyramid.httpexceptions import HTTPBadRequest
+        from occams_studies import models
+
+        config.testing_securitypolicy(userid='joe', permissive=True)
+
+        db_session.add_all([
+            models.Site(name=u'la', title=u'LA'),
+            models.ReferenceType(name=u'foo', title=u'FOO')])
+        db_session.flush()
+
+        fp = self._upload(req, [b'SITE,FOO', b'la,ABC', b'la,XYZ,oops'])
+        with fp, pytest.raises(HTTPBadRequest) as excinfo:
+            self._call_fut(models.PatientFactory(req), req)
+
+        assert [3] == [e['line'] for e in excinfo.value.json['errors']]
+        assert 0 == db_session.query(models.Patient).count()
+
+
 class Test_delete_json:
 
     def _call_fut(self, *args, **kw):
@@ -437,3 +556,55 @@ class Test_delete_json:
         self._call_fut(patient, req)
 
         assert 0 == db_session.query(datastore.Entity).count()
+
+    def _add_visit(self, db_session):
+        from datetime import date
+        from occams_datastore import models as datastore
+        from occams_studies import models
+
+        schema = datastore.Schema(
+            name=u'somevisitform',
+            title=u'Some Visit Form',
+            publish_date=date.today())
+        patient = models.Patient(
+            site=models.Site(name=u'la', title=u'LA'),
+            pid=u'12345')
+        visit = models.Visit(patient=patient, visit_date=date.today())
+        entity = datastore.Entity(collect_date=date.today(), schema=schema)
+        visit.entities.add(entity)
+        patient.entities.add(entity)
+        db_session.add_all([patient, visit, entity, schema])
+        db_session.flush()
+        return patient
+
+    def test_cascade_visits(self, req, db_session, check_csrf_token):
+        """
+        It should delete the patient's visits along with their forms
+        """
+        from occams_datastore import models as datastore
+        from occams_studies import models
+
+        patient = self._add_visit(db_session)
+
+        self._call_fut(patient, req)
+
+        assert 0 == db_session.query(models.Visit).count()
+        assert 0 == db_session.query(datastore.Entity).count()
+        assert 0 == db_session.query(datastore.Context).count()
+
+    def test_dry_run(self, req, db_session, check_csrf_token):
+        """
+        It should only count what would be deleted in dry-run mode
+        """
+        from occams_studies import models
+
+        patient = self._add_visit(db_session)
+        req.params = {'dry_run': '1'}
+
+        res = self._call_fut(patient, req)
+
+        assert 1 == res['counts']['patient']
+        assert 1 == res['counts']['visit']
+        assert 1 == res['counts']['entity']
+        assert 2 == res['counts']['context']
+        assert 1 == db_session.query(models.Patient).count()
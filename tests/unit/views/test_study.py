@@ -807,6 +807,163 @@ class TestAvailableSchemata:
         assert str(tomorrow) == res['schemata'][0]['publish_date']
 
 
+class TestVisits:
+
+    def _call_fut(self, *args, **kw):
+        from occams_studies.views.study import visits as view
+        return view(*args, **kw)
+
+    def test_enrollment_stats(self, req, db_session, factories):
+        """
+        It should summarize the study's enrollment activity
+        """
+        from datetime import date, timedelta
+
+        today = date.today()
+        last_month = date(today.year, today.month, 1) - timedelta(days=1)
+
+        study = factories.StudyFactory.create()
+        factories.EnrollmentFactory.create(
+            study=study, consent_date=today)
+        factories.EnrollmentFactory.create(
+            study=study,
+            consent_date=last_month,
+            latest_consent_date=last_month,
+            termination_date=today)
+        factories.EnrollmentFactory.create()
+        factories.CycleFactory.create(study=study)
+        db_session.flush()
+
+        res = self._call_fut(study, req)
+
+        assert 1 == res['start_this_month']
+        assert 1 == res['start_last_month']
+        assert 1 == res['end_this_month']
+        assert 0 == res['end_last_month']
+        assert 1 == res['active']
+        assert 2 == res['all_time']
+        assert 1 == res['cycles_count']
+        assert res['has_cycles']
+
+
+class TestVisitsCycle:
+
+    def _call_fut(self, *args, **kw):
+        from occams_studies.views.study import visits_cycle as view
+        return view(*args, **kw)
+
+    def test_summary(self, req, db_session, factories):
+        """
+        It should summarize the cycle's visits and forms by state
+        """
+        from occams_datastore import models as datastore
+
+        cycle = factories.CycleFactory.create()
+        pending = (
+            db_session.query(datastore.State)
+            .filter_by(name=u'pending-entry').one())
+        complete = (
+            db_session.query(datastore.State)
+            .filter_by(name=u'complete').one())
+
+        for state in (pending, complete):
+            visit = factories.VisitFactory.create(cycles=[cycle])
+            visit.entities.add(factories.EntityFactory.create(state=state))
+            visit.entities.add(factories.EntityFactory.create(state=state))
+        db_session.flush()
+
+        req.matchdict['cycle'] = cycle.name
+        res = self._call_fut(cycle.study, req)
+
+        assert 2 == res['visit_count']
+        assert 1 == res['visits_summary']['pending-entry']
+        assert 1 == res['visits_summary']['complete']
+        assert 0 == res['visits_summary']['pending-review']
+        assert 2 == res['data_summary']['complete']
+        assert 2 == res['total_visits']
+        assert 2 == len(res['visits'])
+
+    def test_query_count(self, req, db_session, factories):
+        """
+        It should issue a fixed number of queries regardless of states
+        """
+        import sqlalchemy as sa
+
+        cycle = factories.CycleFactory.create()
+        for i in range(5):
+            visit = factories.VisitFactory.create(cycles=[cycle])
+            visit.entities.add(factories.EntityFactory.create())
+        db_session.flush()
+
+        statements = []
+
+        def count(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        engine = db_session.bind
+        sa.event.listen(engine, 'before_cursor_execute', count)
+        try:
+            req.matchdict['cycle'] = cycle.name
+            self._call_fut(cycle.study, req)
+        finally:
+            sa.event.remove(engine, 'before_cursor_execute', count)
+
+        # cycle, states, visit count, summary, sites, listing page
+        assert len(statements) <= 6
+
+
+class TestVisitScheduleJson:
+
+    def _call_fut(self, *args, **kw):
+        from occams_studies.views.study import visit_schedule_json as view
+        return view(*args, **kw)
+
+    def test_statuses(self, req, db_session, factories):
+        """
+        It should list outstanding visits by status
+        """
+        from datetime import date, timedelta
+
+        today = date.today()
+        cycle = factories.CycleFactory.create(week=1, threshold=3)
+        overdue = factories.EnrollmentFactory.create(
+            study=cycle.study, consent_date=today - timedelta(8))
+        missed = factories.EnrollmentFactory.create(
+            study=cycle.study, consent_date=today - timedelta(30))
+        visited = factories.EnrollmentFactory.create(
+            study=cycle.study, consent_date=today - timedelta(30))
+        factories.VisitFactory.create(
+            patient=visited.patient, visit_date=today, cycles=[cycle])
+        db_session.flush()
+
+        res = self._call_fut(cycle.study, req)
+
+        assert [(v['pid'], v['status']) for v in res['visits']] == [
+            (missed.patient.pid, 'missed'),
+            (overdue.patient.pid, 'overdue')]
+
+        req.GET['status'] = 'overdue'
+        res = self._call_fut(cycle.study, req)
+
+        assert [v['pid'] for v in res['visits']] == [overdue.patient.pid]
+        assert res['visits'][0]['window_end'] == \
+            (today + timedelta(2)).isoformat()
+
+    def test_invalid_status(self, req, db_session, factories):
+        """
+        It should reject unknown statuses
+        """
+        from pyramid.httpexceptions import HTTPBadRequest
+
+        study = factories.StudyFactory.create()
+        db_session.flush()
+
+        req.GET['status'] = 'whenever'
+
+        with pytest.raises(HTTPBadRequest):
+            self._call_fut(study, req)
+
+
 class TestUploadRandomizationJson:
 
     def _call_fut(self, *args, **kw):
@@ -1040,4 +1197,401 @@ class TestUploadRandomizationJson:
                 req.POST = {'upload': upload}
                 self._call_fut(study, req)
 
-            assert 'existing reference numbers' in excinfo.value.body
+            errors = excinfo.value.json['errors']
+            assert 1 == len(errors)
+            assert 2 == errors[0]['line']
+            assert 'RANDID' == errors[0]['column']
+            assert 'already exists' in errors[0]['message']
+
+    def test_row_errors(self, req, db_session, check_csrf_token):
+        """
+        It should report problems with each row instead of loading them
+        """
+        import tempfile
+        import csv
+        from datetime import date
+        from pyramid.httpexceptions import HTTPBadRequest
+        from occams_datastore import models as datastore
+        from occams_studies import models
+
+        schema = datastore.Schema(
+            name='rand', title=u'Rand', publish_date=date.today(),
+            attributes={
+                'criteria': datastore.Attribute(
+                    name='criteria',
+                    title=u'Criteria',
+                    type='number',
+                    order=0)})
+
+        study = models.Study(
+            name=u'somestudy',
+            title=u'Some Study',
+            short_title=u'sstudy',
+            code=u'000',
+            is_randomized=True,
+            randomization_schema=schema,
+            consent_date=date.today())
+
+        db_session.add_all([study])
+        db_session.flush()
+
+        class DummyUpload:
+            pass
+
+        with tempfile.NamedTemporaryFile(prefix='nose-', suffix='.exe') as fp:
+            upload = DummyUpload()
+            upload.file = fp
+            upload.filename = fp.name
+
+            writer = csv.writer(fp)
+            writer.writerow([u'ARM', u'STRATA', u'BLOCKID', u'RANDID', u'CRITERIA'])  # noqa
+            writer.writerow([u'UCSD', u'hints', u'1234567', u'987654', u'12'])  # noqa
+            writer.writerow([u'UCSD', u'hints', u'notablock', u'987655', u'12'])  # noqa
+            writer.writerow([u'UCSD', u'hints', u'1234567', u'987654', u'nan?'])  # noqa
+            fp.flush()
+
+            req.POST = {'upload': upload}
+            with pytest.raises(HTTPBadRequest) as excinfo:
+                self._call_fut(study, req)
+
+        errors = excinfo.value.json['errors']
+        assert [(3, 'BLOCKID'), (4, 'CRITERIA'), (4, 'RANDID')] == \
+            sorted((e['line'], e['column']) for e in errors)
+        assert 0 == db_session.query(models.Stratum).count()
+
+    def test_large_upload(self, req, db_session, config, check_csrf_token):
+        """
+        It should load large files in the background
+        """
+        import tempfile
+        import csv
+        from datetime import date
+        import shutil
+        import mock
+        from redis import StrictRedis
+        import transaction
+        from occams_datastore import models as datastore
+        from occams_studies import models
+        from tests.conftest import REDIS_URL
+
+        schema = datastore.Schema(
+            name='rand', title=u'Rand', publish_date=date.today(),
+            attributes={
+                'criteria': datastore.Attribute(
+                    name='criteria',
+                    title=u'Criteria',
+                    type='string',
+                    order=0)})
+
+        study = models.Study(
+            name=u'somestudy',
+            title=u'Some Study',
+            short_title=u'sstudy',
+            code=u'000',
+            is_randomized=True,
+            randomization_schema=schema,
+            consent_date=date.today())
+
+        db_session.add_all([study])
+        db_session.flush()
+
+        export_dir = tempfile.mkdtemp()
+        config.registry.settings['studies.export.dir'] = export_dir
+        config.registry.settings['studies.randomization.async_size'] = '1'
+        config.testing_securitypolicy(userid='joe')
+        req.redis = StrictRedis.from_url(REDIS_URL)
+
+        class DummyUpload:
+            pass
+
+        with tempfile.NamedTemporaryFile(prefix='nose-', suffix='.exe') as fp:
+            upload = DummyUpload()
+            upload.file = fp
+            upload.filename = fp.name
+
+            writer = csv.writer(fp)
+            writer.writerow([u'ARM', u'STRATA', u'BLOCKID', u'RANDID', u'CRITERIA'])  # noqa
+            writer.writerow([u'UCSD', u'hints', u'1234567', u'987654', u'is smart'])  # noqa
+            fp.flush()
+
+            req.POST = {'upload': upload}
+            name = 'occams_studies.tasks.load_randomization'
+            with mock.patch(name) as task:
+                res = self._call_fut(study, req)
+                for hook, args, kws in transaction.get().getAfterCommitHooks():
+                    hook(True, *args, **kws)
+
+        assert 202 == req.response.status_code
+        assert task.apply_async.called
+        assert 0 == db_session.query(models.Stratum).count()
+
+        status = self._call_status(study, req, res['upload_id'])
+        assert 'pending' == status['status']
+
+        shutil.rmtree(export_dir)
+
+    def _call_status(self, context, request, upload_id):
+        from occams_studies.views.study import \
+            randomization_upload_status_json as view
+        request.matchdict['upload'] = upload_id
+        return view(context, request)
+
+
+class TestStrataJson:
+
+    def _call_fut(self, *args, **kw):
+        from occams_studies.views.study import strata_json as view
+        return view(*args, **kw)
+
+    def test_remaining_by_criteria(
+            self, req, db_session, factories, check_csrf_token):
+        """
+        It should count the unassigned strata uploaded for each criteria
+        """
+        import tempfile
+        import csv
+        from occams_studies import randomization
+        from occams_studies.views.study import upload_randomization_json
+
+        schema = factories.SchemaFactory.create(
+            attributes={
+                u'criteria': factories.AttributeFactory.create(
+                    name=u'criteria',
+                    type=u'choice',
+                    choices={
+                        u'0': factories.ChoiceFactory.create(name=u'0'),
+                        u'1': factories.ChoiceFactory.create(name=u'1'),
+                    })})
+        study = factories.StudyFactory.create(
+            is_randomized=True, randomization_schema=schema)
+        db_session.flush()
+
+        class DummyUpload:
+            pass
+
+        with tempfile.NamedTemporaryFile(prefix='nose-', suffix='.exe') as fp:
+            upload = DummyUpload()
+            upload.file = fp
+            upload.filename = fp.name
+
+            writer = csv.writer(fp)
+            writer.writerow([u'ARM', u'BLOCKID', u'RANDID', u'CRITERIA'])
+            writer.writerow([u'A', u'1', u'100', u'0'])
+            writer.writerow([u'B', u'1', u'101', u'1'])
+            writer.writerow([u'A', u'2', u'102', u'1'])
+            fp.flush()
+
+            req.POST = {'upload': upload}
+            upload_randomization_json(study, req)
+
+        res = self._call_fut(study, req)
+
+        assert [({u'criteria': u'0'}, 1), ({u'criteria': u'1'}, 2)] == \
+            [(s['criteria'], s['remaining']) for s in res['strata']]
+
+        stratum = randomization.allocate_stratum(
+            db_session, study, {'criteria': u'1'})
+        assert u'101' == stratum.randid
+
+        res = self._call_fut(study, req)
+
+        assert [1, 1] == [s['remaining'] for s in res['strata']]
+
+
+class TestAddVisitsJson:
+
+    def _call_fut(self, *args, **kw):
+        from occams_studies.views.study import add_visits_json as view
+        return view(*args, **kw)
+
+    def _setup(self, db_session):
+        from datetime import date
+        from occams_datastore import models as datastore
+        from occams_studies import models
+
+        study = models.Study(
+            name=u'somestudy',
+            title=u'Some Study',
+            short_title=u'sstudy',
+            code=u'000',
+            consent_date=date.today())
+
+        cycle = models.Cycle(name='week-1', title=u'Week 1', week=1)
+        cycle.schemata.add(datastore.Schema(
+            name='form1', title=u'', publish_date=date(2015, 1, 1)))
+        study.cycles.append(cycle)
+
+        site = models.Site(name=u'ucsd', title=u'UCSD')
+        patients = [
+            models.Patient(site=site, pid=u'P%d' % i) for i in range(3)]
+
+        db_session.add_all([study] + patients)
+        db_session.flush()
+
+        return study, patients
+
+    def test_partial_success(
+            self, req, db_session, config, check_csrf_token):
+        """
+        It should create valid visits and report problems for the rest
+        """
+        from occams_studies import models
+
+        config.testing_securitypolicy(userid='joe', permissive=True)
+        study, patients = self._setup(db_session)
+
+        req.json_body = {
+            'include_forms': True,
+            'visits': [
+                {'pid': u'P0', 'visit_date': '2015-02-01',
+                 'cycles': ['week-1']},
+                {'pid': u'P1', 'visit_date': '2015-02-01',
+                 'cycles': ['week-1']},
+                {'pid': u'P1', 'visit_date': '2015-02-02',
+                 'cycles': ['week-1']},
+                {'pid': u'XXX', 'visit_date': '2015-02-01',
+                 'cycles': ['week-1']},
+                {'pid': u'P2', 'visit_date': 'foo',
+                 'cycles': ['week-1']},
+            ]}
+
+        res = self._call_fut(study, req)
+
+        assert ['created', 'created', 'error', 'error', 'error'] == \
+            [r['status'] for r in res['results']]
+
+        visit = db_session.query(models.Visit).get(res['results'][0]['id'])
+        assert visit.patient.pid == u'P0'
+        assert [u'week-1'] == [c.name for c in visit.cycles]
+        assert [u'form1'] == [e.schema.name for e in visit.entities]
+
+    def test_existing_visit(
+            self, req, db_session, config, check_csrf_token):
+        """
+        It should not schedule visits that already exist
+        """
+        from datetime import date
+        from occams_studies import models
+
+        config.testing_securitypolicy(userid='joe', permissive=True)
+        study, patients = self._setup(db_session)
+        db_session.add(models.Visit(
+            patient=patients[0],
+            visit_date=date(2015, 2, 1),
+            cycles=[study.cycles[0]]))
+        db_session.flush()
+
+        req.json_body = {
+            'visits': [
+                {'pid': u'P0', 'visit_date': '2015-02-01',
+                 'cycles': ['week-1']},
+                {'pid': u'P0', 'visit_date': '2015-03-01',
+                 'cycles': ['week-1']},
+            ]}
+
+        res = self._call_fut(study, req)
+
+        assert ['error', 'error'] == [r['status'] for r in res['results']]
+
+    def test_not_allowed(
+            self, req, db_session, config, check_csrf_token):
+        """
+        It should not schedule visits for sites the user cannot add to
+        """
+        config.testing_securitypolicy(userid='joe', permissive=False)
+        study, patients = self._setup(db_session)
+
+        req.json_body = {
+            'visits': [
+                {'pid': u'P0', 'visit_date': '2015-02-01',
+                 'cycles': ['week-1']},
+            ]}
+
+        res = self._call_fut(study, req)
+
+        assert 'error' == res['results'][0]['status']
+
+    def test_large_batch(
+            self, req, db_session, config, check_csrf_token):
+        """
+        It should create large batches in the background
+        """
+        import mock
+        from redis import StrictRedis
+        import transaction
+        from tests.conftest import REDIS_URL
+
+        config.testing_securitypolicy(userid='joe', permissive=True)
+        config.registry.settings['studies.visits.async_count'] = '1'
+        req.redis = StrictRedis.from_url(REDIS_URL)
+        study, patients = self._setup(db_session)
+
+        req.json_body = {
+            'visits': [
+                {'pid': p.pid, 'visit_date': '2015-02-01',
+                 'cycles': ['week-1']} for p in patients]}
+
+        name = 'occams_studies.tasks.schedule_visits'
+        with mock.patch(name) as task:
+            res = self._call_fut(study, req)
+            for hook, args, kws in transaction.get().getAfterCommitHooks():
+                hook(True, *args, **kws)
+
+        assert 202 == req.response.status_code
+        assert ['pending'] * 3 == [r['status'] for r in res['results']]
+        assert task.apply_async.called
+
+        from occams_studies.views.study import visit_batch_status_json
+        req.matchdict['batch'] = res['batch_id']
+        status = visit_batch_status_json(study, req)
+        assert 'pending' == status['status']
+        assert 3 == status['total']
+
+
+class TestGetStudyMenu:
+
+    @pytest.fixture(autouse=True)
+    def redis(self, req):
+        from redis import StrictRedis
+        from tests.conftest import REDIS_URL
+        from occams_studies.views.study import study_menu_cache
+        req.redis = StrictRedis.from_url(REDIS_URL)
+        # Start each test with a version that has never been cached
+        study_menu_cache.invalidate(req.redis)
+
+    def _call_fut(self, *args, **kw):
+        from occams_studies.views.study import get_study_menu
+        return get_study_menu(*args, **kw)
+
+    def test_cached(self, req, db_session, factories):
+        """
+        It should not query the database once the menu is cached
+        """
+        study = factories.StudyFactory.create()
+        db_session.flush()
+
+        first = self._call_fut(req)
+
+        factories.StudyFactory.create()
+        db_session.flush()
+
+        second = self._call_fut(req)
+
+        assert [study.name] == [s.name for s in first]
+        assert first == second
+
+    def test_invalidate(self, req, db_session, factories):
+        """
+        It should reload the menu after an invalidation
+        """
+        from occams_studies.views.study import study_menu_cache
+
+        factories.StudyFactory.create()
+        db_session.flush()
+        self._call_fut(req)
+
+        factories.StudyFactory.create()
+        db_session.flush()
+        study_menu_cache.invalidate(req.redis)
+
+        assert 2 == len(self._call_fut(req))
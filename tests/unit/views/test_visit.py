@@ -393,6 +393,71 @@ class Test_edit_json:
                        for x in ('patient', 'visit')]) == \
             sorted([(c.external, c.entity_id) for c in contexts])
 
+    def test_include_forms_query_count(
+            self, req, db_session, check_csrf_token):
+        """
+        It should create cycle forms with a fixed number of statements
+        """
+        from datetime import date, timedelta
+        import sqlalchemy as sa
+        from occams_datastore import models as datastore
+        from occams_studies import models
+
+        study = models.Study(
+            name=u'somestudy',
+            title=u'Some Study',
+            short_title=u'sstudy',
+            code=u'000',
+            consent_date=date.today())
+
+        cycle1 = models.Cycle(name='week-1', title=u'', week=1)
+        cycle2 = models.Cycle(name='week-2', title=u'', week=2)
+
+        cycle1.schemata.add(datastore.Schema(
+            name='form0', title=u'', publish_date=date.today()))
+
+        for i in range(1, 11):
+            cycle2.schemata.add(datastore.Schema(
+                name='form%d' % i, title=u'', publish_date=date.today()))
+
+        study.cycles.extend([cycle1, cycle2])
+
+        patient = models.Patient(
+            site=models.Site(name=u'ucsd', title=u'UCSD'),
+            pid=u'12345')
+
+        db_session.add_all([patient, study])
+        db_session.flush()
+
+        def count_statements(cycle, days):
+            statements = []
+
+            def count(conn, cursor, statement, *args):
+                if statement.startswith('INSERT INTO entity'):
+                    statements.append(statement)
+
+            req.json_body = {
+                'cycles': [cycle.id],
+                'visit_date': str(date.today() + timedelta(days=days)),
+                'include_forms': True
+            }
+
+            engine = db_session.bind
+            sa.event.listen(engine, 'before_cursor_execute', count)
+            try:
+                res = self._call_fut(patient['visits'], req)
+            finally:
+                sa.event.remove(engine, 'before_cursor_execute', count)
+
+            return res, statements
+
+        res1, statements1 = count_statements(cycle1, 1)
+        res10, statements10 = count_statements(cycle2, 2)
+
+        assert 1 == len(res1['entities'])
+        assert 10 == len(res10['entities'])
+        assert 1 == len(statements1) == len(statements10)
+
     def test_include_relative_form(
             self, req, db_session, check_csrf_token, factories):
         """